@@ -0,0 +1,63 @@
+"""status history
+
+Revision ID: 8e2b6a1c4d57
+Revises: 41478f285a90
+Create Date: 2017-06-12 10:21:37.481204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8e2b6a1c4d57'
+down_revision = '41478f285a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # monthly partitions are created by the status monitor as required. Declarative partitioning needs
+    # PostgreSQL 10 or later, older servers get a plain (indexed) table
+    partitioned = int(op.get_bind().execute('SHOW server_version_num').scalar()) >= 100000
+    op.execute("""
+        CREATE TABLE status_transition (
+            deployed_stream_id INTEGER NOT NULL,
+            reference_designator_id INTEGER NOT NULL,
+            transition_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            previous_status VARCHAR NOT NULL,
+            status VARCHAR NOT NULL,
+            elapsed_seconds FLOAT
+        ) {}
+    """.format('PARTITION BY RANGE (transition_time)' if partitioned else ''))
+    if not partitioned:
+        op.create_index('status_transition_deployed_idx', 'status_transition',
+                        ['deployed_stream_id', 'transition_time'])
+        op.create_index('status_transition_refdes_idx', 'status_transition',
+                        ['reference_designator_id', 'transition_time'])
+    op.create_table('stream_status_daily',
+                    sa.Column('deployed_stream_id', sa.Integer(), nullable=False),
+                    sa.Column('day', sa.Date(), nullable=False),
+                    sa.Column('status', sa.String(), nullable=False),
+                    sa.Column('seconds', sa.Float(), nullable=False),
+                    sa.PrimaryKeyConstraint('deployed_stream_id', 'day', 'status')
+                    )
+    op.create_table('instrument_status_daily',
+                    sa.Column('reference_designator_id', sa.Integer(), nullable=False),
+                    sa.Column('day', sa.Date(), nullable=False),
+                    sa.Column('status', sa.String(), nullable=False),
+                    sa.Column('seconds', sa.Float(), nullable=False),
+                    sa.PrimaryKeyConstraint('reference_designator_id', 'day', 'status')
+                    )
+    op.create_table('status_accrual',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('accrued_until', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+
+
+def downgrade():
+    op.drop_table('status_accrual')
+    op.drop_table('instrument_status_daily')
+    op.drop_table('stream_status_daily')
+    # drops every monthly partition as well
+    op.execute('DROP TABLE status_transition')
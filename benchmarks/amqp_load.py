@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Load generator and throughput benchmark for AmqpStatsClient.
+
+Publishes realistic port_agent_stats messages for many reference designators at a fixed rate and
+consumes them with AmqpStatsClient, reporting sustained ingest rate, commit latency and backlog growth.
+By default kombu's in-memory transport is used so no broker is required:
+
+    python benchmarks/amqp_load.py --refdes 5000 --rate 2000 --duration 60
+    python benchmarks/amqp_load.py --broker-url amqp://localhost --rate 500
+
+The monitor database named by --monitor-url is DROPPED and recreated.
+"""
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import click
+from kombu import Connection, Queue
+from sqlalchemy import create_engine
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from ooi_data.postgres import model
+
+from ooi_status import amqp_client
+from ooi_status.metrics import monotonic
+from synthetic_fleet import refdes_name
+
+DEFAULT_MONITOR_URL = 'postgresql+psycopg2://monitor@localhost/monitor_bench'
+QUEUE = 'port_agent_stats_bench'
+
+
+def make_stats_message(refdes, end_time, elapsed, byte_rate, clients):
+    """
+    Build a port agent statistics message as published by the port agents
+    :param refdes: reference designator
+    :param end_time: unix time at the end of the reporting interval
+    :param elapsed: length of the reporting interval in seconds
+    :param byte_rate: bytes per second received from the instrument
+    :param clients: number of connected clients
+    """
+    bytes_in = int(byte_rate * elapsed)
+    return {
+        'reference_designator': refdes,
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_in * clients,
+        'num_clients': {'client': clients},
+        'adds': 0,
+        'end_time': end_time,
+        'elapsed': elapsed,
+    }
+
+
+class LoadGenerator(object):
+    """
+    Publish messages round-robin over a set of reference designators at a fixed rate
+    """
+    def __init__(self, url, queue, refdes_count, rate, interval, seed=0):
+        rng = random.Random(seed)
+        self.connection = Connection(url)
+        self.queue = Queue(name=queue, channel=self.connection)
+        self.producer = self.connection.Producer()
+        self.refdes = [refdes_name(index) for index in range(refdes_count)]
+        self.byte_rates = [rng.uniform(10, 5000) for _ in self.refdes]
+        self.clients = [rng.randint(1, 3) for _ in self.refdes]
+        self.rate = rate
+        self.interval = interval
+        self.published = 0
+        self.stopped = threading.Event()
+
+    def publish_one(self):
+        index = self.published % len(self.refdes)
+        body = make_stats_message(self.refdes[index], time.time(), self.interval, self.byte_rates[index],
+                                  self.clients[index])
+        self.producer.publish(json.dumps(body), routing_key=self.queue.name, declare=[self.queue],
+                              content_type='text/plain', content_encoding='utf-8')
+        self.published += 1
+
+    def run(self, duration):
+        start = monotonic()
+        while not self.stopped.is_set():
+            elapsed = monotonic() - start
+            if elapsed >= duration:
+                break
+            # publish whatever is due, then sleep until the next message is due
+            due = int(elapsed * self.rate)
+            while self.published < due:
+                self.publish_one()
+            time.sleep(min(1.0 / self.rate, 0.01))
+
+
+def histogram_summary(histogram):
+    value = histogram.labels()
+    counts = list(value.counts)
+    total = value.sum
+    count = value.count
+
+    def quantile(q):
+        target = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(value.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+    return {
+        'count': count,
+        'mean': total / count if count else None,
+        'p50_upper_bound': quantile(0.5) if count else None,
+        'p99_upper_bound': quantile(0.99) if count else None,
+    }
+
+
+@click.command()
+@click.option('--monitor-url', default=DEFAULT_MONITOR_URL, help='Monitor database (dropped and recreated)')
+@click.option('--broker-url', default='memory://', help='kombu broker URL')
+@click.option('--refdes', 'refdes_count', default=1000, help='Number of reference designators')
+@click.option('--rate', default=1000, help='Messages published per second')
+@click.option('--duration', default=30, help='Seconds to publish for')
+@click.option('--interval', default=60.0, help='Port agent reporting interval (message elapsed field)')
+@click.option('--drain-timeout', default=60, help='Seconds to wait for the backlog to drain after publishing')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results to this JSON file')
+def main(monitor_url, broker_url, refdes_count, rate, duration, interval, drain_timeout, output):
+    engine = create_engine(monitor_url)
+    model.create_database(engine, drop=True)
+
+    generator = LoadGenerator(broker_url, QUEUE, refdes_count, rate, interval)
+    client = amqp_client.AmqpStatsClient(broker_url, QUEUE, engine)
+    consumer_thread = client.start_thread()
+
+    def consumed():
+        return amqp_client.MESSAGES.labels().value
+
+    publisher = threading.Thread(target=generator.run, args=(duration,))
+    publisher.setDaemon(True)
+
+    samples = []
+    start = monotonic()
+    publisher.start()
+    while publisher.is_alive():
+        time.sleep(1)
+        samples.append({'t': monotonic() - start, 'published': generator.published, 'consumed': consumed(),
+                        'backlog': generator.published - consumed()})
+        click.echo('%(t)6.1fs published=%(published)d consumed=%(consumed)d backlog=%(backlog)d' % samples[-1])
+
+    publish_end = monotonic()
+    while consumed() < generator.published and monotonic() - publish_end < drain_timeout:
+        time.sleep(0.1)
+    end = monotonic()
+
+    client.should_stop = True
+    consumer_thread.join(5)
+
+    backlog_growth = 0
+    if len(samples) > 1:
+        backlog_growth = (samples[-1]['backlog'] - samples[0]['backlog']) / (samples[-1]['t'] - samples[0]['t'])
+
+    results = {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'parameters': {'broker_url': broker_url, 'refdes': refdes_count, 'rate': rate, 'duration': duration},
+        'published': generator.published,
+        'consumed': consumed(),
+        'drained': consumed() >= generator.published,
+        'publish_rate': generator.published / (publish_end - start),
+        'sustained_ingest_rate': consumed() / (end - start),
+        'backlog_growth_per_second': backlog_growth,
+        'commit_seconds': histogram_summary(amqp_client.COMMIT_SECONDS),
+        'samples': samples,
+    }
+
+    click.echo(json.dumps({key: value for key, value in results.items() if key != 'samples'},
+                          indent=2, sort_keys=True))
+    if output:
+        with open(output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Time the status monitor and HTTP API against synthetic fleets of increasing size.
+
+    python benchmarks/run_benchmarks.py --scale 100 --scale 1000 --output results.json
+    python benchmarks/run_benchmarks.py --scale 100 --compare results.json
+
+The monitor and metadata databases named on the command line are DROPPED and recreated for every scale.
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+
+import click
+from six.moves import BaseHTTPServer
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from ooi_data.postgres import model
+
+from ooi_status.metadata_queries import find_instrument_availability
+from ooi_status.metrics import monotonic
+from ooi_status.status_monitor import StatusMonitor
+from synthetic_fleet import FleetSpec, load_fleet, refdes_name
+
+DEFAULT_MONITOR_URL = 'postgresql+psycopg2://monitor@localhost/monitor_bench'
+DEFAULT_METADATA_URL = 'postgresql+psycopg2://awips@localhost/metadata_bench'
+PENDING_UPDATES = 200
+AVAILABILITY_SAMPLES = 10
+
+
+class _EventsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Accepts every status event post, standing in for the uFrame events API
+    """
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"id": 1}'
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # noinspection PyShadowingBuiltins
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_events_server():
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _EventsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+
+def timed(func, repeat):
+    """
+    Call func repeat times
+    :return: dictionary of min/median/max elapsed seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = monotonic()
+        func()
+        times.append(monotonic() - start)
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1], 'repeat': repeat}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=here).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_settings(monitor_url, metadata_url, events_port):
+    handle, path = tempfile.mkstemp(suffix='.py', prefix='ooi_status_bench_')
+    with os.fdopen(handle, 'w') as fh:
+        fh.write('MONITOR_URL = %r\n' % monitor_url)
+        fh.write('METADATA_URL = %r\n' % metadata_url)
+        fh.write('NOTIFY_URL_ROOT = %r\n' % 'http://127.0.0.1')
+        fh.write('NOTIFY_URL_PORT = %d\n' % events_port)
+        fh.write('RESAMPLE_WINDOW_START_HOURS = 24\n')
+        fh.write('RESAMPLE_WINDOW_END_HOURS = 0\n')
+    return path
+
+
+def run_scale(spec, config, app, repeat):
+    load_fleet(spec, config['MONITOR_URL'], config['METADATA_URL'])
+    monitor = StatusMonitor(config)
+    results = {}
+
+    # the first cycle creates every deployed stream, later cycles are the steady state
+    results['check_all_cold'] = timed(monitor.check_all, 1)
+    results['check_all'] = timed(monitor.check_all, repeat)
+
+    def notify():
+        with monitor.session.begin():
+            for index in range(PENDING_UPDATES):
+                monitor.session.add(model.PendingUpdate(message={'assetUid': 'SYN-%05d-0' % index},
+                                                         error_count=0))
+        monitor.notify_all()
+    results['notify_all_%d' % PENDING_UPDATES] = timed(notify, repeat)
+
+    samples = [refdes_name(index) for index in range(0, spec.size, max(spec.size // AVAILABILITY_SAMPLES, 1))]
+
+    def availability():
+        for refdes in samples:
+            find_instrument_availability(monitor.metadata_session, refdes)
+    results['find_instrument_availability_x%d' % len(samples)] = timed(availability, repeat)
+
+    results['resample_count_data_hourly'] = timed(monitor.resample_count_data_hourly, 1)
+
+    client = app.test_client()
+    endpoints = ['/instrument', '/stream', '/expected', '/available/%s' % samples[0]]
+    for endpoint in endpoints:
+        def request():
+            response = client.get(endpoint)
+            response.get_data()
+            assert response.status_code == 200, (endpoint, response.status_code)
+        results['GET %s' % endpoint.split('/')[1]] = timed(request, repeat)
+
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """
+    Print the ratio of current to baseline median times
+    :return: list of (scale, benchmark) pairs which regressed by more than tolerance
+    """
+    regressions = []
+    for scale, results in sorted(current['scales'].items(), key=lambda item: int(item[0])):
+        base_results = baseline['scales'].get(scale)
+        if base_results is None:
+            continue
+        for name, timing in sorted(results.items()):
+            if name not in base_results:
+                continue
+            ratio = timing['median'] / max(base_results[name]['median'], 1e-9)
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = 'REGRESSION'
+                regressions.append((scale, name))
+            click.echo('%8s %-40s %10.4f %10.4f %7.2fx %s' % (scale, name, base_results[name]['median'],
+                                                              timing['median'], ratio, flag))
+    return regressions
+
+
+@click.command()
+@click.option('--monitor-url', default=DEFAULT_MONITOR_URL, help='Monitor database (dropped and recreated)')
+@click.option('--metadata-url', default=DEFAULT_METADATA_URL, help='Metadata database (dropped and recreated)')
+@click.option('--scale', type=int, multiple=True, help='Number of reference designators (repeatable)')
+@click.option('--streams', default=4, help='Streams per instrument')
+@click.option('--days', default=30, help='Days of partition metadata')
+@click.option('--gap-probability', default=0.05, help='Probability a daily partition is missing')
+@click.option('--repeat', default=3, help='Timed repetitions per benchmark')
+@click.option('--seed', default=0, help='Random seed for fleet generation')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results to this JSON file')
+@click.option('--compare', 'baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Compare results with a previous JSON results file')
+@click.option('--tolerance', default=0.2, help='Allowed slowdown relative to the baseline before failing')
+def main(monitor_url, metadata_url, scale, streams, days, gap_probability, repeat, seed, output, baseline,
+         tolerance):
+    scales = scale or (100, 1000)
+    events_server = start_stub_events_server()
+    os.environ['OOISTATUS_SETTINGS'] = write_settings(monitor_url, metadata_url, events_server.server_address[1])
+
+    # the API reads its configuration at import time
+    from ooi_status.api import app
+
+    results = {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'parameters': {'streams': streams, 'days': days, 'gap_probability': gap_probability, 'seed': seed},
+        'scales': {},
+    }
+
+    for size in scales:
+        spec = FleetSpec(size, streams_per_instrument=streams, days=days, gap_probability=gap_probability,
+                         seed=seed)
+        click.echo('Running benchmarks for %d reference designators' % size)
+        results['scales'][str(size)] = run_scale(spec, app.config, app, repeat)
+
+    if output:
+        with open(output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    if baseline:
+        with open(baseline) as fh:
+            regressions = compare(results, json.load(fh), tolerance)
+        if regressions:
+            sys.exit(1)
+    else:
+        click.echo(json.dumps(results['scales'], indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Generate and load reproducible synthetic fleets into local monitor and metadata databases.
+
+A fleet consists of reference designators, the streams each one produces, deployments and
+assets, partition and stream metadata with a controllable pattern of gaps, and port counts.
+The same seed and parameters always produce the same fleet.
+"""
+import datetime
+import random
+
+from ooi_data.postgres import model
+from sqlalchemy import create_engine
+from sqlalchemy_utils import database_exists, create_database
+
+STREAM_POOL = [
+    ('ctdbp_no_sample', 'streamed', 120, 600),
+    ('adcp_velocity_beam', 'streamed', 120, 600),
+    ('adcp_engineering', 'streamed', 1200, 2400),
+    ('nutnr_a_sample', 'streamed', 7200, 14400),
+    ('botpt_nano_sample', 'streamed', 60, 300),
+    ('flort_d_data_record', 'telemetered', 3600, 7200),
+    ('optaa_sample', 'streamed', 900, 1800),
+    ('do_stable_sample', 'telemetered', 0, 0),
+]
+
+INSERT_BATCH = 5000
+
+# tables are loaded in dependency order
+LOAD_ORDER = [
+    model.ExpectedStream,
+    model.ReferenceDesignator,
+    model.PortCount,
+    model.Xasset,
+    model.Xdeployment,
+    model.StreamMetadatum,
+    model.PartitionMetadatum,
+]
+
+
+class FleetSpec(object):
+    """
+    Parameters describing a synthetic fleet
+    :param size: number of reference designators
+    :param streams_per_instrument: number of streams produced by each instrument
+    :param days: days of partition metadata to generate
+    :param gap_probability: probability that any daily partition is missing
+    :param stale_fraction: fraction of streams whose last particle is old enough to be degraded or failed
+    :param port_hours: hours of per-minute port counts to generate for each instrument
+    :param seed: random seed
+    """
+    def __init__(self, size, streams_per_instrument=4, days=30, gap_probability=0.05, stale_fraction=0.1,
+                 port_hours=2, seed=0):
+        self.size = size
+        self.streams_per_instrument = min(streams_per_instrument, len(STREAM_POOL))
+        self.days = days
+        self.gap_probability = gap_probability
+        self.stale_fraction = stale_fraction
+        self.port_hours = port_hours
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def refdes_parts(index):
+    return 'SYNT%04d' % (index // 10), 'ND%03d' % (index % 10), '01-SENSR%05d' % index
+
+
+def refdes_name(index):
+    return '-'.join(refdes_parts(index))
+
+
+def prepare_database(url, metadata):
+    engine = create_engine(url)
+    if not database_exists(engine.url):
+        create_database(engine.url, template='template_postgis')
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    return engine
+
+
+def _insert(engine, table, rows):
+    for index in range(0, len(rows), INSERT_BATCH):
+        engine.execute(table.insert(), rows[index:index + INSERT_BATCH])
+
+
+def generate(spec, now=None):
+    """
+    Generate the rows for a fleet
+    :return: dictionary mapping model class to a list of row dictionaries
+    """
+    rng = random.Random(spec.seed)
+    if now is None:
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+    start = now - datetime.timedelta(days=spec.days)
+
+    rows = {
+        model.ExpectedStream: [],
+        model.Xasset: [],
+        model.Xdeployment: [],
+        model.StreamMetadatum: [],
+        model.PartitionMetadatum: [],
+        model.ReferenceDesignator: [],
+        model.PortCount: [],
+    }
+
+    for stream, method, warn, fail in STREAM_POOL:
+        rows[model.ExpectedStream].append({'name': stream, 'method': method, 'expected_rate': 0,
+                                           'warn_interval': warn, 'fail_interval': fail})
+
+    for index in range(spec.size):
+        subsite, node, sensor = refdes_parts(index)
+        refdes_id = index + 1
+
+        # one or two deployments, the most recent of which is still active
+        deployments = rng.randint(1, 2)
+        boundaries = sorted(start + datetime.timedelta(days=rng.uniform(0, spec.days))
+                            for _ in range(deployments - 1))
+        starts = [start] + boundaries
+        stops = boundaries + [None]
+        for number, (deploy_start, deploy_stop) in enumerate(zip(starts, stops)):
+            asset_id = index * 2 + number + 1
+            rows[model.Xasset].append({'assetid': asset_id, 'uid': 'SYN-%05d-%d' % (index, number)})
+            rows[model.Xdeployment].append({'subsite': subsite, 'node': node, 'sensor': sensor,
+                                            'deploymentnumber': number + 1, 'sassetid': asset_id,
+                                            'eventstarttime': deploy_start, 'eventstoptime': deploy_stop})
+
+        for stream, method, warn, fail in rng.sample(STREAM_POOL, spec.streams_per_instrument):
+            interval = max(warn, 60) / 4.0
+            count_per_day = int(86400 / interval)
+            first = None
+            last = None
+            total = 0
+            for day in range(spec.days):
+                if rng.random() < spec.gap_probability:
+                    continue
+                bin_start = start + datetime.timedelta(days=day)
+                bin_last = bin_start + datetime.timedelta(seconds=86400 - interval)
+                rows[model.PartitionMetadatum].append({'subsite': subsite, 'node': node, 'sensor': sensor,
+                                                       'method': method, 'stream': stream, 'bin': day,
+                                                       'first': bin_start, 'last': bin_last,
+                                                       'count': count_per_day})
+                first = first or bin_start
+                last = bin_last
+                total += count_per_day
+
+            if first is None:
+                continue
+
+            # most streams are current, some are stale by varying amounts
+            if rng.random() < spec.stale_fraction:
+                last = now - datetime.timedelta(seconds=rng.uniform(warn, 3 * max(fail, 60)))
+            else:
+                last = now - datetime.timedelta(seconds=rng.uniform(0, interval))
+            rows[model.StreamMetadatum].append({'subsite': subsite, 'node': node, 'sensor': sensor,
+                                                'method': method, 'stream': stream, 'first': first,
+                                                'last': last, 'count': total})
+
+        rows[model.ReferenceDesignator].append({'id': refdes_id, 'name': refdes_name(index)})
+        rate = rng.uniform(10, 5000)
+        for minute in range(spec.port_hours * 60):
+            rows[model.PortCount].append({'reference_designator_id': refdes_id,
+                                          'collected_time': now - datetime.timedelta(minutes=minute),
+                                          'byte_count': int(rate * 60), 'seconds': 60.0})
+
+    return rows
+
+
+def load_fleet(spec, monitor_url, metadata_url):
+    """
+    Drop and recreate the monitor and metadata schemas, then load a freshly generated fleet
+    :return: (monitor engine, metadata engine, generated rows)
+    """
+    monitor_engine = prepare_database(monitor_url, model.MonitorBase.metadata)
+    metadata_engine = prepare_database(metadata_url, model.MetadataBase.metadata)
+
+    rows = generate(spec)
+    for cls in LOAD_ORDER:
+        engine = monitor_engine if cls.__table__.metadata is model.MonitorBase.metadata else metadata_engine
+        _insert(engine, cls.__table__, rows[cls])
+
+    # explicit ids were supplied for reference designators, move the sequence past them
+    monitor_engine.execute("SELECT setval('reference_designator_id_seq', "
+                           "(SELECT max(id) FROM reference_designator))")
+    return monitor_engine, metadata_engine, rows
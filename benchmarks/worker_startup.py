@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Import time and memory of an API worker.
+
+Each measurement runs in a fresh interpreter. The import of ooi_status.api is timed as it is now (lazy) and
+with pandas, numpy and dateutil imported up front as they used to be (eager). The memory of a set of workers
+is then compared when each worker imports the application itself and when the workers are forked from a
+preloaded master as with gunicorn.conf.py, using the private (unshared) memory of every process:
+
+    python benchmarks/worker_startup.py --workers 4 --repeat 5 --output startup.json
+
+No database is needed, the engines are created without connecting. Private memory is read from /proc and is
+only reported on Linux.
+"""
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+import click
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+EAGER_MODULES = ['numpy', 'pandas', 'dateutil.parser']
+HEAVY_MODULES = ['numpy', 'pandas', 'dateutil', 'gevent']
+
+_PRELUDE = '''
+import json, os, resource, sys, time
+
+def private_kb():
+    try:
+        with open('/proc/self/smaps') as fh:
+            return sum(int(line.split()[1]) for line in fh if line.startswith(('Private_Clean', 'Private_Dirty')))
+    except (IOError, OSError):
+        return None
+
+eager = %(eager)r
+heavy = %(heavy)r
+start = time.time()
+for name in eager:
+    __import__(name)
+from ooi_status.api import app, init_engines
+import_seconds = time.time() - start
+'''
+
+_IMPORT = _PRELUDE + '''
+init_engines(app)
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'private_kb': private_kb(),
+    'heavy_modules': [name for name in heavy if name in sys.modules],
+}))
+'''
+
+_PRELOAD = _PRELUDE + '''
+master_kb = private_kb()
+workers = []
+for _ in range(%(workers)d):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        init_engines(app)
+        os.write(write_fd, json.dumps(private_kb()).encode('ascii'))
+        os._exit(0)
+    os.close(write_fd)
+    workers.append((pid, read_fd))
+worker_kb = []
+for pid, read_fd in workers:
+    worker_kb.append(json.loads(os.read(read_fd, 64).decode('ascii')))
+    os.waitpid(pid, 0)
+print(json.dumps({'master_kb': master_kb, 'worker_kb': worker_kb}))
+'''
+
+
+def run_snippet(snippet):
+    env = dict(os.environ, OOISTATUS_DEFER_ENGINES='1')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(here), env.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, '-c', snippet], env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure_import(eager, repeat):
+    """
+    :return: median import seconds and maximum RSS of a fresh interpreter importing the application
+    """
+    runs = [run_snippet(_IMPORT % {'eager': eager, 'heavy': HEAVY_MODULES}) for _ in range(repeat)]
+    return {
+        'import_seconds': median([run['import_seconds'] for run in runs]),
+        'max_rss_kb': median([run['max_rss_kb'] for run in runs]),
+        'private_kb': runs[-1]['private_kb'],
+        'heavy_modules': runs[-1]['heavy_modules'],
+    }
+
+
+def measure_workers(eager, workers):
+    """
+    :return: total private memory of a master and its workers, with and without preloading the application
+    """
+    independent = [run_snippet(_IMPORT % {'eager': eager, 'heavy': HEAVY_MODULES})['private_kb']
+                   for _ in range(workers)]
+    preloaded = run_snippet(_PRELOAD % {'eager': eager, 'heavy': HEAVY_MODULES, 'workers': workers})
+    if None in independent or preloaded['master_kb'] is None:
+        return None
+    return {
+        'independent_total_kb': sum(independent),
+        'independent_worker_kb': median(independent),
+        'preloaded_total_kb': preloaded['master_kb'] + sum(preloaded['worker_kb']),
+        'preloaded_worker_kb': median(preloaded['worker_kb']),
+    }
+
+
+@click.command()
+@click.option('--workers', default=4, help='Number of workers to compare')
+@click.option('--repeat', default=5, help='Fresh interpreters per import measurement (the median is reported)')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results to this JSON file')
+def main(workers, repeat, output):
+    results = {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'python': sys.version.split()[0],
+        'parameters': {'workers': workers, 'repeat': repeat},
+    }
+    for name, eager in (('lazy', []), ('eager', EAGER_MODULES)):
+        results[name] = measure_import(eager, repeat)
+        results[name]['workers'] = measure_workers(eager, workers)
+
+    lazy, eager = results['lazy'], results['eager']
+    results['import_seconds_saved'] = eager['import_seconds'] - lazy['import_seconds']
+    results['max_rss_kb_saved'] = eager['max_rss_kb'] - lazy['max_rss_kb']
+    if lazy['workers'] and eager['workers']:
+        results['preload_kb_saved'] = (lazy['workers']['independent_total_kb'] -
+                                       lazy['workers']['preloaded_total_kb'])
+
+    click.echo(json.dumps(results, indent=2, sort_keys=True))
+    if output:
+        with open(output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""
+Gunicorn settings for the status API (see run_gunicorn.sh).
+
+The application is imported once in the master and the workers share its memory copy-on-write. Database engines
+are created in each worker after the fork, so no connection pool is ever shared between processes.
+"""
+import os
+
+os.environ.setdefault('OOISTATUS_DEFER_ENGINES', '1')
+
+if 'PSYCOGREEN' in os.environ:
+    # patch before the application is preloaded, the gevent workers would otherwise only patch after forking,
+    # leaving modules imported in the master holding the blocking socket and threading functions
+    from gevent.monkey import patch_all
+    patch_all()
+
+bind = '0.0.0.0:9000'
+workers = 2
+worker_class = 'gevent'
+preload_app = True
+logconfig = 'logging.conf'
+
+
+def post_fork(server, worker):
+    from ooi_status.api import app, init_engines
+    init_engines(app)
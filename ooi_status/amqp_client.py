@@ -1,5 +1,6 @@
 import json
 import datetime
+import time
 
 from logging import getLogger
 from threading import Thread
@@ -8,31 +9,90 @@ from kombu.mixins import ConsumerMixin
 from kombu import Connection, Queue
 from sqlalchemy.orm import sessionmaker
 
-from ooi_data.postgres.model import PortCount, ReferenceDesignator
+from ooi_data.postgres.model import PendingUpdate, PortCount
+
+from . import metrics, sql_stats
+from .queries import get_expected_port_rates, get_rollup_status
+from .rate_detector import RateDetector
+from .status_message import RateStatusMessage
+from .stream_cache import StreamCache
 
 log = getLogger(__name__)
 
+MESSAGES = metrics.counter('ooi_status_amqp_messages_total', 'Port agent statistics messages ingested')
+BYTES = metrics.counter('ooi_status_amqp_bytes_total', 'Port agent bytes_in reported by ingested messages')
+COMMIT_SECONDS = metrics.histogram('ooi_status_amqp_commit_seconds', 'Time to store one port agent message')
+LAG_SECONDS = metrics.gauge('ooi_status_amqp_lag_seconds',
+                            'Delay between the end of a port agent interval and its ingestion')
+
 
 class AmqpStatsClient(ConsumerMixin):
-    def __init__(self, url, queue, engine):
-        self.engine = engine
+    """
+    Store port agent statistics messages as port counts
+    :param detector: optional RateDetector, rate status changes are staged as pending updates
+    :param uid_resolver: callable returning the asset uid of a reference designator, required to stage updates
+    :param rate_status: True if the status monitor reports the port data rate of instruments with an expected
+                        rate (RATE_STATUS). Their rate events are then left to the monitor rather than staged.
+    :param on_rate_event: called with each RateEvent left to the monitor, once its port count is committed
+    :param expected_refresh_seconds: seconds between reloads of the expected port rates used by the detector
+    :param stream_cache: StreamCache resolving reference designator ids (shared with the monitor if given)
+    """
+    def __init__(self, url, queue, engine, slow_seconds=None, detector=None, uid_resolver=None, rate_status=False,
+                 on_rate_event=None, expected_refresh_seconds=300, stream_cache=None):
+        self.engine = sql_stats.instrument_engine(engine, 'amqp', slow_seconds=slow_seconds)
         self.session_factory = sessionmaker(bind=engine, autocommit=True)
         self.session = self.session_factory()
-        self._refdes_cache = {}
+        self.stream_cache = stream_cache if stream_cache is not None else StreamCache()
+        self.detector = detector
+        self.uid_resolver = uid_resolver
+        self.rate_status = rate_status
+        self.on_rate_event = on_rate_event
+        self.expected_refresh_seconds = expected_refresh_seconds
+        self._expected_loaded = None
         self._queue_name = queue
         self.connection = Connection(url)
         self.queue = Queue(name=self._queue_name, channel=self.connection)
 
-    def _get_or_create_refdes(self, reference_designator):
-        if reference_designator not in self._refdes_cache:
-            refdes = self.session.query(ReferenceDesignator).filter(
-                ReferenceDesignator.name == reference_designator).first()
-            if refdes is None:
-                refdes = ReferenceDesignator(name=reference_designator)
-                self.session.add(refdes)
-                self.session.flush()
-            self._refdes_cache[reference_designator] = refdes
-        return self._refdes_cache[reference_designator]
+    @classmethod
+    def from_config(cls, config, engine, stream_cache=None, uid_resolver=None, on_rate_event=None):
+        """
+        Build a client for AMQP_URL / AMQP_QUEUE with the rate detector enabled by RATE_DETECTOR
+        """
+        return cls(config['AMQP_URL'], config['AMQP_QUEUE'], engine, slow_seconds=config.get('SQL_SLOW_SECONDS'),
+                   detector=RateDetector.from_config(config), uid_resolver=uid_resolver,
+                   rate_status=bool(config.get('RATE_STATUS')), on_rate_event=on_rate_event,
+                   expected_refresh_seconds=config.get('RATE_EXPECTED_REFRESH_SECONDS', 300),
+                   stream_cache=stream_cache)
+
+    def _refresh_expected_rates(self):
+        now = time.time()
+        if self._expected_loaded is None or now - self._expected_loaded >= self.expected_refresh_seconds:
+            self.detector.set_expected(get_expected_port_rates(self.session))
+            self._expected_loaded = now
+
+    def _stage_rate_event(self, event):
+        """
+        Stage the rolled up instrument status for a rate event, unless the monitor reports it
+        :return: True if the event was staged
+        """
+        if self.rate_status and self.detector.has_expected(event.refdes):
+            # the RATE_STATUS rollup of the monitor reports instruments with an expected rate
+            return False
+        uid = None
+        if self.uid_resolver is not None:
+            try:
+                uid = self.uid_resolver(event.refdes)
+            except Exception:
+                log.exception('Unable to resolve asset uid for %s', event.refdes)
+        if uid is None:
+            log.warning('Port data rate for %s is %s, no asset uid to notify', event.refdes, event.status)
+            return True
+        reason = 'Port data rate: %.1f B/s (baseline %.1f B/s)' % (event.rate, event.baseline)
+        message = RateStatusMessage(event.refdes, uid, event.previous_status, event.status, reason)
+        message.instrument_status, message.instrument_reason = get_rollup_status(self.session, event.refdes,
+                                                                                 (event.status, reason))
+        self.session.add(PendingUpdate(message=message.as_dict()))
+        return True
 
     def get_consumers(self, Consumer, channel):
         return [
@@ -52,16 +112,29 @@ class AmqpStatsClient(ConsumerMixin):
         if clients > 0 and adds == 0 and bytes_in != (1.0 * bytes_out / clients):
             log.error('differing in/out rates: %d %d %d', bytes_in, bytes_out, clients)
 
-        with self.session.begin():
-            refdes_obj = self._get_or_create_refdes(refdes)
-            pc = PortCount()
-            pc.reference_designator = refdes_obj
-            pc.collected_time = collected
-            pc.byte_count = bytes_in
-            pc.seconds = elapsed
-            self.session.add(pc)
+        deferred = None
+        with COMMIT_SECONDS.time(), sql_stats.scope('amqp_message'):
+            with self.session.begin():
+                pc = PortCount()
+                pc.reference_designator_id = self.stream_cache.refdes_id(self.session, refdes)
+                pc.collected_time = collected
+                pc.byte_count = bytes_in
+                pc.seconds = elapsed
+                self.session.add(pc)
+                if self.detector is not None:
+                    self._refresh_expected_rates()
+                    event = self.detector.update(refdes, bytes_in, elapsed)
+                    if event is not None and not self._stage_rate_event(event):
+                        deferred = event
         message.ack()
 
+        if deferred is not None and self.on_rate_event is not None:
+            self.on_rate_event(deferred)
+
+        MESSAGES.inc()
+        BYTES.inc(max(bytes_in, 0))
+        LAG_SECONDS.set((datetime.datetime.utcnow() - collected).total_seconds())
+
     def start_thread(self):
         t = Thread(target=self.run)
         t.setDaemon(True)
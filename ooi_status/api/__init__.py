@@ -7,6 +7,8 @@ from sqlalchemy.orm import sessionmaker, scoped_session
 
 from ooi_data.postgres.model import MonitorBase, MetadataBase
 
+from .routing import RoutingSession
+
 
 class StatusJsonEncoder(JSONEncoder):
     def default(self, o):
@@ -29,6 +31,10 @@ if 'PSYCOGREEN' in os.environ:
 else:
     using_gevent = False
 
+# imported after the gevent patch so their locks and thread-local state are greenlet aware
+from ..profiling import Profiler
+from ..sql_stats import instrument_from_config
+
 
 app = Flask(__name__)
 
@@ -38,19 +44,51 @@ if 'OOISTATUS_SETTINGS' in os.environ:
 app.json_encoder = StatusJsonEncoder
 
 
-app.engine = create_engine(app.config['MONITOR_URL'])
-app.metadata_engine = create_engine(app.config['METADATA_URL'])
+def create_replica_engine(url):
+    if url:
+        return create_engine(url)
+
+
+def init_engines(app):
+    """
+    Create the database engines and bind the session factories to them. This runs at import unless
+    OOISTATUS_DEFER_ENGINES is set, in which case gunicorn.conf.py calls it in each worker after the fork,
+    so that an application preloaded in the gunicorn master never shares connection pools between workers.
+    """
+    app.engine = create_engine(app.config['MONITOR_URL'])
+    app.metadata_engine = create_engine(app.config['METADATA_URL'])
+    app.replica_engine = create_replica_engine(app.config['MONITOR_REPLICA_URL'])
+    app.metadata_replica_engine = create_replica_engine(app.config['METADATA_REPLICA_URL'])
+    instrument_from_config(app.engine, 'monitor', app.config)
+    instrument_from_config(app.metadata_engine, 'metadata', app.config)
+    instrument_from_config(app.replica_engine, 'monitor_replica', app.config)
+    instrument_from_config(app.metadata_replica_engine, 'metadata_replica', app.config)
 
-app.sessionmaker = sessionmaker(bind=app.engine)
+    app.sessionmaker.configure(primary=app.engine, replica=app.replica_engine)
+    app.metadata_sessionmaker.configure(primary=app.metadata_engine, replica=app.metadata_replica_engine)
+
+    if using_gevent:
+        for engine in (app.engine, app.metadata_engine, app.replica_engine, app.metadata_replica_engine):
+            if engine is not None:
+                engine.pool._use_threadlocal = True
+
+
+app.engine = app.metadata_engine = app.replica_engine = app.metadata_replica_engine = None
+app.sessionmaker = sessionmaker(class_=RoutingSession)
 app.session = scoped_session(app.sessionmaker)
-app.metadata_sessionmaker = sessionmaker(bind=app.metadata_engine)
+app.metadata_sessionmaker = sessionmaker(class_=RoutingSession)
 app.metadata_session = scoped_session(app.metadata_sessionmaker)
 
+# concurrent greenlets share one thread, so request profiles under gevent would mix requests together
+app.profiler = Profiler.from_config(app.config, profile_requests=not using_gevent)
+if using_gevent and app.config.get('PROFILE_DIR'):
+    app.logger.warning('Request profiling is disabled under gevent')
+
 MetadataBase.query = app.session.query_property()
 MonitorBase.query = app.session.query_property()
 
-if using_gevent:
-    app.engine.pool._use_threadlocal = True
+if 'OOISTATUS_DEFER_ENGINES' not in os.environ:
+    init_engines(app)
 
 
 import ooi_status.api.views
@@ -0,0 +1,48 @@
+import time
+
+from sqlalchemy.orm import Session
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+READ_PRIMARY_COOKIE = 'ooi_status_read_primary'
+
+
+class RoutingSession(Session):
+    """
+    Session which sends reads to a replica engine when the session has been marked as safe
+    for replica reads (see use_replica). Flushes and all other work go to the primary engine.
+    """
+    def __init__(self, primary=None, replica=None, **kwargs):
+        kwargs.setdefault('bind', primary)
+        super(RoutingSession, self).__init__(**kwargs)
+        self.primary = primary
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica is not None and self.info.get('use_replica') and not self._flushing:
+            return self.replica
+        return self.primary
+
+
+def use_replica(method, cookies):
+    """
+    Determine whether a request may read from the replicas. Only read requests are eligible and
+    a client which has recently modified data reads from the primary until its cookie expires.
+    :param method: HTTP request method
+    :param cookies: request cookies
+    :return: True if this request may be served from the replicas
+    """
+    if method not in READ_METHODS:
+        return False
+    try:
+        read_primary_until = float(cookies.get(READ_PRIMARY_COOKIE, 0))
+    except ValueError:
+        read_primary_until = 0
+    return read_primary_until < time.time()
+
+
+def mark_read_primary(response, seconds):
+    """
+    Direct subsequent reads from this client to the primary for the next `seconds` seconds
+    """
+    response.set_cookie(READ_PRIMARY_COOKIE, '%.3f' % (time.time() + seconds), max_age=seconds)
+    return response
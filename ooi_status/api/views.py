@@ -1,13 +1,105 @@
+import datetime
+
+import six
 import six.moves.http_client as http_client
-from dateutil.parser import parse
-from flask import jsonify, request
-from ooi_data.postgres.model import ExpectedStream, DeployedStream
+from flask import Response, g, jsonify, request, stream_with_context
+from ooi_data.postgres.model import ExpectedStream, DeployedStream, ReferenceDesignator
 from werkzeug.exceptions import abort
 
+from .. import downsample, export, metrics, sql_stats
 from ..api import app
-from ..metadata_queries import find_instrument_availability
-from ..queries import (get_status_by_instrument, get_status_by_stream,
-                       get_status_by_stream_id, get_status_by_refdes_id)
+from ..api.routing import use_replica, mark_read_primary, READ_METHODS
+from ..history import get_instrument_uptime, get_stream_uptime
+from ..json_stream import negotiate_encoding, stream_json
+from ..metadata_queries import iter_instrument_availability
+from ..queries import (get_status_by_instrument, iter_status_by_stream,
+                       get_status_by_stream_id, get_status_by_refdes_id,
+                       bulk_update_deployed, bulk_update_expected, bulk_set_enabled, THRESHOLD_FIELDS,
+                       get_port_data_rates, rate_bucket_seconds)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPACT = 'compact'
+MSGPACK = 'msgpack'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+REQUEST_SECONDS = metrics.histogram('ooi_status_api_request_seconds',
+                                    'Time to produce API response headers', ['endpoint', 'method', 'status'])
+
+
+def parse(value):
+    """
+    Parse a time argument, dateutil is imported on first use as most endpoints take none
+    """
+    from dateutil.parser import parse as parse_time
+    return parse_time(value)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = metrics.monotonic()
+
+
+@app.after_request
+def observe_request_time(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        REQUEST_SECONDS.labels(request.endpoint, request.method, response.status_code).observe(
+            metrics.monotonic() - start)
+    return response
+
+
+@app.before_request
+def start_profile():
+    g.profile = app.profiler.request(request.endpoint, request.path, request.method).start()
+
+
+@app.after_request
+def record_profile_status(response):
+    profile = getattr(g, 'profile', None)
+    if profile is not None:
+        profile.metadata['status'] = response.status_code
+    return response
+
+
+@app.teardown_request
+def stop_profile(exception=None):
+    # teardown runs after a streamed body has been generated, so the profile covers the whole response
+    profile = getattr(g, 'profile', None)
+    if profile is not None:
+        profile.stop(query_string=request.query_string.decode('utf-8', 'replace'),
+                     error=type(exception).__name__ if exception else None)
+
+
+@app.before_request
+def start_sql_scope():
+    g.sql_scope = sql_stats.scope(request.endpoint or 'unknown').__enter__()
+
+
+@app.teardown_request
+def end_sql_scope(exception=None):
+    scope = getattr(g, 'sql_scope', None)
+    if scope is not None:
+        scope.__exit__(None, None, None)
+
+
+@app.before_request
+def route_sessions():
+    replica = use_replica(request.method, request.cookies)
+    app.session.info['use_replica'] = replica
+    app.metadata_session.info['use_replica'] = replica
+
+
+@app.after_request
+def read_your_writes(response):
+    # a successful modification pins this client's reads to the primary until the replicas catch up
+    replicas = app.replica_engine is not None or app.metadata_replica_engine is not None
+    if replicas and request.method not in READ_METHODS and response.status_code < 400:
+        mark_read_primary(response, app.config['REPLICA_READ_YOUR_WRITES_SECONDS'])
+    return response
 
 
 @app.teardown_appcontext
@@ -16,6 +108,42 @@ def shutdown_session(exception=None):
     app.metadata_session.remove()
 
 
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/sql/stats')
+def get_sql_stats():
+    """
+    Statement statistics for this worker process, optionally for a single scope (an endpoint or monitor cycle)
+    """
+    scope_name = request.args.get('scope')
+    limit = request.args.get('limit', 20, type=int)
+    result = sql_stats.STATS.summary(scope_name=scope_name, limit=limit)
+    if result is None:
+        abort(http_client.NOT_FOUND)
+    return jsonify(result)
+
+
+def stream_jsonify(obj):
+    """
+    Streaming replacement for jsonify. The body is encoded incrementally with the application's
+    json encoder and compressed with gzip or deflate when the client accepts it.
+    """
+    encoder = app.json_encoder(sort_keys=app.config['JSON_SORT_KEYS'])
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    body = stream_json(obj, encoder, encoding=encoding,
+                       chunk_size=app.config['JSON_STREAM_CHUNK_SIZE'],
+                       level=app.config['JSON_COMPRESS_LEVEL'])
+
+    response = Response(stream_with_context(body), mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
 @app.route('/available/<refdes>', methods=['GET'])
 def available(refdes):
     filter_method = request.args.get('method')
@@ -27,8 +155,38 @@ def available(refdes):
         start_time = parse(start_time)
     if stop_time is not None:
         stop_time = parse(stop_time)
-    return jsonify({'availability': find_instrument_availability(
-        app.metadata_session, refdes, filter_method, filter_stream, lower_bound=start_time, upper_bound=stop_time)})
+
+    availability_format = _availability_format()
+    try:
+        availability = iter_instrument_availability(app.metadata_session, refdes, filter_method, filter_stream,
+                                                    lower_bound=start_time, upper_bound=stop_time,
+                                                    compact=availability_format is not None)
+    except ValueError:
+        abort(http_client.BAD_REQUEST)
+
+    if availability_format == MSGPACK:
+        body = msgpack.packb({'availability': list(availability)}, use_bin_type=True)
+        return Response(body, mimetype=MSGPACK_MIMETYPE, headers={'Vary': 'Accept'})
+    return stream_jsonify({'availability': availability})
+
+
+def _availability_format():
+    """
+    The compact format is selected with ?format=compact. MessagePack is selected with ?format=msgpack
+    or an Accept header preferring application/x-msgpack, when the msgpack package is installed.
+    Aborts with 406 if ?format=msgpack is requested without the msgpack package.
+    """
+    requested = request.args.get('format')
+    if requested == MSGPACK:
+        if msgpack is None:
+            abort(http_client.NOT_ACCEPTABLE)
+        return MSGPACK
+    if requested == COMPACT:
+        return COMPACT
+    if requested is None and msgpack is not None and \
+            request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE:
+        return MSGPACK
+    return None
 
 
 @app.route('/expected', methods=['GET'])
@@ -78,15 +236,54 @@ def update_expected_by_id(expected_id):
     abort(http_client.NOT_FOUND)
 
 
+@app.route('/expected', methods=['PATCH'])
+def bulk_update_expected_streams():
+    body = request.json or {}
+    expected_ids = _id_list(body.get('ids'))
+    filter_method = body.get('method')
+    filter_stream = body.get('stream')
+    values = _threshold_values(body)
+
+    if not (expected_ids or filter_method or filter_stream):
+        abort(http_client.BAD_REQUEST)
+
+    updated = bulk_update_expected(app.session, values, expected_ids=expected_ids,
+                                   filter_method=filter_method, filter_stream=filter_stream)
+    app.session.commit()
+    return jsonify({'updated': updated})
+
+
 @app.route('/deployed/<int:deployed_id>')
 def deployed_by_id(deployed_id):
-    deployed_stream = app.session.query(DeployedStream).get(deployed_id)
+    deployed_stream = get_status_by_stream_id(app.session, deployed_id)
     if deployed_stream:
         return jsonify(deployed_stream.as_dict())
 
     abort(http_client.NOT_FOUND)
 
 
+@app.route('/deployed/<int:deployed_id>/uptime')
+def deployed_uptime(deployed_id):
+    start, end = _uptime_window()
+    return jsonify(get_stream_uptime(app.session, deployed_id, start, end))
+
+
+def _uptime_window():
+    """
+    Read the start (inclusive) and end (exclusive) days of an uptime query, defaulting to the last 30 days
+    """
+    end = request.args.get('end')
+    start = request.args.get('start')
+    try:
+        end = parse(end).date() if end else datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
+        start = parse(start).date() if start else end - datetime.timedelta(days=30)
+    except ValueError:
+        abort(http_client.BAD_REQUEST)
+    if start >= end:
+        abort(http_client.BAD_REQUEST)
+    return start, end
+
+
 @app.route('/deployed/<int:deployed_id>', methods=['PATCH'])
 def update_deployed_by_id(deployed_id):
     def patch(deployed, patch):
@@ -100,7 +297,7 @@ def update_deployed_by_id(deployed_id):
         if 'fail_interval' in patch:
             deployed._fail_interval = patch['fail_interval']
 
-    deployed_stream = app.session.query(DeployedStream).get(deployed_id)
+    deployed_stream = get_status_by_stream_id(app.session, deployed_id)
     if deployed_stream:
         patch(deployed_stream, request.json)
         app.session.commit()
@@ -109,6 +306,15 @@ def update_deployed_by_id(deployed_id):
     abort(http_client.NOT_FOUND)
 
 
+@app.route('/deployed', methods=['PATCH'])
+def bulk_update_deployed_streams():
+    body = request.json or {}
+    values = _threshold_values(body, nullable=True)
+    updated = bulk_update_deployed(app.session, values, **_deployed_filters(body))
+    app.session.commit()
+    return jsonify({'updated': updated})
+
+
 @app.route('/stream')
 def get_streams():
     filter_status = request.args.get('status')
@@ -116,7 +322,8 @@ def get_streams():
     filter_method = request.args.get('method')
     filter_stream = request.args.get('stream')
 
-    return jsonify(get_status_by_stream(app.session, filter_refdes, filter_method, filter_stream, filter_status))
+    return stream_jsonify(iter_status_by_stream(app.session, filter_refdes, filter_method, filter_stream,
+                                                filter_status))
 
 
 @app.route('/stream/<int:deployed_id>')
@@ -135,8 +342,9 @@ def get_instruments():
     filter_method = request.args.get('method')
     filter_stream = request.args.get('stream')
 
-    return jsonify(get_status_by_instrument(app.session, filter_refdes=filter_refdes, filter_method=filter_method,
-                                            filter_stream=filter_stream, filter_status=filter_status))
+    return stream_jsonify(get_status_by_instrument(app.session, filter_refdes=filter_refdes,
+                                                   filter_method=filter_method, filter_stream=filter_stream,
+                                                   filter_status=filter_status))
 
 
 @app.route('/instrument/<int:refdes_id>')
@@ -144,6 +352,90 @@ def get_instrument(refdes_id):
     return jsonify(get_status_by_refdes_id(app.session, refdes_id))
 
 
+@app.route('/instrument/<int:refdes_id>/uptime')
+def get_instrument_uptime_by_id(refdes_id):
+    start, end = _uptime_window()
+    return jsonify(get_instrument_uptime(app.session, refdes_id, start, end))
+
+
+@app.route('/instrument/rates')
+def get_instrument_rates():
+    names = request.args.getlist('refdes')
+    if not names:
+        abort(http_client.BAD_REQUEST)
+    instruments = app.session.query(ReferenceDesignator.id, ReferenceDesignator.name).filter(
+        ReferenceDesignator.name.in_(names))
+    return jsonify(_port_rates(dict(instruments)))
+
+
+@app.route('/instrument/<int:refdes_id>/rates')
+def get_instrument_rates_by_id(refdes_id):
+    refdes = app.session.query(ReferenceDesignator.name).filter(ReferenceDesignator.id == refdes_id).scalar()
+    if refdes is None:
+        abort(http_client.NOT_FOUND)
+    return jsonify(_port_rates({refdes_id: refdes}))
+
+
+def _port_rates(instruments):
+    """
+    Downsampled port data rates of the requested window
+    :param instruments: dictionary mapping reference designator id to name
+    """
+    end = request.args.get('end')
+    start = request.args.get('start')
+    max_points = request.args.get('max_points', app.config['RATES_DEFAULT_POINTS'], type=int)
+    algorithm = request.args.get('algorithm', 'lttb')
+    try:
+        end = parse(end) if end else datetime.datetime.utcnow()
+        start = parse(start) if start else end - datetime.timedelta(days=app.config['RATES_DEFAULT_DAYS'])
+    except ValueError:
+        abort(http_client.BAD_REQUEST)
+    if start >= end or not 2 <= max_points <= app.config['RATES_MAX_POINTS'] or \
+            algorithm not in downsample.ALGORITHMS:
+        abort(http_client.BAD_REQUEST)
+
+    bucket_seconds = rate_bucket_seconds(start, end, max_points, minimum=app.config['RATES_BUCKET_SECONDS'])
+    rates = get_port_data_rates(app.session, list(instruments), start, end, bucket_seconds)
+    result = {}
+    for refdes_id, refdes in instruments.items():
+        times, values = downsample.downsample(*rates.get(refdes_id, ([], [])), threshold=max_points,
+                                              algorithm=algorithm)
+        result[refdes] = {
+            'refdes_id': refdes_id,
+            'time': [int(value * 1000) for value in times],
+            'rate': [float(value) for value in values],
+        }
+    return {
+        'start': start,
+        'end': end,
+        'bucket_seconds': bucket_seconds,
+        'algorithm': algorithm,
+        'rates': result,
+    }
+
+
+@app.route('/export/<dataset>')
+def export_dataset(dataset):
+    output_format = request.args.get('format', 'csv')
+    if dataset not in export.DATASETS or output_format not in export.FORMATS:
+        abort(http_client.BAD_REQUEST)
+    if output_format == 'parquet' and not export.parquet_available():
+        abort(http_client.BAD_REQUEST)
+    try:
+        start = parse(request.args['start']) if request.args.get('start') else None
+        end = parse(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        abort(http_client.BAD_REQUEST)
+
+    body = export.export(app.session, dataset, output_format, batch_size=app.config['EXPORT_BATCH_SIZE'],
+                         refdes=request.args.get('refdes'), method=request.args.get('method'),
+                         stream=request.args.get('stream'), status=request.args.get('status'),
+                         start=start, end=end)
+    filename = '%s.%s' % (dataset, output_format)
+    return Response(stream_with_context(body), mimetype=export.CONTENT_TYPES[output_format],
+                    headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+
 @app.route('/stream/<int:deployed_id>/disable', methods=['PUT'])
 def disable_by_id(deployed_id):
     deployed = app.session.query(DeployedStream).get(deployed_id)
@@ -164,11 +456,23 @@ def enable_by_id(deployed_id):
     return jsonify(get_status_by_stream_id(app.session, deployed_id))
 
 
+@app.route('/stream/disable', methods=['PUT'])
+def bulk_disable():
+    updated = bulk_set_enabled(app.session, False, **_deployed_filters(request.json or {}))
+    app.session.commit()
+    return jsonify({'updated': updated})
+
+
+@app.route('/stream/enable', methods=['PUT'])
+def bulk_enable():
+    updated = bulk_set_enabled(app.session, True, **_deployed_filters(request.json or {}))
+    app.session.commit()
+    return jsonify({'updated': updated})
+
+
 @app.route('/instrument/<refdes>/disable', methods=['PUT'])
 def disable_by_refdes(refdes):
-    deployed = app.session.query(DeployedStream).filter(DeployedStream.reference_designator == refdes)
-    for each in deployed:
-        each.disable()
+    bulk_set_enabled(app.session, False, refdes_names=[refdes])
     app.session.commit()
 
     return jsonify(get_status_by_instrument(app.session, filter_refdes=refdes))
@@ -176,9 +480,61 @@ def disable_by_refdes(refdes):
 
 @app.route('/instrument/<refdes>/enable', methods=['PUT'])
 def enable_by_refdes(refdes):
-    deployed = app.session.query(DeployedStream).filter(DeployedStream.reference_designator == refdes)
-    for each in deployed:
-        each.enable()
+    bulk_set_enabled(app.session, True, refdes_names=[refdes])
     app.session.commit()
 
     return jsonify(get_status_by_instrument(app.session, filter_refdes=refdes))
+
+
+def _threshold_values(body, nullable=False):
+    """
+    Extract the new threshold values from a bulk request body.
+    Every value is validated before anything is updated, so one bad value rejects the whole request.
+    :param nullable: whether null (clear the override) is accepted
+    """
+    values = {field: body[field] for field in THRESHOLD_FIELDS if field in body}
+    for value in values.values():
+        if value is None and nullable:
+            continue
+        if isinstance(value, bool) or not isinstance(value, six.integer_types + (float,)) or value < 0:
+            abort(http_client.BAD_REQUEST)
+    return values
+
+
+def _id_list(value):
+    """
+    Validate an optional list of ids from a bulk request body
+    """
+    if value is not None and (not isinstance(value, list) or
+                              not all(isinstance(each, six.integer_types) and not isinstance(each, bool)
+                                      for each in value)):
+        abort(http_client.BAD_REQUEST)
+    return value
+
+
+def _name_list(value):
+    """
+    Validate an optional list of names from a bulk request body
+    """
+    if value is not None and (not isinstance(value, list) or
+                              not all(isinstance(each, six.string_types) for each in value)):
+        abort(http_client.BAD_REQUEST)
+    return value
+
+
+def _deployed_filters(body):
+    """
+    Extract the deployed stream selection from a bulk request body.
+    At least one id or filter is required so a bare request can't modify every stream.
+    """
+    filters = {
+        'deployed_ids': _id_list(body.get('ids')),
+        'refdes_names': _name_list(body.get('refdes_names')),
+        'filter_refdes': body.get('refdes'),
+        'filter_method': body.get('method'),
+        'filter_stream': body.get('stream'),
+        'filter_status': body.get('status'),
+    }
+    if not any(filters.values()):
+        abort(http_client.BAD_REQUEST)
+    return filters
@@ -2,10 +2,137 @@
 MONITOR_URL ='postgresql+psycopg2://monitor@/monitor'
 METADATA_URL = 'postgresql+psycopg2://awips@/metadata'
 
+# Optional read replicas used by the HTTP API for GET requests
+MONITOR_REPLICA_URL = None
+METADATA_REPLICA_URL = None
+# Seconds a client reads from the primary databases after modifying data
+REPLICA_READ_YOUR_WRITES_SECONDS = 10
+
 # AMQP
 AMQP_URL = 'amqp://localhost'
 AMQP_QUEUE = 'port_agent_stats'
+# Consume the port agent statistics queue in the status monitor (run it on one monitor instance only)
+AMQP_CONSUMER = False
 
 # UFRAME STATUS NOTIFIER
 NOTIFY_URL_ROOT = 'http://localhost'
 NOTIFY_URL_PORT = 12587
+
+# API RESPONSE STREAMING
+JSON_STREAM_CHUNK_SIZE = 16384
+JSON_COMPRESS_LEVEL = 6
+
+# PORT DATA RATE API
+# Days of rates returned when no start is given
+RATES_DEFAULT_DAYS = 7
+# Points returned per instrument when max_points is not given, and the largest max_points accepted
+RATES_DEFAULT_POINTS = 500
+RATES_MAX_POINTS = 5000
+# Narrowest bucket port counts are summed into before downsampling
+RATES_BUCKET_SECONDS = 3600
+
+# BULK EXPORT
+# Rows fetched from the server side cursor and encoded at a time (a Parquet row group)
+EXPORT_BATCH_SIZE = 10000
+
+# METRICS
+# Port on which the status monitor serves Prometheus metrics (None to disable)
+METRICS_PORT = None
+
+# PROFILING
+# Directory to write cProfile output to (None disables profiling entirely)
+PROFILE_DIR = None
+# Number of profiles retained in PROFILE_DIR
+PROFILE_KEEP = 50
+# Profile one status monitor cycle in every N (0 to disable)
+PROFILE_CYCLE_EVERY = 0
+# API endpoint names or path prefixes whose requests are always profiled, e.g. ['available', '/stream']
+PROFILE_ROUTES = []
+# Profile every other API request, keeping those slower than this many seconds (None to disable)
+PROFILE_SLOW_SECONDS = None
+
+# SQL STATEMENT STATISTICS
+# Record statement fingerprints, counts and timings for every engine (see /sql/stats)
+SQL_STATS = True
+# Log statements which take at least this many seconds (None to disable)
+SQL_SLOW_SECONDS = 1.0
+
+# SHARDING
+# Split reference designators into this many hash partitions shared between monitor instances (0 to disable)
+SHARD_PARTITIONS = 0
+# Seconds between partition ownership refreshes (ownership is also refreshed before each check)
+SHARD_REBALANCE_SECONDS = 15
+# Advisory lock class used for partition locks, the next value is used for member locks
+SHARD_LOCK_CLASS = 7007
+SHARD_MAX_MEMBERS = 64
+
+# EVENT DRIVEN CHECKS
+# Check streams as their metadata changes (requires ooi_status_monitor --install-trigger on the metadata database)
+METADATA_NOTIFY = False
+METADATA_NOTIFY_CHANNEL = 'ooi_status_stream_metadata'
+# Seconds to collect notifications before checking the notified streams
+METADATA_NOTIFY_DEBOUNCE_SECONDS = 2
+# Minutes between full sweeps of all active streams while notifications are enabled
+METADATA_NOTIFY_SWEEP_MINUTES = 10
+
+# METADATA MIRROR
+# Keep a local copy of the active streams, pulling only changed rows from the metadata database each cycle
+METADATA_MIRROR = False
+# Streams whose last particle time is within this many minutes of the newest seen are re-read every cycle
+METADATA_MIRROR_OVERLAP_MINUTES = 60
+# Minutes between refreshes of the active deployments
+METADATA_MIRROR_DEPLOYMENT_MINUTES = 10
+# Minutes between full reloads of the mirror
+METADATA_MIRROR_RESYNC_MINUTES = 60
+# Rows fetched at a time from server side cursors when scanning stream metadata
+METADATA_FETCH_BATCH = 1000
+
+# STATUS HISTORY
+# Log status transitions and maintain daily time-in-state aggregates (requires the status history migration)
+STATUS_HISTORY = False
+# Longest interval accrued at once, time beyond this (e.g. while the monitor was stopped) is not counted
+STATUS_ACCRUAL_MAX_GAP_MINUTES = 10
+
+# PORT DATA RATE DETECTION
+# Track the data rate of every port agent in AmqpStatsClient and stage degraded / recovered events
+# (left to RATE_STATUS for instruments with an expected rate when it is enabled)
+RATE_DETECTOR = False
+# EWMA smoothing factor of the learned data rate
+RATE_EWMA_ALPHA = 0.1
+# Samples required before the learned rate is used for ports without an expected rate
+RATE_WARMUP_SAMPLES = 10
+# Rates below this fraction of the expected (or learned) rate are low
+RATE_LOW_RATIO = 0.25
+# Consecutive low rates before a port is degraded
+RATE_PERSIST_SAMPLES = 3
+# A degraded port recovers at this fraction of the expected (or learned) rate
+RATE_RECOVER_RATIO = 0.5
+# Standard deviations below the learned rate required for a rate to be low
+RATE_Z_SCORE = 3.0
+# Seconds between reloads of the expected rates
+RATE_EXPECTED_REFRESH_SECONDS = 300
+
+# PORT DATA RATE STATUS
+# Combine the observed port data rate of instruments with an expected rate into their rolled up status
+RATE_STATUS = False
+# Minutes of port counts averaged for the observed rate
+RATE_STATUS_WINDOW_MINUTES = 60
+# Observed rates below these fractions of the expected rate are degraded / failed
+RATE_STATUS_DEGRADED_RATIO = 0.5
+RATE_STATUS_FAILED_RATIO = 0.1
+
+# STREAM CACHE
+# Maximum number of deployed streams cached by the monitor
+STREAM_CACHE_SIZE = 100000
+# Minutes between full reloads of the cache
+STREAM_CACHE_REFRESH_MINUTES = 60
+# Invalidate cached thresholds as they are edited (requires ooi_status_monitor --install-trigger). When off, or
+# without the triggers, the cache is reloaded by every full check instead
+STREAM_CACHE_NOTIFY = True
+STREAM_CACHE_CHANNEL = 'ooi_status_stream_cache'
+
+# WARM RESTART SNAPSHOTS
+# Path prefix of the snapshot files (None to disable)
+SNAPSHOT_PATH = None
+# Seconds between snapshots (a snapshot is also written when the monitor stops)
+SNAPSHOT_INTERVAL_SECONDS = 300
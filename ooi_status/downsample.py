@@ -0,0 +1,90 @@
+"""
+Shape preserving downsampling of time series for display.
+
+Both functions return the indexes of the points to keep, in time order, so several columns can be reduced with
+the same selection:
+
+* lttb - Largest Triangle Three Buckets (Steinarsson, 2013). The first and last points are kept and every bucket
+  in between contributes the point forming the largest triangle with the point kept from the previous bucket
+  and the average of the next bucket. This follows the visual shape of the series closely.
+* minmax - the minimum and maximum of every bucket. Every peak and dip survives, which suits outage spotting.
+
+The bucket averages, triangle areas and extremes are computed with numpy over whole buckets. LTTB still walks the
+buckets in order because each choice depends on the previous one, but that loop is bounded by the number of
+points returned, not the length of the series.
+
+numpy is imported by each function, so the API only loads it once a rates request arrives.
+"""
+ALGORITHMS = ('lttb', 'minmax')
+
+
+def lttb(x, y, threshold):
+    """
+    :param x: increasing array of x values (e.g. seconds since the epoch)
+    :param y: array of y values
+    :param threshold: maximum number of points returned, below 3 only the first and last points are kept
+    :return: int array of the indexes of the points kept
+    """
+    import numpy as np
+    x = np.asarray(x, dtype='f8')
+    y = np.asarray(y, dtype='f8')
+    length = len(x)
+    if threshold >= length:
+        return np.arange(length)
+    if threshold < 3:
+        # no room for a bucket between the first and last points
+        return np.array([0, length - 1][:max(threshold, 0)], dtype='i8')
+
+    # threshold - 2 buckets of (almost) equal count between the first and last points
+    edges = np.linspace(1, length - 1, threshold - 1).astype('i8')
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:length - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:length - 1], edges[:-1]) / counts
+    # the third point of each triangle is the average of the following bucket, or the last point
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(threshold, dtype='i8')
+    selected[0] = 0
+    selected[-1] = length - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        area = np.abs((x[previous] - next_x[bucket]) * (y[start:stop] - y[previous]) -
+                      (x[previous] - x[start:stop]) * (next_y[bucket] - y[previous]))
+        previous = start + np.argmax(area)
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax(x, y, threshold):
+    """
+    :param x: increasing array of x values
+    :param y: array of y values
+    :param threshold: maximum number of points returned, below 2 only the first point is kept
+    :return: int array of the indexes of the points kept
+    """
+    import numpy as np
+    y = np.asarray(y, dtype='f8')
+    length = len(y)
+    if threshold >= length:
+        return np.arange(length)
+    if threshold < 2:
+        return np.arange(max(threshold, 0))
+
+    edges = np.linspace(0, length, threshold // 2 + 1).astype('i8')
+    buckets = np.repeat(np.arange(len(edges) - 1), np.diff(edges))
+    # sorted by bucket then value, the first and last index of each bucket are its minimum and maximum
+    order = np.lexsort((y, buckets))
+    return np.unique(np.concatenate([order[edges[:-1]], order[edges[1:] - 1]]))
+
+
+def downsample(x, y, threshold, algorithm='lttb'):
+    """
+    :return: (x, y) reduced to at most threshold points with the named algorithm
+    """
+    import numpy as np
+    if algorithm not in ALGORITHMS:
+        raise ValueError('Unknown downsampling algorithm %r' % algorithm)
+    selected = (lttb if algorithm == 'lttb' else minmax)(x, y, threshold)
+    return np.asarray(x)[selected], np.asarray(y)[selected]
@@ -0,0 +1,182 @@
+"""
+Data driven estimation of stream thresholds from partition metadata.
+
+The inter-arrival times of every stream are rebuilt as in the replay tool (the gaps between partitions and the
+mean particle spacing within them, each weighted by the number of intervals it represents). Weighted percentiles
+are then computed for every (stream, method) and every deployed stream in one vectorized pass, and thresholds are
+proposed from the median and a high percentile:
+
+    warn_interval = max(margin * p<percentile>, MIN_WARN_SECONDS), rounded up to the minute
+    fail_interval = fail_factor * warn_interval
+
+The expected stream proposals are written in the CSV format accepted by ooi_status_monitor --expected (with the
+statistics in additional columns), so the whole array can be recalibrated with one load. Streams with too few
+intervals keep their current thresholds. expected_rate is carried over unchanged since partition metadata says
+nothing about port data rates.
+
+    ooi_status_estimate --start 2017-01-01 --end 2017-04-01 --output expected.csv --deployed-output deployed.csv
+"""
+import datetime
+import logging
+import os
+
+import click
+import numpy as np
+import pandas as pd
+from flask import Config
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .get_logger import get_logger
+from .queries import get_threshold_frames
+from .replay import parse_time_option, load_timeline, resolve_thresholds
+
+log = get_logger(__name__, logging.INFO)
+here = os.path.dirname(__file__)
+
+MIN_WARN_SECONDS = 300
+EXPECTED_FIELDS = ['name', 'method', 'expected_rate', 'warn_interval', 'fail_interval']
+
+
+def weighted_percentiles(groups, values, weights, quantiles, size):
+    """
+    Weighted percentiles of values within each group, computed with a single sort
+    :param groups: int array, the group of each value (0 .. size - 1)
+    :param values: float array
+    :param weights: float array, the number of occurrences of each value
+    :param quantiles: sequence of quantiles between 0 and 1
+    :param size: number of groups
+    :return: array of shape (len(quantiles), size), NaN for empty groups
+    """
+    result = np.full((len(quantiles), size), np.nan)
+    if not len(values):
+        return result
+    order = np.lexsort((values, groups))
+    groups = groups[order]
+    values = values[order]
+    cumulative = np.cumsum(weights[order])
+
+    totals = np.bincount(groups, weights=weights[order], minlength=size)
+    present = np.flatnonzero(totals > 0)
+    # cumulative weight before each group, and the index range of each group in the sorted values
+    before = np.concatenate([[0], np.cumsum(totals)[:-1]])[present]
+    first = np.searchsorted(groups, present, side='left')
+    last = np.searchsorted(groups, present, side='right') - 1
+
+    for row, quantile in enumerate(quantiles):
+        index = np.searchsorted(cumulative, before + quantile * totals[present], side='left')
+        result[row, present] = values[np.clip(index, first, last)]
+    return result
+
+
+def interval_statistics(timeline, groups, size, percentile):
+    """
+    :return: dataframe with intervals, median_seconds and p<percentile>_seconds for each group
+    """
+    stream_groups = groups[timeline.stream_index]
+    median, high = weighted_percentiles(stream_groups, timeline.gaps, timeline.weights,
+                                        [0.5, percentile / 100.0], size)
+    return pd.DataFrame({
+        'intervals': np.bincount(stream_groups, weights=timeline.weights, minlength=size),
+        'median_seconds': median,
+        'p%g_seconds' % percentile: high,
+    }, columns=['intervals', 'median_seconds', 'p%g_seconds' % percentile])
+
+
+def propose(stats, percentile, margin, fail_factor):
+    """
+    :return: (warn_interval, fail_interval) series proposed from the statistics
+    """
+    warn = np.fmax(stats['p%g_seconds' % percentile] * margin, MIN_WARN_SECONDS)
+    warn = np.ceil(warn / 60.0) * 60
+    return warn.astype('i8'), (warn * fail_factor).astype('i8')
+
+
+def estimate(timeline, expected, deployed, percentile=99, margin=1.5, fail_factor=2, min_intervals=100):
+    """
+    Propose thresholds for every (stream, method) and every deployed stream in the timeline
+    :param timeline: Timeline from the replay module
+    :param expected: expected stream dataframe from get_threshold_frames
+    :param deployed: deployed stream dataframe from get_threshold_frames
+    :param percentile: high percentile of the interval distribution
+    :param margin: multiple of the high percentile at which a stream becomes degraded
+    :param fail_factor: multiple of the warn interval at which a stream fails
+    :param min_intervals: minimum number of intervals required for a proposal
+    :return: (expected stream dataframe in the --expected CSV format, deployed stream dataframe)
+    """
+    streams = timeline.streams
+    keys = streams.stream + '\0' + streams.method
+    type_groups, type_keys = pd.factorize(keys)
+
+    # one row per (stream, method)
+    types = streams.loc[~keys.duplicated(), ['stream', 'method']].rename(columns={'stream': 'name'})
+    types = types.reset_index(drop=True)
+    types['streams'] = np.bincount(type_groups, minlength=len(type_keys))
+    types = pd.concat([types, interval_statistics(timeline, type_groups, len(type_keys), percentile)], axis=1)
+    warn, fail = propose(types, percentile, margin, fail_factor)
+
+    types = types.merge(expected, on=['name', 'method'], how='left')
+    types = types.rename(columns={'warn_interval': 'current_warn_interval',
+                                  'fail_interval': 'current_fail_interval'})
+    estimated = (types.intervals >= min_intervals).values
+    types['estimated'] = estimated
+    types['warn_interval'] = np.where(estimated, warn, types.current_warn_interval)
+    types['fail_interval'] = np.where(estimated, fail, types.current_fail_interval)
+    types['expected_rate'] = types.expected_rate.fillna(0)
+    # streams without enough data or a current definition are left out
+    types = types[types.warn_interval.notnull()].copy()
+    types[['warn_interval', 'fail_interval']] = types[['warn_interval', 'fail_interval']].astype('i8')
+
+    # one row per deployed stream, alongside the proposal for its (stream, method)
+    per_stream = streams[['refdes', 'stream', 'method']].rename(columns={'stream': 'name'})
+    per_stream = pd.concat([per_stream, interval_statistics(timeline, np.arange(len(streams)), len(streams),
+                                                           percentile)], axis=1)
+    warn, fail = propose(per_stream, percentile, margin, fail_factor)
+    current_warn, current_fail = resolve_thresholds(streams, expected, deployed)
+    per_stream['current_warn_interval'] = current_warn
+    per_stream['current_fail_interval'] = current_fail
+    per_stream['warn_interval'] = np.where(per_stream.intervals >= min_intervals, warn, np.nan)
+    per_stream['fail_interval'] = np.where(per_stream.intervals >= min_intervals, fail, np.nan)
+    per_stream = per_stream.merge(types[['name', 'method', 'warn_interval', 'fail_interval']],
+                                  on=['name', 'method'], how='left', suffixes=('', '_default'))
+
+    extra = ['current_warn_interval', 'current_fail_interval', 'estimated', 'streams', 'intervals',
+             'median_seconds', 'p%g_seconds' % percentile]
+    types = types[EXPECTED_FIELDS + extra].sort_values(['name', 'method'])
+    return types, per_stream.sort_values(['refdes', 'method', 'name'])
+
+
+@click.command()
+@click.option('--start', callback=parse_time_option, help='Start of the sample window (default 30 days before end)')
+@click.option('--end', callback=parse_time_option, help='End of the sample window (default now)')
+@click.option('--output', type=click.Path(dir_okay=False), required=True,
+              help='Write the proposed expected stream thresholds to this CSV file')
+@click.option('--deployed-output', type=click.Path(dir_okay=False),
+              help='Write per deployed stream statistics and proposals to this CSV file')
+@click.option('--percentile', type=float, default=99, help='High percentile of the intervals (default 99)')
+@click.option('--margin', type=float, default=1.5, help='Warn at this multiple of the high percentile')
+@click.option('--fail-factor', type=float, default=2, help='Fail at this multiple of the warn interval')
+@click.option('--min-intervals', type=int, default=100, help='Minimum number of intervals for a proposal')
+def main(start, end, output, deployed_output, percentile, margin, fail_factor, min_intervals):
+    config = Config(here)
+    config.from_object('ooi_status.default_settings')
+    if 'OOISTATUS_SETTINGS' in os.environ:
+        config.from_envvar('OOISTATUS_SETTINGS')
+
+    end = end or datetime.datetime.utcnow()
+    start = start or end - datetime.timedelta(days=30)
+
+    timeline = load_timeline(config, start, end)
+    monitor_session = sessionmaker(bind=create_engine(config['MONITOR_URL']))()
+    expected, deployed = get_threshold_frames(monitor_session)
+
+    types, per_stream = estimate(timeline, expected, deployed, percentile=percentile, margin=margin,
+                                 fail_factor=fail_factor, min_intervals=min_intervals)
+    types.to_csv(output, index=False)
+    log.info('Proposed thresholds for %d of %d expected streams', types.estimated.sum(), len(types))
+    if deployed_output:
+        per_stream.to_csv(deployed_output, index=False)
+
+
+if __name__ == '__main__':
+    main()
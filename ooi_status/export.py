@@ -0,0 +1,251 @@
+"""
+Streaming bulk export of stream status, port counts and status history.
+
+Three datasets can be exported for a reference designator / method / stream filter (substring matches, as in
+the API) and a time window:
+
+* status - the current status and effective thresholds of every matching deployed stream
+* port_counts - the port agent byte counts collected in the window
+* availability - the status spans of every matching deployed stream overlapping the window, rebuilt from the
+  status transition history (STATUS_HISTORY) and clipped to the window
+
+Rows are fetched through a server side cursor EXPORT_BATCH_SIZE at a time, and each batch is encoded and
+handed to the caller before the next is fetched. CSV is written a batch at a time, and Parquet as one row group
+per batch (when pyarrow is installed). Memory use depends only on the batch size, never on the size of the
+export.
+
+    ooi_status_monitor export port_counts --refdes RS03AXPS --start 2017-01-01 --format parquet --output pc.parquet
+"""
+import csv
+import datetime
+import logging
+
+import six
+from ooi_data.postgres.model import DeployedStream, ExpectedStream, PortCount, ReferenceDesignator
+from sqlalchemy import func, or_, select
+
+from .get_logger import get_logger
+from .history import status_transition
+from .queries import _filter_status_query
+
+log = get_logger(__name__, logging.INFO)
+
+DATASETS = ('status', 'port_counts', 'availability')
+FORMATS = ('csv', 'parquet')
+CONTENT_TYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+EXPORT_BATCH_SIZE = 10000
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def status_statement(session, refdes=None, method=None, stream=None, status=None, start=None, end=None):
+    """
+    :return: (statement, columns) of the current status of the matching deployed streams (the window is unused)
+    """
+    query = session.query(
+        ReferenceDesignator.name.label('refdes'),
+        ExpectedStream.name.label('stream'),
+        ExpectedStream.method.label('method'),
+        DeployedStream.status.label('status'),
+        DeployedStream.status_time.label('status_time'),
+        func.coalesce(DeployedStream._expected_rate, ExpectedStream.expected_rate).label('expected_rate'),
+        func.coalesce(DeployedStream._warn_interval, ExpectedStream.warn_interval).label('warn_interval'),
+        func.coalesce(DeployedStream._fail_interval, ExpectedStream.fail_interval).label('fail_interval'),
+    ).select_from(DeployedStream)
+    query = _filter_status_query(query, filter_refdes=refdes, filter_method=method, filter_stream=stream,
+                                 filter_status=status).order_by(ReferenceDesignator.name, ExpectedStream.method,
+                                                                ExpectedStream.name)
+    columns = [('refdes', 'string'), ('stream', 'string'), ('method', 'string'), ('status', 'string'),
+               ('status_time', 'timestamp'), ('expected_rate', 'float'), ('warn_interval', 'int'),
+               ('fail_interval', 'int')]
+    return query.statement, columns
+
+
+def port_count_statement(session, refdes=None, method=None, stream=None, status=None, start=None, end=None):
+    """
+    :return: (statement, columns) of the port counts collected in the window (method, stream and status are unused)
+    """
+    query = session.query(
+        ReferenceDesignator.name.label('refdes'),
+        PortCount.collected_time,
+        PortCount.byte_count,
+        PortCount.seconds,
+    ).join(PortCount.reference_designator).filter(PortCount.collected_time >= start,
+                                                   PortCount.collected_time < end)
+    if refdes:
+        query = query.filter(ReferenceDesignator.name.like('%%%s%%' % refdes))
+    query = query.order_by(PortCount.collected_time)
+    columns = [('refdes', 'string'), ('collected_time', 'timestamp'), ('byte_count', 'int'), ('seconds', 'float')]
+    return query.statement, columns
+
+
+def availability_statement(session, refdes=None, method=None, stream=None, status=None, start=None, end=None):
+    """
+    :return: (statement, columns) of the status spans of the matching deployed streams, clipped to the window
+    """
+    transitions = _filter_status_query(session.query(
+        ReferenceDesignator.name.label('refdes'),
+        ExpectedStream.name.label('stream'),
+        ExpectedStream.method.label('method'),
+        status_transition.c.deployed_stream_id,
+        status_transition.c.transition_time,
+        status_transition.c.status,
+        func.lead(status_transition.c.transition_time).over(
+            partition_by=status_transition.c.deployed_stream_id,
+            order_by=status_transition.c.transition_time).label('next_time'),
+    ).select_from(DeployedStream).join(status_transition,
+                                       status_transition.c.deployed_stream_id == DeployedStream.id),
+        filter_refdes=refdes, filter_method=method, filter_stream=stream).filter(
+        status_transition.c.transition_time < end).subquery()
+
+    statement = select([
+        transitions.c.refdes,
+        transitions.c.stream,
+        transitions.c.method,
+        func.greatest(transitions.c.transition_time, start).label('start'),
+        func.least(func.coalesce(transitions.c.next_time, end), end).label('stop'),
+        transitions.c.status,
+    ]).where(or_(transitions.c.next_time.is_(None), transitions.c.next_time > start))
+    if status:
+        statement = statement.where(transitions.c.status == status)
+    statement = statement.order_by(transitions.c.deployed_stream_id, transitions.c.transition_time)
+    columns = [('refdes', 'string'), ('stream', 'string'), ('method', 'string'), ('start', 'timestamp'),
+               ('stop', 'timestamp'), ('status', 'string')]
+    return statement, columns
+
+
+STATEMENTS = {
+    'status': status_statement,
+    'port_counts': port_count_statement,
+    'availability': availability_statement,
+}
+
+
+def iter_batches(session, statement, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Execute a statement through a server side (named) cursor and fetch the first batch before returning, so
+    database errors are raised to the caller rather than part way through a streamed response
+    :return: generator yielding the rows batch_size at a time
+    """
+    result = session.connection().execution_options(stream_results=True).execute(statement)
+    try:
+        first = result.fetchmany(batch_size)
+    except Exception:
+        result.close()
+        raise
+    return _fetch_batches(result, first, batch_size)
+
+
+def _fetch_batches(result, rows, batch_size):
+    try:
+        while rows:
+            yield rows
+            rows = result.fetchmany(batch_size)
+    finally:
+        result.close()
+
+
+def _drain(buffer):
+    value = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+    if isinstance(value, six.text_type):
+        value = value.encode('utf-8')
+    return value
+
+
+def write_csv(columns, batches):
+    """
+    Encode batches of rows as CSV with a header line
+    :return: generator of bytes, one chunk per batch
+    """
+    buffer = six.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield _drain(buffer)
+    for rows in batches:
+        writer.writerows(rows)
+        yield _drain(buffer)
+
+
+class _ChunkSink(object):
+    """
+    Write only file object collecting the bytes written since the last drain
+    """
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        value, self.chunks = b''.join(self.chunks), []
+        return value
+
+
+def write_parquet(columns, batches):
+    """
+    Encode batches of rows as a Parquet file with one row group per batch
+    :return: generator of bytes, one chunk per batch and a final chunk with the file footer
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'string': pa.string(), 'timestamp': pa.timestamp('us'), 'int': pa.int64(), 'float': pa.float64()}
+    names = [name for name, _ in columns]
+    arrow_types = [types[kind] for _, kind in columns]
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, pa.schema(list(zip(names, arrow_types))))
+    for rows in batches:
+        arrays = [pa.array([row[index] for row in rows], type=arrow_type)
+                  for index, arrow_type in enumerate(arrow_types)]
+        writer.write_table(pa.Table.from_arrays(arrays, names=names))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export(session, dataset, output_format='csv', batch_size=EXPORT_BATCH_SIZE, refdes=None, method=None,
+           stream=None, status=None, start=None, end=None):
+    """
+    Stream a dataset in the requested format
+    :param session: monitor database session, which must stay open while the export is consumed
+    :param dataset: one of DATASETS
+    :param output_format: one of FORMATS
+    :param start: start of the window (default 30 days before end)
+    :param end: end of the window (exclusive, default now)
+    :return: generator of bytes, the query has already been executed
+    """
+    if dataset not in STATEMENTS:
+        raise ValueError('Unknown dataset %r' % dataset)
+    if output_format not in FORMATS:
+        raise ValueError('Unknown format %r' % output_format)
+    end = end or datetime.datetime.utcnow()
+    start = start or end - datetime.timedelta(days=30)
+
+    statement, columns = STATEMENTS[dataset](session, refdes=refdes, method=method, stream=stream, status=status,
+                                             start=start, end=end)
+    log.info('Exporting %s (%s) from %s to %s', dataset, output_format, start, end)
+    batches = iter_batches(session, statement, batch_size)
+    writer = write_parquet if output_format == 'parquet' else write_csv
+    return writer(columns, batches)
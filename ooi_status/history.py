@@ -0,0 +1,264 @@
+"""
+Status transition history and daily time-in-state aggregates.
+
+status_transition is an append-only log of every status change written by the monitor, range partitioned by
+month (partitions are created on demand). stream_status_daily and instrument_status_daily hold the number of
+seconds each deployed stream / reference designator spent in each status per day. They are maintained
+incrementally by accrue_status_time, which on every check attributes the time since the previous accrual
+(recorded in status_accrual) to the statuses currently stored in deployed_stream. Uptime queries read only the
+daily aggregates.
+
+The tables are created by the alembic migration (or create_tables). Partitioning requires PostgreSQL 10 or later,
+on older servers the migration creates status_transition as a plain table and no partitions are created.
+"""
+import datetime
+import logging
+
+from ooi_data.postgres.model import DeployedStream, StatusEnum
+from sqlalchemy import (Column, Date, DateTime, Float, Integer, MetaData, String, Table, case, event, func,
+                        literal, select, text)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from .get_logger import get_logger
+
+log = get_logger(__name__, logging.INFO)
+
+metadata = MetaData()
+
+status_transition = Table(
+    'status_transition', metadata,
+    Column('deployed_stream_id', Integer, nullable=False),
+    Column('reference_designator_id', Integer, nullable=False),
+    Column('transition_time', DateTime, nullable=False),
+    Column('previous_status', String, nullable=False),
+    Column('status', String, nullable=False),
+    Column('elapsed_seconds', Float),
+)
+
+stream_status_daily = Table(
+    'stream_status_daily', metadata,
+    Column('deployed_stream_id', Integer, primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('status', String, primary_key=True),
+    Column('seconds', Float, nullable=False),
+)
+
+instrument_status_daily = Table(
+    'instrument_status_daily', metadata,
+    Column('reference_designator_id', Integer, primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('status', String, primary_key=True),
+    Column('seconds', Float, nullable=False),
+)
+
+status_accrual = Table(
+    'status_accrual', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('accrued_until', DateTime, nullable=False),
+)
+
+CREATE_TRANSITION_TABLE = """
+CREATE TABLE IF NOT EXISTS status_transition (
+    deployed_stream_id INTEGER NOT NULL,
+    reference_designator_id INTEGER NOT NULL,
+    transition_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    previous_status VARCHAR NOT NULL,
+    status VARCHAR NOT NULL,
+    elapsed_seconds FLOAT
+) PARTITION BY RANGE (transition_time)
+"""
+
+_CREATE_PARTITION = """
+CREATE TABLE IF NOT EXISTS {name} PARTITION OF status_transition FOR VALUES FROM ('{start}') TO ('{stop}');
+CREATE INDEX IF NOT EXISTS {name}_deployed_idx ON {name} (deployed_stream_id, transition_time);
+CREATE INDEX IF NOT EXISTS {name}_refdes_idx ON {name} (reference_designator_id, transition_time)
+"""
+
+# serializes partition creation between monitor instances
+PARTITION_LOCK_KEY = 70070041
+ACCRUAL_ID = 1
+
+# partitions known to exist, names are only added once the transaction creating them has committed
+_known_partitions = set()
+_PENDING_PARTITIONS = 'ooi_status_pending_partitions'
+_IS_PARTITIONED = text("SELECT relkind = 'p' FROM pg_class WHERE oid = 'status_transition'::regclass")
+_partitioned = {}
+
+
+def create_tables(engine):
+    """
+    Create the history tables (for tests and databases not managed by alembic)
+    """
+    with engine.begin() as conn:
+        conn.execute(CREATE_TRANSITION_TABLE)
+    metadata.create_all(engine, tables=[stream_status_daily, instrument_status_daily, status_accrual])
+
+
+def month_bounds(when):
+    start = datetime.date(when.year, when.month, 1)
+    if when.month == 12:
+        stop = datetime.date(when.year + 1, 1, 1)
+    else:
+        stop = datetime.date(when.year, when.month + 1, 1)
+    return start, stop
+
+
+def is_partitioned(session):
+    """
+    :return: True if status_transition is a partitioned table (checked once per process)
+    """
+    if 'status_transition' not in _partitioned:
+        _partitioned['status_transition'] = bool(session.execute(_IS_PARTITIONED).scalar())
+    return _partitioned['status_transition']
+
+
+def ensure_partition(session, when):
+    """
+    Create the monthly status_transition partition containing when if it does not already exist
+    """
+    start, stop = month_bounds(when)
+    name = 'status_transition_y%04dm%02d' % (start.year, start.month)
+    pending = session.info.setdefault(_PENDING_PARTITIONS, set())
+    if name in _known_partitions or name in pending:
+        return
+    session.execute(select([func.pg_advisory_xact_lock(PARTITION_LOCK_KEY)]))
+    session.execute(_CREATE_PARTITION.format(name=name, start=start, stop=stop))
+    pending.add(name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _partitions_committed(session):
+    _known_partitions.update(session.info.pop(_PENDING_PARTITIONS, ()))
+
+
+# noinspection PyUnusedLocal
+@event.listens_for(Session, 'after_soft_rollback')
+def _partitions_rolled_back(session, previous_transaction):
+    # the partitions were rolled back with the transaction and are created again by the next insert
+    session.info.pop(_PENDING_PARTITIONS, None)
+
+
+def record_transitions(session, transitions):
+    """
+    Append status transitions with a single multi-row insert
+    :param session: sqlalchemy session object
+    :param transitions: list of dictionaries matching the status_transition columns
+    """
+    if not transitions:
+        return
+    if is_partitioned(session):
+        for month in {month_bounds(t['transition_time'])[0] for t in transitions}:
+            ensure_partition(session, month)
+    session.execute(status_transition.insert(), transitions)
+
+
+def split_days(start, stop):
+    """
+    Split the interval [start, stop) at midnight
+    :return: list of (date, seconds) tuples
+    """
+    pieces = []
+    while start < stop:
+        midnight = datetime.datetime.combine(start.date() + datetime.timedelta(days=1), datetime.time())
+        end = min(midnight, stop)
+        pieces.append((start.date(), (end - start).total_seconds()))
+        start = end
+    return pieces
+
+
+def _rollup_status_expression(status):
+    return case([
+        (func.bool_or(status == StatusEnum.FAILED), StatusEnum.FAILED),
+        (func.bool_or(status == StatusEnum.DEGRADED), StatusEnum.DEGRADED),
+        (func.bool_or(status == StatusEnum.OPERATIONAL), StatusEnum.OPERATIONAL),
+    ], else_=StatusEnum.NOT_TRACKED)
+
+
+def _accumulate(table, key_column, source):
+    insert = postgresql.insert(table).from_select([key_column, 'day', 'status', 'seconds'], source)
+    return insert.on_conflict_do_update(
+        index_elements=[key_column, 'day', 'status'],
+        set_={'seconds': table.c.seconds + insert.excluded.seconds})
+
+
+def accrue_status_time(session, now, max_gap):
+    """
+    Add the time since the previous accrual to the daily aggregates of every deployed stream and reference
+    designator, attributed to their current status. Must be called before new statuses are written.
+    :param session: sqlalchemy session object (inside a transaction)
+    :param now: end of the interval to accrue
+    :param max_gap: timedelta, longer intervals (the monitor was not running) are truncated to this length
+    :return: number of seconds accrued
+    """
+    accrued_until = session.execute(
+        select([status_accrual.c.accrued_until]).where(status_accrual.c.id == ACCRUAL_ID).with_for_update()
+    ).scalar()
+    if accrued_until is None:
+        session.execute(status_accrual.insert().values(id=ACCRUAL_ID, accrued_until=now))
+        return 0
+    if accrued_until >= now:
+        return 0
+
+    start = max(accrued_until, now - max_gap)
+    if start > accrued_until:
+        log.warning('Status accrual skipped %s while the monitor was not running', start - accrued_until)
+    session.execute(status_accrual.update().where(status_accrual.c.id == ACCRUAL_ID).values(accrued_until=now))
+
+    ds = DeployedStream.__table__
+    for day, seconds in split_days(start, now):
+        streams = select([ds.c.id, literal(day, Date), ds.c.status, literal(seconds, Float)])
+        session.execute(_accumulate(stream_status_daily, 'deployed_stream_id', streams))
+
+        instruments = select([ds.c.reference_designator_id, literal(day, Date),
+                              _rollup_status_expression(ds.c.status), literal(seconds, Float)]
+                             ).group_by(ds.c.reference_designator_id)
+        session.execute(_accumulate(instrument_status_daily, 'reference_designator_id', instruments))
+    return (now - start).total_seconds()
+
+
+def _uptime(rows, start, end):
+    seconds = {status: 0.0 for status in (StatusEnum.OPERATIONAL, StatusEnum.DEGRADED,
+                                          StatusEnum.FAILED, StatusEnum.NOT_TRACKED)}
+    for status, total in rows:
+        seconds[status] = seconds.get(status, 0.0) + total
+    tracked = seconds[StatusEnum.OPERATIONAL] + seconds[StatusEnum.DEGRADED] + seconds[StatusEnum.FAILED]
+    return {
+        'start': start,
+        'end': end,
+        'seconds': seconds,
+        'uptime': 100.0 * seconds[StatusEnum.OPERATIONAL] / tracked if tracked else None,
+        'available': 100.0 * (seconds[StatusEnum.OPERATIONAL] + seconds[StatusEnum.DEGRADED]) / tracked
+        if tracked else None,
+    }
+
+
+def _uptime_query(session, table, key_column, key, start, end):
+    query = session.query(table.c.status, func.sum(table.c.seconds)).filter(
+        table.c[key_column] == key,
+        table.c.day >= start,
+        table.c.day < end,
+    ).group_by(table.c.status)
+    return _uptime(query, start, end)
+
+
+def get_stream_uptime(session, deployed_id, start, end):
+    """
+    Time in each status and uptime percentage of a deployed stream from the daily aggregates
+    :param start: first day (inclusive)
+    :param end: last day (exclusive)
+    :return: dictionary of seconds per status, uptime (operational / tracked) and available
+             ((operational + degraded) / tracked) percentages, None if the stream was never tracked
+    """
+    result = _uptime_query(session, stream_status_daily, 'deployed_stream_id', deployed_id, start, end)
+    result['deployed_id'] = deployed_id
+    return result
+
+
+def get_instrument_uptime(session, refdes_id, start, end):
+    """
+    Time in each rolled up status and uptime percentage of a reference designator from the daily aggregates
+    """
+    result = _uptime_query(session, instrument_status_daily, 'reference_designator_id', refdes_id, start, end)
+    result['refdes_id'] = refdes_id
+    return result
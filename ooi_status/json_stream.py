@@ -0,0 +1,141 @@
+"""
+Incremental JSON encoding with optional gzip/deflate compression.
+
+Lists, tuples, generators and other iterators are encoded element by element so a response body
+can be sent while the rows backing it are still being produced.
+"""
+import zlib
+
+import six
+
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
+
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+
+# wbits values selecting the gzip or zlib (HTTP "deflate") container
+_WBITS = {
+    GZIP: 16 + zlib.MAX_WBITS,
+    DEFLATE: zlib.MAX_WBITS,
+}
+
+_ITERABLE_TYPES = (list, tuple, Iterator)
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Select a content encoding from an Accept-Encoding header value
+    :param accept_encoding: raw Accept-Encoding header value (may be None)
+    :return: GZIP, DEFLATE or None if the client does not accept either
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        fields = part.strip().split(';')
+        coding = fields[0].strip().lower()
+        quality = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+
+    for coding in (GZIP, DEFLATE):
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > 0:
+            return coding
+    return None
+
+
+def iterencode(obj, encoder):
+    """
+    Encode obj as JSON, yielding text fragments as they are produced
+    :param obj: object to encode, iterators are consumed lazily and encoded as JSON arrays
+    :param encoder: json.JSONEncoder instance used for all scalar values and as_dict/datetime handling
+    :return: generator yielding JSON text fragments
+    """
+    if isinstance(obj, dict):
+        yield '{'
+        items = [(key if isinstance(key, six.string_types) else six.text_type(key), value)
+                 for key, value in obj.items()]
+        if encoder.sort_keys:
+            items.sort(key=lambda item: item[0])
+        first = True
+        for key, value in items:
+            if not first:
+                yield ','
+            first = False
+            yield encoder.encode(key)
+            yield ':'
+            for chunk in iterencode(value, encoder):
+                yield chunk
+        yield '}'
+
+    elif isinstance(obj, _ITERABLE_TYPES):
+        yield '['
+        first = True
+        for value in obj:
+            if not first:
+                yield ','
+            first = False
+            for chunk in iterencode(value, encoder):
+                yield chunk
+        yield ']'
+
+    elif hasattr(obj, 'as_dict'):
+        for chunk in iterencode(obj.as_dict(), encoder):
+            yield chunk
+
+    else:
+        for chunk in encoder.iterencode(obj):
+            yield chunk
+
+
+def buffer_chunks(fragments, chunk_size):
+    """
+    Coalesce small text fragments into utf-8 encoded chunks of at least chunk_size bytes
+    """
+    buf = []
+    size = 0
+    for fragment in fragments:
+        if isinstance(fragment, six.text_type):
+            fragment = fragment.encode('utf-8')
+        buf.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            yield b''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield b''.join(buf)
+
+
+def compress_chunks(chunks, encoding, level=6):
+    """
+    Compress a stream of byte chunks. Each input chunk is sync-flushed so the client
+    can begin decoding before the full body has been produced.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_json(obj, encoder, encoding=None, chunk_size=16384, level=6):
+    """
+    Produce the complete (optionally compressed) JSON body for obj as a generator of byte chunks
+    """
+    chunks = buffer_chunks(iterencode(obj, encoder), chunk_size)
+    if encoding is not None:
+        chunks = compress_chunks(chunks, encoding, level)
+    return chunks
@@ -0,0 +1,165 @@
+"""
+Local mirror of the active streams in the metadata database.
+
+get_active_streams joins stream_metadata, xdeployment and xasset on every cycle. ActiveStreamMirror runs that join
+once and afterwards only pulls:
+
+* streams whose last particle time is newer than the watermark (minus an overlap for late arriving rows)
+* the list of active deployments, every METADATA_MIRROR_DEPLOYMENT_MINUTES, loading the streams of new ones
+
+The full join is repeated every METADATA_MIRROR_RESYNC_MINUTES to pick up anything the incremental
+refreshes cannot see, such as a stream receiving data older than the watermark.
+"""
+import datetime
+import logging
+from collections import namedtuple
+
+from . import metrics
+from .get_logger import get_logger
+from .metadata_queries import (ActiveStream, FETCH_BATCH_SIZE, get_active_deployments, get_active_stream_rows,
+                               get_stream_lasts, stream_query)
+
+log = get_logger(__name__, logging.INFO)
+
+MIRROR_ROWS = metrics.counter('ooi_status_metadata_mirror_rows_total', 'Rows pulled into the metadata mirror',
+                              ['refresh'])
+MIRROR_STREAMS = metrics.gauge('ooi_status_metadata_mirror_streams', 'Streams held in the metadata mirror')
+
+
+Deployment = namedtuple('Deployment', 'uid start stop')
+
+
+class ActiveStreamMirror(object):
+    """
+    :param overlap: timedelta subtracted from the watermark for each incremental refresh
+    :param deployment_interval: timedelta between refreshes of the active deployments
+    :param resync_interval: timedelta between full reloads
+    :param batch_size: number of rows fetched at a time from the server side cursor during a full reload
+    """
+    def __init__(self, overlap=datetime.timedelta(hours=1), deployment_interval=datetime.timedelta(minutes=10),
+                 resync_interval=datetime.timedelta(hours=1), batch_size=FETCH_BATCH_SIZE):
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.deployment_interval = deployment_interval
+        self.resync_interval = resync_interval
+        self.deployments = {}
+        self.streams = {}
+        self.watermark = None
+        self.last_resync = None
+        self.last_deployment_refresh = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(overlap=datetime.timedelta(minutes=config.get('METADATA_MIRROR_OVERLAP_MINUTES', 60)),
+                   deployment_interval=datetime.timedelta(
+                       minutes=config.get('METADATA_MIRROR_DEPLOYMENT_MINUTES', 10)),
+                   resync_interval=datetime.timedelta(minutes=config.get('METADATA_MIRROR_RESYNC_MINUTES', 60)),
+                   batch_size=config.get('METADATA_FETCH_BATCH', FETCH_BATCH_SIZE))
+
+    def _set_last(self, key, last, now):
+        self.streams[key] = last
+        if last is None:
+            return
+        # a future last (clock skew, bad instrument time) must not move the watermark ahead of the present,
+        # incremental refreshes would otherwise return nothing until the next resync
+        last = min(last, now)
+        if self.watermark is None or last > self.watermark:
+            self.watermark = last
+
+    def resync(self, session, now):
+        """
+        Reload every active stream and deployment with a single join
+        """
+        deployments = {}
+        self.streams = {}
+        self.watermark = None
+        count = 0
+        rows = stream_query(get_active_stream_rows(session), self.batch_size)
+        for subsite, node, sensor, method, stream, last, uid, start, stop in rows:
+            count += 1
+            self._choose_deployment(deployments, (subsite, node, sensor), Deployment(uid, start, stop))
+            self._set_last((subsite, node, sensor, method, stream), last, now)
+        self.deployments = deployments
+        self.last_resync = self.last_deployment_refresh = now
+        MIRROR_ROWS.labels('resync').inc(count)
+        log.info('Metadata mirror loaded %d streams for %d deployments', len(self.streams), len(deployments))
+
+    @staticmethod
+    def _choose_deployment(deployments, sensor, deployment):
+        # like get_current_deployment, prefer the most recently started deployment
+        current = deployments.get(sensor)
+        if current is None or (deployment.start is not None and
+                               (current.start is None or deployment.start > current.start)):
+            deployments[sensor] = deployment
+
+    def refresh_deployments(self, session, now):
+        """
+        Reload the active deployments, dropping the streams of ended deployments and loading those of new ones
+        """
+        deployments = {}
+        for subsite, node, sensor, uid, start, stop in get_active_deployments(session):
+            self._choose_deployment(deployments, (subsite, node, sensor), Deployment(uid, start, stop))
+
+        added = set(deployments) - set(self.deployments)
+        removed = set(self.deployments) - set(deployments)
+        self.deployments = deployments
+        if removed:
+            self.streams = {key: last for key, last in self.streams.items() if key[:3] not in removed}
+        if added:
+            count = 0
+            for row in get_stream_lasts(session, sensors=added):
+                count += 1
+                self._set_last(tuple(row[:5]), row[5], now)
+            MIRROR_ROWS.labels('deployments').inc(count)
+        if added or removed:
+            log.info('Metadata mirror deployments: %d added, %d removed', len(added), len(removed))
+        self.last_deployment_refresh = now
+
+    def refresh_streams(self, session, streams=None):
+        """
+        Pull the last particle time of streams which changed since the watermark, or of the given streams
+        """
+        now = datetime.datetime.utcnow()
+        if streams is not None:
+            query = get_stream_lasts(session, streams=streams)
+        else:
+            since = self.watermark - self.overlap if self.watermark is not None else None
+            query = get_stream_lasts(session, since=since)
+
+        count = 0
+        for row in query:
+            count += 1
+            key = tuple(row[:5])
+            if key[:3] in self.deployments:
+                self._set_last(key, row[5], now)
+        MIRROR_ROWS.labels('incremental').inc(count)
+
+    def refresh(self, session, streams=None):
+        now = datetime.datetime.utcnow()
+        if self.last_resync is None or now - self.last_resync >= self.resync_interval:
+            self.resync(session, now)
+            return
+        if now - self.last_deployment_refresh >= self.deployment_interval:
+            self.refresh_deployments(session, now)
+        self.refresh_streams(session, streams)
+
+    def active_streams(self, session, streams=None):
+        """
+        Refresh the mirror and yield the active streams in the same form as get_active_streams
+        :param session: metadata database session
+        :param streams: optional collection of (subsite, node, sensor, method, stream) tuples to restrict the result to
+        :return: (ActiveStream, TimeDelta(since last particle), String(Asset UID))
+        """
+        self.refresh(session, streams)
+        MIRROR_STREAMS.set(len(self.streams))
+
+        now = datetime.datetime.utcnow()
+        keys = self.streams if streams is None else [key for key in streams if key in self.streams]
+        for key in keys:
+            last = self.streams[key]
+            deployment = self.deployments.get(key[:3])
+            if last is None or deployment is None:
+                continue
+            if deployment.stop is not None and deployment.stop <= now:
+                continue
+            yield ActiveStream(key[0], key[1], key[2], key[3], key[4], last), now - last, deployment.uid
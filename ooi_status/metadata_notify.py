@@ -0,0 +1,177 @@
+"""
+Event driven status checks using Postgres LISTEN/NOTIFY on the stream metadata table.
+
+Triggers on stream_metadata publish the stream key whenever a row is inserted or its last particle time
+changes. MetadataListener receives these notifications on a dedicated connection and, after a short debounce
+window, passes the distinct stream keys to a callback (StatusMonitor.check_streams).
+"""
+import json
+import logging
+import select
+import threading
+import time
+
+from ooi_data.postgres import model
+
+from . import metrics
+from .get_logger import get_logger
+
+log = get_logger(__name__, logging.INFO)
+
+NOTIFICATIONS = metrics.counter('ooi_status_metadata_notifications_total', 'Stream metadata notifications received')
+
+FUNCTION_NAME = 'ooi_status_notify_stream_metadata'
+TRIGGER_NAME = 'ooi_status_stream_metadata_notify'
+INSERT_TRIGGER_NAME = TRIGGER_NAME + '_insert'
+UPDATE_TRIGGER_NAME = TRIGGER_NAME + '_update'
+
+# the function never reads OLD (unassigned during INSERT before PG 11), the update trigger only fires for
+# changes to last
+_CREATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', json_build_array(NEW.subsite, NEW.node, NEW.sensor,
+                                                    NEW.method, NEW.stream)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+_DROP_TRIGGER = 'DROP TRIGGER IF EXISTS {trigger} ON {table}'
+_CREATE_INSERT_TRIGGER = """
+CREATE TRIGGER {insert_trigger} AFTER INSERT ON {table}
+FOR EACH ROW EXECUTE PROCEDURE {function}()
+"""
+_CREATE_UPDATE_TRIGGER = """
+CREATE TRIGGER {update_trigger} AFTER UPDATE OF last ON {table}
+FOR EACH ROW WHEN (OLD.last IS DISTINCT FROM NEW.last) EXECUTE PROCEDURE {function}()
+"""
+_DROP_FUNCTION = 'DROP FUNCTION IF EXISTS {function}()'
+
+
+def _format(sql, channel, trigger=TRIGGER_NAME):
+    return sql.format(function=FUNCTION_NAME, trigger=trigger, insert_trigger=INSERT_TRIGGER_NAME,
+                      update_trigger=UPDATE_TRIGGER_NAME, channel=channel, table=model.StreamMetadatum.__tablename__)
+
+
+def _drop_triggers():
+    # TRIGGER_NAME is the combined insert/update trigger installed by earlier versions
+    return [_format(_DROP_TRIGGER, '', trigger) for trigger in (TRIGGER_NAME, INSERT_TRIGGER_NAME, UPDATE_TRIGGER_NAME)]
+
+
+def install_statements(channel):
+    """
+    :return: list of the SQL statements creating (or replacing) the notification function and triggers
+    """
+    return ([_format(_CREATE_FUNCTION, channel)] + _drop_triggers() +
+            [_format(_CREATE_INSERT_TRIGGER, channel), _format(_CREATE_UPDATE_TRIGGER, channel)])
+
+
+def install_trigger(engine, channel):
+    """
+    Create (or replace) the notification triggers on the stream metadata table
+    """
+    with engine.begin() as conn:
+        for sql in install_statements(channel):
+            conn.execute(sql)
+    log.info('Installed %s triggers on %s', channel, model.StreamMetadatum.__tablename__)
+
+
+def remove_trigger(engine):
+    with engine.begin() as conn:
+        for sql in _drop_triggers() + [_format(_DROP_FUNCTION, '')]:
+            conn.execute(sql)
+
+
+def parse_payload(payload):
+    """
+    :return: (subsite, node, sensor, method, stream) tuple or None if the payload is not a stream key
+    """
+    try:
+        key = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(key, list) or len(key) != 5:
+        return None
+    return tuple(key)
+
+
+class MetadataListener(object):
+    """
+    Listen for stream metadata notifications and call back with the changed stream keys
+    :param engine: database engine
+    :param channel: notification channel
+    :param callback: called with a set of (subsite, node, sensor, method, stream) tuples, or None when
+                     notifications may have been missed (after reconnecting) and every stream should be checked
+    :param debounce: seconds to collect notifications before calling back
+    :param parse: function converting a payload to the key passed to the callback (None ignores the payload),
+                  other triggers can be followed with the same listener by replacing parse_payload
+    """
+    def __init__(self, engine, channel, callback, debounce=2.0, reconnect_seconds=10, parse=parse_payload):
+        self.engine = engine
+        self.channel = channel
+        self.callback = callback
+        self.debounce = debounce
+        self.parse = parse
+        self.reconnect_seconds = reconnect_seconds
+        self.should_stop = False
+        self._thread = None
+
+    def _connect(self):
+        conn = self.engine.raw_connection()
+        # LISTEN only takes effect outside of a transaction
+        conn.connection.set_session(autocommit=True)
+        conn.cursor().execute('LISTEN "%s"' % self.channel)
+        log.info('Listening for notifications on %s', self.channel)
+        return conn
+
+    def _listen(self, conn):
+        dbapi_conn = conn.connection
+        pending = set()
+        deadline = None
+        while not self.should_stop:
+            timeout = 1.0 if deadline is None else max(deadline - time.time(), 0)
+            if select.select([dbapi_conn], [], [], timeout) != ([], [], []):
+                dbapi_conn.poll()
+                while dbapi_conn.notifies:
+                    notify = dbapi_conn.notifies.pop(0)
+                    key = self.parse(notify.payload)
+                    NOTIFICATIONS.inc()
+                    if key is not None:
+                        pending.add(key)
+                if pending and deadline is None:
+                    deadline = time.time() + self.debounce
+
+            if deadline is not None and time.time() >= deadline:
+                keys, pending, deadline = pending, set(), None
+                self._call(keys)
+
+    def _call(self, keys):
+        try:
+            self.callback(keys)
+        except Exception:
+            log.exception('Error handling notifications on %s', self.channel)
+
+    def run(self):
+        first = True
+        while not self.should_stop:
+            conn = None
+            try:
+                conn = self._connect()
+                if not first:
+                    # notifications sent while disconnected are lost
+                    self._call(None)
+                first = False
+                self._listen(conn)
+            except Exception:
+                log.exception('Listener on %s failed, reconnecting in %ds', self.channel, self.reconnect_seconds)
+                time.sleep(self.reconnect_seconds)
+            finally:
+                if conn is not None:
+                    # the LISTEN registration must not be returned to the pool
+                    conn.invalidate()
+
+    def start_thread(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self._thread
@@ -1,8 +1,8 @@
 import datetime
+from collections import namedtuple
 
-import pandas as pd
 from ooi_data.postgres import model
-from sqlalchemy import func, not_, or_
+from sqlalchemy import case, func, not_, or_, tuple_
 
 from .get_logger import get_logger
 
@@ -21,6 +21,7 @@ data_categories = {
 
 EVEN_DEPLOYMENT = '#0073cf'
 ODD_DEPLOYMENT = '#cf5c00'
+EPOCH = datetime.datetime(1970, 1, 1)
 
 
 def get_data(session, subsite, node, sensor, method, stream, lower_bound, upper_bound):
@@ -36,6 +37,7 @@ def get_data(session, subsite, node, sensor, method, stream, lower_bound, upper_
     :param upper_bound: datetime object representing the upper time bound of this query
     :return: pandas DataFrame containing all partition metadata records matching the above criteria
     """
+    import pandas as pd
     pm = model.PartitionMetadatum
     filters = [
         pm.subsite == subsite,
@@ -55,7 +57,7 @@ def get_data(session, subsite, node, sensor, method, stream, lower_bound, upper_
     ]
 
     query = session.query(*fields).filter(*filters).order_by(pm.bin)
-    df = pd.read_sql_query(query.statement, query.session.bind, index_col='bin')
+    df = pd.read_sql_query(query.statement, query.session.get_bind(), index_col='bin')
     return df
 
 
@@ -131,16 +133,18 @@ def find_data_spans(session, subsite, node, sensor, method, stream, lower_bound,
     return available
 
 
-def filter_spans(spans, deploy_data):
+def filter_spans(spans, deploy_data, new_spans=None):
     """
     Given an ordered list of spans and an ordered list of deployment bounds,
     filter all spans to inside the bounds of the deployments.
     :param spans: tuples representing (start, span_type, stop)
     :param deploy_data: tuples representing (start, deployment number, stop)
+    :param new_spans: list (or CompactSpans) the adjusted spans are appended to, a new list by default
     :return: spans adjusted to fit inside deployment bounds
     """
     index = 0
-    new_spans = []
+    if new_spans is None:
+        new_spans = []
     for start, _, stop in deploy_data:
         for span_start, span_type, span_stop, in spans:
             if span_start > stop:
@@ -159,6 +163,71 @@ def filter_spans(spans, deploy_data):
     return new_spans
 
 
+def epoch_millis(value):
+    """
+    :param value: datetime (or pandas Timestamp)
+    :return: integer milliseconds since the unix epoch
+    """
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+class CompactSpans(object):
+    """
+    Span sink for the compact availability format. Spans are appended as (start, span_type, stop) like to a list
+    but stored as parallel columns: start and stop in milliseconds since the unix epoch and the span type as an
+    index into the sorted category names.
+    :param categories: dictionary mapping span type to its display properties
+    """
+    def __init__(self, categories):
+        self.categories = categories
+        self.names = sorted(categories)
+        self.codes = {name: code for code, name in enumerate(self.names)}
+        self.start = []
+        self.stop = []
+        self.category = []
+
+    def __len__(self):
+        return len(self.start)
+
+    def append(self, span):
+        start, span_type, stop = span
+        self.start.append(epoch_millis(start))
+        self.category.append(self.codes[span_type])
+        self.stop.append(epoch_millis(stop))
+
+    def extend(self, spans):
+        for span in spans:
+            self.append(span)
+
+    def measure(self, name):
+        """
+        :return: compact measure dictionary containing measure, categories, start, stop and category
+        """
+        categories = []
+        for category in self.names:
+            category_info = {'name': category}
+            category_info.update(self.categories[category])
+            categories.append(category_info)
+        return {
+            'measure': name,
+            'categories': categories,
+            'start': self.start,
+            'stop': self.stop,
+            'category': self.category,
+        }
+
+
+def _measure(name, spans, categories, compact):
+    if not compact:
+        return {'measure': name, 'data': spans, 'categories': categories}
+    if not isinstance(spans, CompactSpans):
+        columns = CompactSpans(categories)
+        columns.extend(spans)
+        spans = columns
+    return spans.measure(name)
+
+
 def find_instrument_availability(session, refdes, method=None, stream=None, lower_bound=None, upper_bound=None):
     """
     :param session: sqlalchemy session object
@@ -169,7 +238,30 @@ def find_instrument_availability(session, refdes, method=None, stream=None, lowe
     :param upper_bound: datetime object representing the upper time bound of this query
     :return: visavail.js compatible representation of the data availability for this query
     """
-    subsite, node, sensor = refdes.split('-', 2)
+    return list(iter_instrument_availability(session, refdes, method=method, stream=stream,
+                                             lower_bound=lower_bound, upper_bound=upper_bound))
+
+
+def iter_instrument_availability(session, refdes, method=None, stream=None, lower_bound=None, upper_bound=None,
+                                 compact=False):
+    """
+    Generator version of find_instrument_availability, yields each measure as soon as it has been computed.
+    The reference designator is validated and the deployments and streams are queried before returning, so
+    errors are raised to the caller rather than part way through a streamed response.
+    :param session: sqlalchemy session object
+    :param refdes: Instrument reference designator
+    :param method: stream delivery method
+    :param stream: stream name
+    :param lower_bound: datetime object representing the lower time bound of this query
+    :param upper_bound: datetime object representing the upper time bound of this query
+    :param compact: yield measures in the compact columnar format (see CompactSpans)
+    :return: generator yielding visavail.js compatible measures
+    :raises ValueError: if refdes is not a subsite-node-sensor reference designator
+    """
+    parts = refdes.split('-', 2)
+    if len(parts) != 3 or not all(parts):
+        raise ValueError('Invalid reference designator: %r' % refdes)
+    subsite, node, sensor = parts
     now = datetime.datetime.utcnow()
     if upper_bound is None or upper_bound > now:
         upper_bound = now
@@ -177,7 +269,6 @@ def find_instrument_availability(session, refdes, method=None, stream=None, lowe
     if lower_bound is None:
         lower_bound = session.query(func.min(model.Xdeployment.eventstarttime).label('first')).first().first
 
-    avail = []
     deploy_data = []
     categories = {}
 
@@ -200,9 +291,9 @@ def find_instrument_availability(session, refdes, method=None, stream=None, lowe
         else:
             categories[name] = {'color': ODD_DEPLOYMENT}
 
+    measures = []
     if deploy_data:
-        avail.append({'measure': 'Deployments', 'data': deploy_data,
-                      'categories': categories})
+        measures.append(_measure('Deployments', deploy_data, categories, compact))
 
         # update bounds based on deployment data
         deployment_lower_bound = min((x[0] for x in deploy_data))
@@ -232,60 +323,208 @@ def find_instrument_availability(session, refdes, method=None, stream=None, lowe
     if stream:
         filters.append(model.StreamMetadatum.stream == stream)
 
-    query = query.filter(*filters)
+    streams = query.filter(*filters).all()
+    return _iter_stream_measures(session, subsite, node, sensor, measures, streams, deploy_data,
+                                 lower_bound, upper_bound, compact)
+
+
+def _iter_stream_measures(session, subsite, node, sensor, measures, streams, deploy_data, lower_bound, upper_bound,
+                          compact):
+    """
+    Yield the measures computed so far, then fetch and yield the gaps of each stream
+    """
+    for measure in measures:
+        yield measure
 
     # Fetch gaps for all streams found
-    for row in query:
+    for row in streams:
         gaps = find_data_spans(session, subsite, node, sensor, row.method, row.stream, lower_bound, upper_bound)
-        gaps = filter_spans(gaps, deploy_data)
-        if gaps:
-            avail.append({
-                'measure': '%s %s' % (row.method, row.stream),
-                'data': gaps,
-                'categories': data_categories
-            })
-        else:
-            avail.append({
-                'measure': '%s %s' % (row.method, row.stream),
-                'data': [(lower_bound, NOT_EXPECTED, lower_bound)],
-                'categories': data_categories
-            })
+        # compact spans are converted as they are filtered
+        gaps = filter_spans(gaps, deploy_data, CompactSpans(data_categories) if compact else None)
+        if not gaps:
+            gaps = [(lower_bound, NOT_EXPECTED, lower_bound)]
+        yield _measure('%s %s' % (row.method, row.stream), gaps, data_categories, compact)
+
+
+def compact_measure(measure):
+    """
+    Convert a visavail.js measure into a compact columnar form. Span boundaries are encoded
+    as integer milliseconds since the unix epoch and span types as indexes into the category list.
+    The API builds compact measures directly, see iter_instrument_availability(compact=True).
+    :param measure: dictionary as produced by iter_instrument_availability
+    :return: dictionary containing measure, categories, start, stop and category
+    """
+    return _measure(measure['measure'], measure['data'], measure['categories'], True)
 
-    return avail
 
+ACTIVE_METHODS = ('telemetered', 'streamed')
+FETCH_BATCH_SIZE = 1000
 
-def get_all_streams(session):
+
+class ActiveStream(namedtuple('ActiveStream', 'subsite node sensor method stream last')):
     """
-    :param session: sqlalchemy session object
-    :return: generator yielding the reference designator, delivery method, stream name, start and stop for all streams
+    Compact stand-in for the StreamMetadatum fields used by the status monitor
     """
-    for row in session.query(model.StreamMetadatum):
-        yield row.refdes, row.method, row.stream, row.count, row.stop
+    __slots__ = ()
 
+    @property
+    def refdes(self):
+        return '-'.join((self.subsite, self.node, self.sensor))
 
-def get_active_streams(session):
+
+def stream_query(query, batch_size=FETCH_BATCH_SIZE):
     """
-    Return all streams which are within an active deployment
-    :param session: sqlalchemy session object
-    :return: (StreamMetadatum, TimeDelta(since last particle), String(Asset UID))
+    Fetch the rows of a query through a server side (named) cursor, batch_size rows at a time,
+    instead of letting psycopg2 buffer the whole result set in memory
     """
-    now = datetime.datetime.utcnow()
-    for sm, assetid, uid in session.query(
-        model.StreamMetadatum,
-        model.Xdeployment.sassetid,
-        model.Xasset.uid
-    ).filter(
-        model.StreamMetadatum.subsite == model.Xdeployment.subsite,
-        model.StreamMetadatum.node == model.Xdeployment.node,
-        model.StreamMetadatum.sensor == model.Xdeployment.sensor,
-        model.StreamMetadatum.method.in_(['telemetered', 'streamed']),
+    return query.execution_options(stream_results=True).yield_per(batch_size)
+
+
+def _active_deployment_filters(now):
+    return [
         model.Xdeployment.sassetid == model.Xasset.assetid,
         or_(
             model.Xdeployment.eventstoptime.is_(None),
             model.Xdeployment.eventstoptime > now
         )
-    ):
-        yield sm, now - sm.last, uid
+    ]
+
+
+def _stream_key_filter(streams):
+    sm = model.StreamMetadatum
+    return tuple_(sm.subsite, sm.node, sm.sensor, sm.method, sm.stream).in_(list(streams))
+
+
+def get_active_deployments(session):
+    """
+    Column-only query of the deployments which have not ended
+    :param session: sqlalchemy session object
+    :return: query yielding (subsite, node, sensor, asset uid, deployment start, deployment stop)
+    """
+    now = datetime.datetime.utcnow()
+    return session.query(
+        model.Xdeployment.subsite,
+        model.Xdeployment.node,
+        model.Xdeployment.sensor,
+        model.Xasset.uid,
+        model.Xdeployment.eventstarttime,
+        model.Xdeployment.eventstoptime,
+    ).filter(*_active_deployment_filters(now))
+
+
+def get_active_stream_rows(session, streams=None):
+    """
+    Column-only query of the streams which are within an active deployment
+    :param session: sqlalchemy session object
+    :param streams: optional collection of (subsite, node, sensor, method, stream) tuples to restrict the result to
+    :return: query yielding (subsite, node, sensor, method, stream, last, asset uid, deployment start, deployment stop)
+    """
+    now = datetime.datetime.utcnow()
+    sm = model.StreamMetadatum
+    query = session.query(
+        sm.subsite, sm.node, sm.sensor, sm.method, sm.stream, sm.last,
+        model.Xasset.uid,
+        model.Xdeployment.eventstarttime,
+        model.Xdeployment.eventstoptime,
+    ).filter(
+        sm.subsite == model.Xdeployment.subsite,
+        sm.node == model.Xdeployment.node,
+        sm.sensor == model.Xdeployment.sensor,
+        sm.method.in_(ACTIVE_METHODS),
+        *_active_deployment_filters(now)
+    )
+    if streams is not None:
+        query = query.filter(_stream_key_filter(streams))
+    return query
+
+
+def get_stream_lasts(session, since=None, sensors=None, streams=None):
+    """
+    Column-only query of the last particle time of telemetered and streamed streams
+    :param session: sqlalchemy session object
+    :param since: only streams whose last particle is newer than this datetime
+    :param sensors: only streams of these (subsite, node, sensor) tuples
+    :param streams: only these (subsite, node, sensor, method, stream) tuples
+    :return: query yielding (subsite, node, sensor, method, stream, last)
+    """
+    sm = model.StreamMetadatum
+    query = session.query(sm.subsite, sm.node, sm.sensor, sm.method, sm.stream, sm.last).filter(
+        sm.method.in_(ACTIVE_METHODS))
+    if since is not None:
+        query = query.filter(sm.last > since)
+    if sensors is not None:
+        query = query.filter(tuple_(sm.subsite, sm.node, sm.sensor).in_(list(sensors)))
+    if streams is not None:
+        query = query.filter(_stream_key_filter(streams))
+    return query
+
+
+def get_all_streams(session, batch_size=FETCH_BATCH_SIZE):
+    """
+    :param session: sqlalchemy session object
+    :param batch_size: number of rows fetched from the server side cursor at a time
+    :return: generator yielding the reference designator, delivery method, stream name, count and last particle time
+             for all streams
+    """
+    sm = model.StreamMetadatum
+    query = session.query(sm.subsite, sm.node, sm.sensor, sm.method, sm.stream, sm.count, sm.last)
+    for subsite, node, sensor, method, stream, count, last in stream_query(query, batch_size):
+        yield '-'.join((subsite, node, sensor)), method, stream, count, last
+
+
+def get_active_streams(session, streams=None, batch_size=FETCH_BATCH_SIZE):
+    """
+    Return all streams which are within an active deployment. Rows are fetched in batches from a server side
+    cursor, so the caller processes each batch while the remainder is still on the server.
+    :param session: sqlalchemy session object
+    :param streams: optional collection of (subsite, node, sensor, method, stream) tuples to restrict the result to
+    :param batch_size: number of rows fetched at a time
+    :return: (ActiveStream, TimeDelta(since last particle), String(Asset UID))
+    """
+    if streams is not None and not streams:
+        return
+    now = datetime.datetime.utcnow()
+    query = get_active_stream_rows(session, streams=streams)
+    for subsite, node, sensor, method, stream, last, uid, _, _ in stream_query(query, batch_size):
+        yield ActiveStream(subsite, node, sensor, method, stream, last), now - last, uid
+
+
+def get_partition_rows(session, lower_bound, upper_bound, methods=ACTIVE_METHODS):
+    """
+    Column-only query of the partition metadata of every stream overlapping a time window
+    :param session: sqlalchemy session object
+    :param lower_bound: datetime object representing the lower time bound of this query
+    :param upper_bound: datetime object representing the upper time bound of this query
+    :param methods: stream delivery methods to include
+    :return: query yielding (subsite, node, sensor, method, stream, first, last, count) ordered by stream and first
+    """
+    pm = model.PartitionMetadatum
+    return session.query(
+        pm.subsite, pm.node, pm.sensor, pm.method, pm.stream, pm.first, pm.last, pm.count
+    ).filter(
+        pm.method.in_(methods),
+        pm.last > lower_bound,
+        pm.first < upper_bound,
+    ).order_by(pm.subsite, pm.node, pm.sensor, pm.method, pm.stream, pm.first)
+
+
+def get_deployment_spans(session, lower_bound, upper_bound):
+    """
+    Column-only query of the first start and last stop (null if still deployed) of the deployments
+    of each instrument overlapping a time window
+    :return: query yielding (subsite, node, sensor, start, stop)
+    """
+    xd = model.Xdeployment
+    # a null stop time sorts last, so bool_or is needed to tell an open deployment from the latest stop
+    open_deployment = func.bool_or(xd.eventstoptime.is_(None))
+    return session.query(
+        xd.subsite, xd.node, xd.sensor,
+        func.min(xd.eventstarttime),
+        case([(open_deployment, None)], else_=func.max(xd.eventstoptime)),
+    ).filter(
+        or_(xd.eventstoptime > lower_bound, xd.eventstoptime.is_(None)),
+        xd.eventstarttime < upper_bound,
+    ).group_by(xd.subsite, xd.node, xd.sensor)
 
 
 def get_deployments(session, subsite, node, sensor, lower_bound=None, upper_bound=None):
@@ -0,0 +1,288 @@
+"""
+Lightweight in-process metrics (counters, gauges and histograms) exposed in the Prometheus text format.
+
+Metrics are created through the module level registry and may be shared freely between threads:
+
+    CHECKS = counter('ooi_status_checks_total', 'Number of checks performed', ['result'])
+    CHECKS.labels('ok').inc()
+
+    DURATION = histogram('ooi_status_check_seconds', 'Time spent checking')
+    with DURATION.time():
+        ...
+"""
+import bisect
+import functools
+import math
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+
+# time.monotonic is not available on python 2
+monotonic = getattr(time, 'monotonic', time.time)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Timer(object):
+    """
+    Observe the elapsed (monotonic) time of a block or function call into a histogram
+    """
+    def __init__(self, child):
+        self.child = child
+        self.start = None
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.child.observe(monotonic() - self.start)
+
+    def __call__(self, f):
+        @functools.wraps(f)
+        def decorated(*args, **kwargs):
+            with Timer(self.child):
+                return f(*args, **kwargs)
+        return decorated
+
+
+class CounterValue(object):
+    def __init__(self, metric):
+        self._lock = metric.lock
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented')
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield '', (), self.value
+
+
+class GaugeValue(object):
+    def __init__(self, metric):
+        self._lock = metric.lock
+        self.value = 0.0
+
+    def set(self, value):
+        with self._lock:
+            self.value = float(value)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set_to_current_time(self):
+        self.set(time.time())
+
+    def samples(self):
+        yield '', (), self.value
+
+
+class HistogramValue(object):
+    def __init__(self, metric):
+        self._lock = metric.lock
+        self.buckets = metric.buckets
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+            count = self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield '_bucket', (('le', _format_value(bound)),), cumulative
+        yield '_bucket', (('le', '+Inf'),), count
+        yield '_sum', (), total
+        yield '_count', (), count
+
+
+class Metric(object):
+    """
+    A named metric, optionally partitioned by label values. Metrics without labels forward
+    inc/set/observe/time directly to their single value.
+    """
+    value_class = None
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self._values = {}
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError('%s expects labels %r' % (self.name, self.labelnames))
+        key = tuple(str(v) for v in values)
+        value = self._values.get(key)
+        if value is None:
+            with self.lock:
+                value = self._values.get(key)
+                if value is None:
+                    value = self._values[key] = self.value_class(self)
+        return value
+
+    # conveniences for unlabelled metrics: metric.inc() == metric.labels().inc()
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_to_current_time(self):
+        self.labels().set_to_current_time()
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation.replace('\\', r'\\').replace('\n', r'\n')),
+            '# TYPE %s %s' % (self.name, self.type_name),
+        ]
+        for key, value in sorted(self._values.items()):
+            labels = tuple(zip(self.labelnames, key))
+            for suffix, extra, sample in value.samples():
+                lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(labels + extra),
+                                            _format_value(sample)))
+        return lines
+
+
+class Counter(Metric):
+    value_class = CounterValue
+    type_name = 'counter'
+
+
+class Gauge(Metric):
+    value_class = GaugeValue
+    type_name = 'gauge'
+
+
+class Histogram(Metric):
+    value_class = HistogramValue
+    type_name = 'histogram'
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def get_or_create(self, metric_class, name, documentation, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, metric_class) or metric.labelnames != tuple(labelnames):
+                raise ValueError('Metric %s already registered with a different type or labels' % name)
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.get_or_create(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.get_or_create(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                                                          .replace('\n', r'\n'))
+                             for name, value in labels)
+
+
+def _format_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if value == int(value):
+        return '%d' % value
+    return repr(float(value))
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # noinspection PyShadowingBuiltins
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port, addr=''):
+    """
+    Serve the metrics registry from a daemon thread (used by processes without a web framework)
+    :return: the running server
+    """
+    server = _ThreadingHTTPServer((addr, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
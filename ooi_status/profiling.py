@@ -0,0 +1,189 @@
+"""
+Opt-in cProfile capture for status monitor cycles and API requests.
+
+Profiles are written to PROFILE_DIR as <time>-<kind>-<name>.prof (loadable with pstats or snakeviz)
+next to a .json file describing the cycle or request. Only the newest PROFILE_KEEP profiles are kept.
+When PROFILE_DIR is not set every hook returns a shared no-op object.
+"""
+import cProfile
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from .get_logger import get_logger
+from .metrics import monotonic
+
+log = get_logger(__name__, logging.INFO)
+
+# cProfile profilers can't overlap (on Python 3.12+ not even across threads), and the greenlets of a gevent worker
+# share a thread, so only one capture is active per process and captures started meanwhile are skipped
+_active = threading.Lock()
+
+
+class NullCapture(object):
+    @property
+    def metadata(self):
+        # a fresh dictionary so callers may annotate a capture without checking whether profiling is enabled
+        return {}
+
+    def start(self):
+        return self
+
+    def stop(self, **metadata):
+        pass
+
+    def __enter__(self):
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_CAPTURE = NullCapture()
+
+
+class Capture(object):
+    """
+    A single profiling session. Profiles shorter than min_seconds are discarded.
+    """
+    def __init__(self, profiler, kind, name, min_seconds=None, metadata=None):
+        self.profiler = profiler
+        self.kind = kind
+        self.name = name
+        self.min_seconds = min_seconds
+        self.metadata = metadata or {}
+        self.profile = None
+        self.started = None
+        self._start = None
+
+    def start(self):
+        self.started = time.time()
+        self._start = monotonic()
+        if not _active.acquire(False):
+            log.debug('Skipping %s profile of %s, another capture is active', self.kind, self.name)
+            return self
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError:
+            # a profiler not started by this module is active
+            self.profile = None
+            _active.release()
+        return self
+
+    def stop(self, **metadata):
+        if self.profile is None:
+            return
+        try:
+            self.profile.disable()
+        finally:
+            _active.release()
+        duration = monotonic() - self._start
+        if self.min_seconds is None or duration >= self.min_seconds:
+            self.metadata.update(metadata)
+            self.profiler.write(self, duration)
+        self.profile = None
+
+    def __enter__(self):
+        return self.start()
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop(error=exc_type.__name__ if exc_type else None)
+
+
+class Profiler(object):
+    """
+    Decide which monitor cycles and API requests are profiled
+    :param directory: output directory, profiling is disabled when None
+    :param keep: number of profiles to retain
+    :param cycle_every: profile one monitor cycle in every N (0 disables cycle profiling)
+    :param routes: endpoint names or path prefixes whose requests are always profiled
+    :param slow_seconds: profile all other requests, keeping those which take at least this long
+    :param profile_requests: False disables request profiling (a request profile under gevent would include the
+                             frames of every greenlet scheduled while it runs)
+    """
+    def __init__(self, directory=None, keep=50, cycle_every=0, routes=(), slow_seconds=None, profile_requests=True):
+        self.directory = directory
+        self.enabled = directory is not None
+        self.profile_requests = profile_requests
+        self.keep = keep
+        self.cycle_every = cycle_every
+        self.routes = tuple(routes or ())
+        self.slow_seconds = slow_seconds
+        self._cycles = {}
+        self._lock = threading.Lock()
+
+        if self.enabled and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def from_config(cls, config, profile_requests=True):
+        return cls(directory=config.get('PROFILE_DIR'),
+                   keep=config.get('PROFILE_KEEP', 50),
+                   cycle_every=config.get('PROFILE_CYCLE_EVERY', 0),
+                   routes=config.get('PROFILE_ROUTES', ()),
+                   slow_seconds=config.get('PROFILE_SLOW_SECONDS'),
+                   profile_requests=profile_requests)
+
+    def cycle(self, name, **metadata):
+        """
+        Return a capture for the next monitor cycle of this name (a no-op unless it is sampled)
+        """
+        if not self.enabled or not self.cycle_every:
+            return NULL_CAPTURE
+        with self._lock:
+            count = self._cycles[name] = self._cycles.get(name, 0) + 1
+        if count % self.cycle_every:
+            return NULL_CAPTURE
+        metadata['cycle'] = count
+        return Capture(self, 'cycle', name, metadata=metadata)
+
+    def request(self, endpoint, path, method):
+        """
+        Return a capture for an API request (a no-op unless its route is selected or slow requests are kept)
+        """
+        if not self.enabled or not self.profile_requests:
+            return NULL_CAPTURE
+        metadata = {'endpoint': endpoint, 'path': path, 'method': method}
+        name = endpoint or 'unknown'
+        if any(endpoint == route or path.startswith(route) for route in self.routes):
+            return Capture(self, 'request', name, metadata=metadata)
+        if self.slow_seconds is not None:
+            return Capture(self, 'request', name, min_seconds=self.slow_seconds, metadata=metadata)
+        return NULL_CAPTURE
+
+    def write(self, capture, duration):
+        stamp = datetime.datetime.utcfromtimestamp(capture.started).strftime('%Y%m%dT%H%M%S.%f')
+        base = os.path.join(self.directory, '%s-%s-%s' % (stamp, capture.kind, re.sub(r'[^\w.]+', '_', capture.name)))
+
+        metadata = dict(capture.metadata)
+        metadata.update({
+            'kind': capture.kind,
+            'name': capture.name,
+            'started': capture.started,
+            'duration': duration,
+            'pid': os.getpid(),
+        })
+
+        with self._lock:
+            capture.profile.dump_stats(base + '.prof')
+            with open(base + '.json', 'w') as fh:
+                json.dump(metadata, fh, indent=2, sort_keys=True, default=str)
+            self._rotate()
+        log.info('Wrote profile %s.prof (%.3fs)', base, duration)
+
+    def _rotate(self):
+        profiles = sorted(glob.glob(os.path.join(self.directory, '*.prof')))
+        for path in profiles[:max(len(profiles) - self.keep, 0)]:
+            for filename in (path, path[:-len('.prof')] + '.json'):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
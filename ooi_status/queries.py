@@ -2,8 +2,10 @@ import logging
 from collections import Counter
 from datetime import timedelta, datetime
 
-import pandas as pd
 from ooi_data.postgres.model import ExpectedStream, DeployedStream, PortCount, ReferenceDesignator
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import contains_eager, joinedload
 from sqlalchemy.sql.elements import and_
 
 from .get_logger import get_logger
@@ -13,7 +15,19 @@ log = get_logger(__name__, logging.INFO)
 
 
 def get_status_query(session, filter_refdes=None, filter_method=None, filter_status=None, filter_stream=None):
-    query = session.query(DeployedStream).join(ExpectedStream, ReferenceDesignator)
+    """
+    Query returning the matching deployed streams with their reference designator and expected stream
+    populated from the same joined SELECT (no lazy loads when serializing)
+    """
+    query = _filter_status_query(session.query(DeployedStream), filter_refdes=filter_refdes,
+                                 filter_method=filter_method, filter_status=filter_status,
+                                 filter_stream=filter_stream)
+    return query.options(contains_eager(DeployedStream.expected_stream),
+                         contains_eager(DeployedStream.reference_designator))
+
+
+def _filter_status_query(query, filter_refdes=None, filter_method=None, filter_status=None, filter_stream=None):
+    query = query.join(ExpectedStream, ReferenceDesignator)
 
     filter_constraints = []
     if filter_refdes:
@@ -44,12 +58,53 @@ def resample_port_count(session, refdes_id, counts_df, seconds):
         return resampled
 
 
-def get_port_data_rates(session, refdes_id):
-    counts_df = get_port_rates_dataframe(session, refdes_id, None, None)
-    if not counts_df.empty:
-        counts_df = counts_df.resample('1H').mean()
-        counts_df['rate'] = counts_df.byte_count / counts_df.seconds
-    return counts_df
+def rate_bucket_seconds(start, end, max_points, minimum=3600, oversample=4):
+    """
+    Width of the buckets port counts are summed into before downsampling: at least minimum seconds, and wide
+    enough that the window holds no more than oversample * max_points buckets
+    :return: bucket width in seconds, a multiple of minimum
+    """
+    window = (end - start).total_seconds()
+    buckets = max(max_points * oversample, 1)
+    return int(minimum * max(-(-window // (buckets * minimum)), 1))
+
+
+def get_port_data_rates(session, refdes_ids, start, end, bucket_seconds=3600):
+    """
+    Port data rates of several instruments, summed into fixed width buckets by the database so that only one
+    row per bucket is transferred however many port counts the window holds
+    :param session: sqlalchemy session object
+    :param refdes_ids: reference designator ids
+    :param start: start of the window
+    :param end: end of the window (exclusive)
+    :param bucket_seconds: bucket width, see rate_bucket_seconds
+    :return: dictionary mapping reference designator id to (bucket start seconds since the epoch, bytes/second)
+             arrays, instruments without port counts in the window are omitted
+    """
+    import numpy as np
+    # the width is inlined so the grouped expression is identical in the select list and GROUP BY
+    width = literal_column(str(int(bucket_seconds)))
+    bucket = func.floor(func.extract('epoch', PortCount.collected_time) / width) * width
+    byte_count = func.sum(PortCount.byte_count)
+    seconds = func.sum(PortCount.seconds)
+    query = session.query(PortCount.reference_designator_id, bucket, byte_count, seconds).filter(
+        PortCount.reference_designator_id.in_(list(refdes_ids)),
+        PortCount.collected_time >= start,
+        PortCount.collected_time < end,
+    ).group_by(PortCount.reference_designator_id, bucket).having(seconds > 0).order_by(
+        PortCount.reference_designator_id, bucket)
+
+    rows = query.all()
+    if not rows:
+        return {}
+    refdes = np.array([row[0] for row in rows])
+    values = np.array([row[1:] for row in rows], dtype='f8')
+    # rows are ordered by reference designator, split them where it changes
+    splits = np.flatnonzero(refdes[1:] != refdes[:-1]) + 1
+    rates = {}
+    for group, part in zip(np.split(refdes, splits), np.split(values, splits)):
+        rates[int(group[0])] = part[:, 0], part[:, 1] / part[:, 2]
+    return rates
 
 
 def get_status_by_instrument(session, filter_refdes=None, filter_method=None, filter_stream=None, filter_status=None):
@@ -79,7 +134,7 @@ def get_status_by_instrument(session, filter_refdes=None, filter_method=None, fi
 
 
 def get_status_by_refdes_id(session, refdes_id):
-    query = session.query(DeployedStream).join(ReferenceDesignator).filter(ReferenceDesignator.id == refdes_id)
+    query = get_status_query(session).filter(ReferenceDesignator.id == refdes_id)
     streams = list(query)
     overall = _rollup_statuses(set(s.status for s in streams))
     return {
@@ -95,13 +150,207 @@ def get_status_by_stream(session, filter_refdes=None, filter_method=None, filter
     }
 
 
+def iter_status_by_stream(session, filter_refdes=None, filter_method=None, filter_stream=None, filter_status=None,
+                          batch_size=500):
+    """
+    Same as get_status_by_stream, but the matching streams are loaded in batches as the result is consumed
+    """
+    query = get_status_query(session, filter_refdes=filter_refdes, filter_method=filter_method,
+                             filter_stream=filter_stream, filter_status=filter_status)
+    return {
+        'status': iter(query.yield_per(batch_size))
+    }
+
+
 def get_status_by_stream_id(session, deployed_id):
-    return session.query(DeployedStream).get(deployed_id).first()
+    return session.query(DeployedStream).options(
+        joinedload(DeployedStream.expected_stream),
+        joinedload(DeployedStream.reference_designator)
+    ).filter(DeployedStream.id == deployed_id).first()
+
+
+#### BULK UPDATES ####
+
+THRESHOLD_FIELDS = ('expected_rate', 'warn_interval', 'fail_interval')
+
+
+def get_deployed_id_query(session, deployed_ids=None, refdes_names=None, filter_refdes=None, filter_method=None,
+                          filter_stream=None, filter_status=None):
+    """
+    Build a query selecting only the ids of the deployed streams matching the supplied ids and filters
+    """
+    query = _filter_status_query(session.query(DeployedStream.id),
+                                 filter_refdes=filter_refdes,
+                                 filter_method=filter_method,
+                                 filter_stream=filter_stream,
+                                 filter_status=filter_status)
+    if deployed_ids:
+        query = query.filter(DeployedStream.id.in_(deployed_ids))
+    if refdes_names:
+        query = query.filter(ReferenceDesignator.name.in_(refdes_names))
+    return query
+
+
+def bulk_update_deployed(session, values, **filters):
+    """
+    Apply threshold overrides to every matching deployed stream with a single UPDATE statement
+    :param session: sqlalchemy session object
+    :param values: dictionary mapping one or more of THRESHOLD_FIELDS to the new override value (None clears it)
+    :param filters: keyword arguments accepted by get_deployed_id_query
+    :return: number of deployed streams updated
+    """
+    updates = {getattr(DeployedStream, '_' + field): values[field] for field in THRESHOLD_FIELDS if field in values}
+    if not updates:
+        return 0
+    id_query = get_deployed_id_query(session, **filters)
+    # disable correlation so the subquery keeps its own joined FROM clause
+    query = session.query(DeployedStream).filter(DeployedStream.id.in_(id_query.statement.correlate(None)))
+    return query.update(updates, synchronize_session=False)
+
+
+def bulk_set_enabled(session, enabled, **filters):
+    """
+    Set-based equivalent of DeployedStream.enable/disable for every matching deployed stream.
+    Disabling zeroes all threshold overrides, enabling clears them so the expected stream values apply.
+    """
+    value = None if enabled else 0
+    return bulk_update_deployed(session, {field: value for field in THRESHOLD_FIELDS}, **filters)
+
+
+def bulk_update_expected(session, values, expected_ids=None, filter_method=None, filter_stream=None):
+    """
+    Apply new default thresholds to every matching expected stream with a single UPDATE statement
+    :param session: sqlalchemy session object
+    :param values: dictionary mapping one or more of THRESHOLD_FIELDS to the new value
+    :param expected_ids: list of expected stream ids
+    :param filter_method: stream delivery method
+    :param filter_stream: stream name
+    :return: number of expected streams updated
+    """
+    updates = {getattr(ExpectedStream, field): values[field] for field in THRESHOLD_FIELDS if field in values}
+    if not updates:
+        return 0
+    query = session.query(ExpectedStream)
+    if expected_ids:
+        query = query.filter(ExpectedStream.id.in_(expected_ids))
+    if filter_method:
+        query = query.filter(ExpectedStream.method == filter_method)
+    if filter_stream:
+        query = query.filter(ExpectedStream.name == filter_stream)
+    return query.update(updates, synchronize_session=False)
+
+
+UPSERT_BATCH_SIZE = 5000
+
+
+def upsert_expected_streams(session, rows):
+    """
+    Insert or update expected stream definitions with INSERT ... ON CONFLICT (name, method) DO UPDATE.
+    Existing rows whose thresholds already match are not rewritten.
+    :param session: sqlalchemy session object
+    :param rows: list of dictionaries containing name, method and THRESHOLD_FIELDS, unique on (name, method)
+    :return: (list of inserted expected stream ids, list of updated expected stream ids)
+    """
+    table = ExpectedStream.__table__
+    inserted = []
+    updated = []
+    for index in range(0, len(rows), UPSERT_BATCH_SIZE):
+        insert = postgresql.insert(table).values(rows[index:index + UPSERT_BATCH_SIZE])
+        changed = or_(*[table.c[field].is_distinct_from(insert.excluded[field]) for field in THRESHOLD_FIELDS])
+        insert = insert.on_conflict_do_update(
+            index_elements=[table.c.name, table.c.method],
+            set_={field: insert.excluded[field] for field in THRESHOLD_FIELDS},
+            where=changed,
+        # xmax is only zero for newly inserted row versions
+        ).returning(table.c.id, literal_column('xmax = 0').label('inserted'))
+        for expected_id, was_inserted in session.execute(insert):
+            if was_inserted:
+                inserted.append(expected_id)
+            else:
+                updated.append(expected_id)
+    return inserted, updated
+
+
+def get_expected_changes(session, df):
+    """
+    Compare new expected stream definitions with the stored definitions
+    :param session: sqlalchemy session object
+    :param df: dataframe containing name, method and THRESHOLD_FIELDS, unique on (name, method)
+    :return: dataframe of new or changed definitions with the stored values in <field>_old columns
+    """
+    import pandas as pd
+    fields = ['name', 'method'] + list(THRESHOLD_FIELDS)
+    query = session.query(*[getattr(ExpectedStream, field) for field in fields])
+    current = pd.read_sql_query(query.statement, query.session.get_bind())
+    merged = df[fields].merge(current, on=['name', 'method'], how='left', suffixes=('', '_old'), indicator=True)
+    changed = merged['_merge'] == 'left_only'
+    for field in THRESHOLD_FIELDS:
+        new = merged[field]
+        old = merged[field + '_old']
+        changed |= (new != old) & ~(new.isnull() & old.isnull())
+    return merged[changed].drop('_merge', axis=1)
+
+
+def count_inheriting_deployed(session, expected_ids):
+    """
+    Count the deployed streams of these expected streams which use at least one default threshold
+    """
+    if not expected_ids:
+        return 0
+    inheriting = or_(*[getattr(DeployedStream, '_' + field).is_(None) for field in THRESHOLD_FIELDS])
+    return session.query(func.count(DeployedStream.id)).filter(
+        DeployedStream.expected_stream_id.in_(expected_ids), inheriting).scalar()
+
+
+def clear_redundant_overrides(session, expected_ids):
+    """
+    Clear deployed stream overrides which equal their expected stream's threshold, so that these deployed
+    streams follow future changes to the defaults. Disabled streams (all overrides zero) are left alone.
+    One UPDATE ... FROM statement is issued per threshold.
+    :return: dictionary mapping threshold field to the number of overrides cleared
+    """
+    cleared = {}
+    if not expected_ids:
+        return cleared
+    enabled = or_(*[getattr(DeployedStream, '_' + field).is_distinct_from(0) for field in THRESHOLD_FIELDS])
+    for field in THRESHOLD_FIELDS:
+        column = getattr(DeployedStream, '_' + field)
+        query = session.query(DeployedStream).filter(
+            DeployedStream.expected_stream_id == ExpectedStream.id,
+            ExpectedStream.id.in_(expected_ids),
+            column == getattr(ExpectedStream, field),
+            enabled)
+        cleared[field] = query.update({column: None}, synchronize_session=False)
+    return cleared
+
+
+def get_threshold_frames(session):
+    """
+    Fetch the stored thresholds in two frames, so that proposed expected stream defaults can be
+    substituted before resolving each deployed stream's effective thresholds
+    :param session: sqlalchemy session object
+    :return: (dataframe of expected stream name, method, expected_rate, warn_interval and fail_interval,
+              dataframe of deployed stream refdes, name, method and warn_interval, fail_interval overrides)
+    """
+    import pandas as pd
+    expected_query = session.query(ExpectedStream.name, ExpectedStream.method, ExpectedStream.expected_rate,
+                                   ExpectedStream.warn_interval, ExpectedStream.fail_interval)
+    deployed_query = session.query(
+        ReferenceDesignator.name.label('refdes'),
+        ExpectedStream.name,
+        ExpectedStream.method,
+        DeployedStream._warn_interval.label('warn_interval'),
+        DeployedStream._fail_interval.label('fail_interval'),
+    ).select_from(DeployedStream).join(DeployedStream.reference_designator).join(DeployedStream.expected_stream)
+    bind = session.get_bind()
+    return (pd.read_sql_query(expected_query.statement, bind),
+            pd.read_sql_query(deployed_query.statement, bind))
 
 
 #### RATES ####
 
 def get_port_rates_dataframe(session, refdes_id, start, end):
+    import pandas as pd
     now = datetime.utcnow()
     if start is None:
         start = now - timedelta(days=1)
@@ -110,11 +359,89 @@ def get_port_rates_dataframe(session, refdes_id, start, end):
     query = session.query(PortCount).filter(and_(PortCount.reference_designator_id == refdes_id,
                                                  PortCount.collected_time >= start,
                                                  PortCount.collected_time < end)).order_by(PortCount.collected_time)
-    counts_df = pd.read_sql_query(query.statement, query.session.bind, index_col='collected_time')
+    counts_df = pd.read_sql_query(query.statement, query.session.get_bind(), index_col='collected_time')
     counts_df['rate'] = counts_df.byte_count / counts_df.seconds
     return counts_df
 
 
+def expected_rate_column():
+    """
+    Effective expected rate of a deployed stream: its override if set, otherwise the expected stream default
+    """
+    return func.coalesce(DeployedStream._expected_rate, ExpectedStream.expected_rate)
+
+
+def get_expected_port_rates(session):
+    """
+    Expected port data rate of every instrument with at least one expected rate set
+    :param session: sqlalchemy session object
+    :return: dictionary mapping reference designator to the sum of its deployed streams' expected rates
+    """
+    rate = func.sum(expected_rate_column())
+    query = session.query(ReferenceDesignator.name, rate).select_from(DeployedStream).join(
+        DeployedStream.reference_designator).join(DeployedStream.expected_stream).group_by(
+        ReferenceDesignator.name).having(rate > 0)
+    return dict(query)
+
+
+def get_port_rate_frame(session, start, end):
+    """
+    Observed and expected port data rates of every instrument with an expected rate, in one grouped query
+    :param session: sqlalchemy session object
+    :param start: start of the port count window
+    :param end: end of the port count window
+    :return: dataframe of refdes, expected_rate, byte_count and seconds (null without port counts in the window)
+    """
+    import pandas as pd
+    expected = session.query(
+        DeployedStream.reference_designator_id.label('refdes_id'),
+        func.sum(expected_rate_column()).label('expected_rate'),
+    ).join(DeployedStream.expected_stream).group_by(DeployedStream.reference_designator_id).having(
+        func.sum(expected_rate_column()) > 0).subquery()
+    observed = session.query(
+        PortCount.reference_designator_id.label('refdes_id'),
+        func.sum(PortCount.byte_count).label('byte_count'),
+        func.sum(PortCount.seconds).label('seconds'),
+    ).filter(PortCount.collected_time >= start, PortCount.collected_time < end).group_by(
+        PortCount.reference_designator_id).subquery()
+    query = session.query(
+        ReferenceDesignator.name.label('refdes'),
+        expected.c.expected_rate,
+        observed.c.byte_count,
+        observed.c.seconds,
+    ).join(expected, expected.c.refdes_id == ReferenceDesignator.id).outerjoin(
+        observed, observed.c.refdes_id == ReferenceDesignator.id)
+    return pd.read_sql_query(query.statement, query.session.get_bind())
+
+
+def classify_port_rates(df, degraded_ratio=0.5, failed_ratio=0.1):
+    """
+    Compare observed with expected port data rates for every instrument at once
+    :param df: dataframe as returned by get_port_rate_frame
+    :param degraded_ratio: rates below this fraction of the expected rate are degraded
+    :param failed_ratio: rates below this fraction of the expected rate are failed
+    :return: dictionary mapping reference designator to (rate status, rate reason). Instruments without port
+             counts in the window are not tracked, the port agent statistics may simply not be collected.
+    """
+    import pandas as pd
+    seconds = df.seconds.where(df.seconds > 0)
+    rate = df.byte_count / seconds
+    ratio = rate / df.expected_rate
+    status = pd.Series(StatusEnum.OPERATIONAL, index=df.index)
+    status[ratio < degraded_ratio] = StatusEnum.DEGRADED
+    status[ratio < failed_ratio] = StatusEnum.FAILED
+    status[rate.isnull()] = StatusEnum.NOT_TRACKED
+
+    result = {}
+    for refdes, rate_status, observed, expected in zip(df.refdes, status, rate, df.expected_rate):
+        if rate_status == StatusEnum.NOT_TRACKED:
+            reason = 'Port data rate: no port statistics'
+        else:
+            reason = 'Port data rate: %.1f B/s (expected %.1f B/s)' % (observed, expected)
+        result[refdes] = rate_status, reason
+    return result
+
+
 def _rollup_statuses(statuses):
     if StatusEnum.FAILED in statuses:
         return StatusEnum.FAILED
@@ -125,7 +452,7 @@ def _rollup_statuses(statuses):
     return StatusEnum.NOT_TRACKED
 
 
-def _rollup_status_query(query):
+def _rollup_status_query(query, rate_status=None):
     statuses = Counter((status[0] for status in query))
     rollup_status = _rollup_statuses(statuses)
     reasons = []
@@ -134,6 +461,10 @@ def _rollup_status_query(query):
             reasons.append('%s: %d' % (key, statuses[key]))
 
     rollup_reason = 'Stream statuses: ' + ', '.join(reasons)
+    if rate_status is not None:
+        port_status, port_reason = rate_status
+        rollup_status = _rollup_statuses([rollup_status, port_status])
+        rollup_reason = '%s; %s' % (rollup_reason, port_reason)
     return rollup_status, rollup_reason
 
 
@@ -143,7 +474,11 @@ def get_rollup_status_by_id(session, refdes_id):
     return _rollup_status_query(query)
 
 
-def get_rollup_status(session, refdes):
+def get_rollup_status(session, refdes, rate_status=None):
+    """
+    :param rate_status: optional (rate status, rate reason) tuple from classify_port_rates to combine with
+                        the stream statuses
+    """
     query = session.query(DeployedStream.status).join(ReferenceDesignator)
     query = query.filter(ReferenceDesignator.name == refdes)
-    return _rollup_status_query(query)
+    return _rollup_status_query(query, rate_status)
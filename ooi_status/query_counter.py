@@ -0,0 +1,31 @@
+from sqlalchemy import event
+
+
+class QueryCounter(object):
+    """
+    Record every statement executed against an engine while the counter is active
+
+    with QueryCounter(engine) as counter:
+        ...
+    assert counter.count <= 2, counter.statements
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    # noinspection PyUnusedLocal
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
@@ -0,0 +1,160 @@
+"""
+Streaming detection of port agent data rate degradation.
+
+RateDetector keeps an exponentially weighted moving average and variance of the bytes/second reported by each
+port agent, in flat numpy arrays indexed by a per reference designator slot, so every message costs a dictionary
+lookup and a few scalar updates regardless of the number of ports. Each rate is compared with a baseline: the
+expected rate of the instrument if one is set (the sum of the expected_rate of its deployed streams), otherwise
+the learned average once enough samples have been seen.
+
+A port becomes degraded after RATE_PERSIST_SAMPLES consecutive rates below RATE_LOW_RATIO of the baseline (and,
+for a learned baseline, more than RATE_Z_SCORE standard deviations below it). It recovers at the first rate of at
+least RATE_RECOVER_RATIO of the baseline. The learned average is not updated with low rates, so a degraded port
+does not gradually become the new normal.
+"""
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from . import metrics
+from .get_logger import get_logger
+from .status_message import StatusEnum
+
+log = get_logger(__name__, logging.INFO)
+
+RATE_EVENTS = metrics.counter('ooi_status_rate_events_total', 'Port data rate status changes', ['status'])
+DEGRADED_PORTS = metrics.gauge('ooi_status_rate_degraded_ports', 'Ports whose data rate is degraded')
+
+RateEvent = namedtuple('RateEvent', 'refdes previous_status status rate baseline')
+
+OPERATIONAL = 0
+DEGRADED = 1
+_STATUS_NAMES = {OPERATIONAL: StatusEnum.OPERATIONAL, DEGRADED: StatusEnum.DEGRADED}
+
+
+class RateDetector(object):
+    """
+    :param alpha: EWMA smoothing factor
+    :param warmup: samples required before the learned average is used as a baseline
+    :param low_ratio: rates below this fraction of the baseline are low
+    :param recover_ratio: a degraded port recovers at this fraction of the baseline
+    :param persist: consecutive low rates required to become degraded
+    :param z_score: standard deviations below a learned baseline required for a rate to be low
+    :param capacity: initial number of port slots (grown as needed)
+    """
+    def __init__(self, alpha=0.1, warmup=10, low_ratio=0.25, recover_ratio=0.5, persist=3, z_score=3.0,
+                 capacity=1024):
+        self.alpha = alpha
+        self.warmup = warmup
+        self.low_ratio = low_ratio
+        self.recover_ratio = recover_ratio
+        self.persist = persist
+        self.z_score = z_score
+        self.slots = {}
+        self.mean = np.zeros(capacity)
+        self.var = np.zeros(capacity)
+        self.expected = np.zeros(capacity)
+        self.samples = np.zeros(capacity, dtype='i4')
+        self.low = np.zeros(capacity, dtype='i2')
+        self.state = np.zeros(capacity, dtype='i1')
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :return: RateDetector if RATE_DETECTOR is set, otherwise None
+        """
+        if not config.get('RATE_DETECTOR'):
+            return None
+        return cls(alpha=config.get('RATE_EWMA_ALPHA', 0.1),
+                   warmup=config.get('RATE_WARMUP_SAMPLES', 10),
+                   low_ratio=config.get('RATE_LOW_RATIO', 0.25),
+                   recover_ratio=config.get('RATE_RECOVER_RATIO', 0.5),
+                   persist=config.get('RATE_PERSIST_SAMPLES', 3),
+                   z_score=config.get('RATE_Z_SCORE', 3.0))
+
+    def _grow(self):
+        size = len(self.mean) * 2
+        for name in ('mean', 'var', 'expected', 'samples', 'low', 'state'):
+            array = getattr(self, name)
+            grown = np.zeros(size, dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def slot(self, refdes):
+        slot = self.slots.get(refdes)
+        if slot is None:
+            slot = len(self.slots)
+            if slot >= len(self.mean):
+                self._grow()
+            self.slots[refdes] = slot
+        return slot
+
+    def set_expected(self, rates):
+        """
+        Replace the expected rates
+        :param rates: dictionary mapping reference designator to expected bytes/second
+        """
+        self.expected[:] = 0
+        for refdes, rate in rates.items():
+            self.expected[self.slot(refdes)] = rate or 0
+
+    def has_expected(self, refdes):
+        """
+        :return: True if the port is compared with an expected rate rather than its learned average
+        """
+        slot = self.slots.get(refdes)
+        return slot is not None and self.expected[slot] > 0
+
+    def degraded(self):
+        return sorted(refdes for refdes, slot in self.slots.items() if self.state[slot] == DEGRADED)
+
+    def update(self, refdes, byte_count, seconds):
+        """
+        Add one port agent interval
+        :return: RateEvent if the port changed status, otherwise None
+        """
+        if not seconds or seconds <= 0:
+            return None
+        rate = float(byte_count) / seconds
+        slot = self.slot(refdes)
+        mean = self.mean[slot]
+        samples = self.samples[slot]
+
+        expected = self.expected[slot]
+        if expected > 0:
+            baseline = expected
+            low = rate < self.low_ratio * baseline
+        elif samples >= self.warmup:
+            baseline = mean
+            low = (rate < self.low_ratio * baseline and
+                   baseline - rate > self.z_score * np.sqrt(self.var[slot]))
+        else:
+            baseline = None
+            low = False
+
+        if not low:
+            # exponentially weighted mean and variance
+            diff = rate - mean
+            increment = self.alpha * diff if samples else diff
+            self.mean[slot] = mean + increment
+            self.var[slot] = (1 - self.alpha) * (self.var[slot] + diff * increment) if samples else 0
+            self.samples[slot] = samples + 1
+            self.low[slot] = 0
+        else:
+            self.low[slot] += 1
+
+        state = self.state[slot]
+        if state == OPERATIONAL and self.low[slot] >= self.persist:
+            new_state = DEGRADED
+        elif state == DEGRADED and baseline is not None and rate >= self.recover_ratio * baseline:
+            new_state = OPERATIONAL
+        else:
+            return None
+
+        self.state[slot] = new_state
+        RATE_EVENTS.labels(_STATUS_NAMES[new_state]).inc()
+        DEGRADED_PORTS.set(int((self.state[:len(self.slots)] == DEGRADED).sum()))
+        log.info('Port data rate for %s %s -> %s (%.1f B/s, baseline %.1f B/s)', refdes,
+                 _STATUS_NAMES[state], _STATUS_NAMES[new_state], rate, baseline)
+        return RateEvent(refdes, _STATUS_NAMES[state], _STATUS_NAMES[new_state], rate, baseline)
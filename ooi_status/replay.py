@@ -0,0 +1,326 @@
+"""
+Offline replay of the status monitor over historical partition metadata.
+
+The arrival timeline of every stream is rebuilt from partition metadata: the gaps between consecutive
+partitions, plus the mean spacing of the particles within each partition. While no particle arrives the elapsed
+time grows linearly, so for a gap of g seconds and thresholds (warn, fail) the stream spends
+clip(min(g, fail) - warn, 0) seconds degraded and max(g - fail, 0) seconds failed, and raises a degraded and/or
+failed alert when g exceeds the threshold (the same rules as DeployedStream.get_status; a zero threshold is
+disabled and a stream with both thresholds zero is not tracked).
+
+Every gap is evaluated against every candidate setting at once with numpy broadcasting, and the per stream
+totals are summed with a single bincount, so months of metadata for the whole array replay in seconds once
+loaded. Candidate settings are the current thresholds multiplied by scale factors, or proposed expected stream
+CSV files (in the format accepted by --expected) with the stored deployed stream overrides still applied.
+
+    ooi_status_replay --start 2017-01-01 --end 2017-04-01 --scale 0.5 --scale 1 --scale 2 --proposed new.csv
+"""
+import datetime
+import logging
+import os
+
+import click
+import numpy as np
+import pandas as pd
+from dateutil.parser import parse
+from flask import Config
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .get_logger import get_logger
+from .metadata_queries import FETCH_BATCH_SIZE, get_deployment_spans, get_partition_rows
+from .queries import get_threshold_frames
+from .status_message import StatusEnum
+
+log = get_logger(__name__, logging.INFO)
+here = os.path.dirname(__file__)
+
+STREAM_KEY = ['subsite', 'node', 'sensor', 'method', 'stream']
+STATES = (StatusEnum.OPERATIONAL, StatusEnum.DEGRADED, StatusEnum.FAILED, StatusEnum.NOT_TRACKED)
+
+
+def read_frame(engine, query, batch_size=FETCH_BATCH_SIZE):
+    """
+    Read a query into a dataframe through a server side cursor, batch_size rows at a time
+    """
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        chunks = list(pd.read_sql_query(query.statement, conn, chunksize=batch_size))
+    if not chunks:
+        return pd.DataFrame(columns=[column['name'] for column in query.column_descriptions])
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _seconds(series):
+    """
+    Convert a datetime series to float seconds since the epoch (NaN for missing values)
+    """
+    values = pd.to_datetime(series)
+    seconds = values.values.astype('datetime64[ns]').astype('i8') / 1e9
+    seconds[values.isnull().values] = np.nan
+    return seconds
+
+
+class Timeline(object):
+    """
+    Gaps between particle arrivals of many streams
+    :param streams: dataframe of the stream key columns and refdes, one row per stream
+    :param stream_index: int array, the stream (row of streams) of each gap
+    :param gaps: float array of gap lengths in seconds
+    :param weights: float array, the number of times each gap occurs
+    """
+    def __init__(self, streams, stream_index, gaps, weights):
+        self.streams = streams
+        self.stream_index = stream_index
+        self.gaps = gaps
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.streams)
+
+
+def build_timeline(partitions, deployments, start, end):
+    """
+    Rebuild the arrival gaps of every stream within [start, end), limited to the span of its instrument's
+    deployments where deployment information is available
+    :param partitions: dataframe as returned by get_partition_rows
+    :param deployments: dataframe as returned by get_deployment_spans (subsite, node, sensor, start, stop)
+    :return: Timeline
+    """
+    partitions = partitions.sort_values(STREAM_KEY + ['first']).reset_index(drop=True)
+    keys = partitions[STREAM_KEY]
+    new_stream = (keys != keys.shift(1)).any(axis=1).values
+    stream_index = np.cumsum(new_stream) - 1
+    starts = np.flatnonzero(new_stream)
+    streams = keys[new_stream].reset_index(drop=True)
+    streams['refdes'] = streams.subsite + '-' + streams.node + '-' + streams.sensor
+    if partitions.empty:
+        return Timeline(streams, np.zeros(0, dtype='i8'), np.zeros(0), np.zeros(0))
+
+    # per stream bounds: the window, narrowed to the deployment span
+    spans = streams.merge(deployments, on=['subsite', 'node', 'sensor'], how='left')
+    origin = _seconds(pd.Series([start]))[0]
+    stream_lower = np.fmax(_seconds(spans['start']), origin) - origin
+    stream_upper = np.fmin(_seconds(spans['stop']), _seconds(pd.Series([end]))[0]) - origin
+    lower = stream_lower[stream_index]
+    upper = stream_upper[stream_index]
+
+    # times relative to the window start keep the offsets below small enough for exact float arithmetic
+    first = _seconds(partitions['first']) - origin
+    last = _seconds(partitions['last']) - origin
+    count = partitions['count'].fillna(0).values.astype('f8')
+
+    # latest particle time before each partition (partitions may overlap): a running maximum which
+    # restarts for each stream, computed in one pass by offsetting each stream above the previous one
+    offset = np.nanmax(last) - np.nanmin(last) + 1
+    latest = np.maximum.accumulate(last + stream_index * offset) - stream_index * offset
+    previous = np.concatenate([[np.nan], latest[:-1]])
+    previous[starts] = np.nan
+    previous = np.where(np.isnan(previous), lower, np.fmax(previous, lower))
+    between = np.clip(np.fmin(first, upper) - previous, 0, None)
+
+    # particles within a partition are assumed evenly spaced
+    duration = last - first
+    inside = np.clip(np.fmin(last, upper) - np.fmax(first, lower), 0, None)
+    fraction = np.where(duration > 0, inside / np.where(duration > 0, duration, 1), 0)
+    spacing = np.where(count > 1, duration / np.fmax(count - 1, 1), 0)
+    within = np.clip(count - 1, 0, None) * fraction
+
+    # from the last particle to the end of the window (or deployment)
+    final = latest[np.append(starts[1:], len(latest)) - 1]
+    trailing = np.clip(stream_upper - np.fmax(final, stream_lower), 0, None)
+
+    gaps = np.concatenate([between, spacing, trailing])
+    weights = np.concatenate([np.ones(len(partitions)), within, np.ones(len(streams))])
+    index = np.concatenate([stream_index, stream_index, np.arange(len(streams))]).astype('i8')
+    keep = (gaps > 0) & (weights > 0)
+    return Timeline(streams, index[keep], gaps[keep], weights[keep])
+
+
+def resolve_thresholds(streams, expected, deployed):
+    """
+    Effective (warn_interval, fail_interval) of each stream: the deployed stream override if set,
+    otherwise the expected stream default, otherwise zero (not tracked)
+    :return: (warn array, fail array) aligned with streams
+    """
+    merged = streams[['refdes', 'stream', 'method']].rename(columns={'stream': 'name'})
+    merged = merged.merge(deployed, on=['refdes', 'name', 'method'], how='left')
+    merged = merged.merge(expected, on=['name', 'method'], how='left', suffixes=('', '_default'))
+    warn = merged['warn_interval'].fillna(merged['warn_interval_default']).fillna(0)
+    fail = merged['fail_interval'].fillna(merged['fail_interval_default']).fillna(0)
+    return warn.values.astype('f8'), fail.values.astype('f8')
+
+
+def replay(timeline, warn, fail):
+    """
+    Replay the timeline against several candidate threshold settings at once
+    :param timeline: Timeline
+    :param warn: array of shape (settings, streams), zero disables the threshold
+    :param fail: array of shape (settings, streams), zero disables the threshold
+    :return: dictionary mapping the per state seconds (STATES) and degraded_alerts / failed_alerts
+             to arrays of shape (settings, streams)
+    """
+    settings, streams = warn.shape
+    w = warn[:, timeline.stream_index]
+    f = fail[:, timeline.stream_index]
+    g = timeline.gaps[np.newaxis, :]
+    weights = timeline.weights[np.newaxis, :]
+
+    tracked = (w > 0) | (f > 0)
+    w = np.where(w > 0, w, np.inf)
+    f = np.where(f > 0, f, np.inf)
+
+    failed = np.clip(g - f, 0, None)
+    degraded = np.clip(np.fmin(g, f) - w, 0, None)
+    operational = g - failed - degraded
+
+    # sum every (setting, stream) pair with one bincount over the flattened arrays
+    bins = (np.arange(settings)[:, np.newaxis] * streams + timeline.stream_index[np.newaxis, :]).ravel()
+
+    def total(values):
+        return np.bincount(bins, weights=(values * weights).ravel(), minlength=settings * streams).reshape(
+            settings, streams)
+
+    return {
+        StatusEnum.OPERATIONAL: total(np.where(tracked, operational, 0)),
+        StatusEnum.DEGRADED: total(np.where(tracked, degraded, 0)),
+        StatusEnum.FAILED: total(np.where(tracked, failed, 0)),
+        StatusEnum.NOT_TRACKED: total(np.where(tracked, 0, g)),
+        'degraded_alerts': total(tracked & (g > w) & (w < f)),
+        'failed_alerts': total(tracked & (g > f)),
+    }
+
+
+def summarize(labels, warn, fail, results):
+    """
+    :return: dataframe with one row per setting: tracked streams, alert counts, hours in each state and uptime
+    """
+    rows = []
+    for index, label in enumerate(labels):
+        tracked = (warn[index] > 0) | (fail[index] > 0)
+        seconds = {state: results[state][index].sum() for state in STATES}
+        tracked_seconds = sum(seconds[state] for state in STATES[:3])
+        row = {
+            'setting': label,
+            'tracked_streams': int(tracked.sum()),
+            'degraded_alerts': int(round(results['degraded_alerts'][index].sum())),
+            'failed_alerts': int(round(results['failed_alerts'][index].sum())),
+            'uptime': 100.0 * seconds[StatusEnum.OPERATIONAL] / tracked_seconds if tracked_seconds else None,
+        }
+        for state in STATES:
+            row['%s_hours' % state] = seconds[state] / 3600.0
+        rows.append(row)
+    columns = ['setting', 'tracked_streams', 'degraded_alerts', 'failed_alerts', 'uptime'] + [
+        '%s_hours' % state for state in STATES]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def stream_detail(timeline, labels, warn, fail, results):
+    """
+    :return: dataframe with one row per stream and setting
+    """
+    frames = []
+    for index, label in enumerate(labels):
+        df = timeline.streams[['refdes', 'method', 'stream']].copy()
+        df['setting'] = label
+        df['warn_interval'] = warn[index]
+        df['fail_interval'] = fail[index]
+        for key in ('degraded_alerts', 'failed_alerts') + STATES:
+            df[key] = results[key][index]
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_proposed_csv(filename):
+    """
+    Read proposed expected stream thresholds from a CSV file in the --expected format
+    """
+    df = pd.read_csv(filename)[['name', 'method', 'warn_interval', 'fail_interval']]
+    return df.drop_duplicates(['name', 'method'], keep='last')
+
+
+def load_timeline(config, start, end):
+    """
+    Load the partition metadata and deployments overlapping [start, end) and rebuild the timeline
+    """
+    metadata_engine = create_engine(config['METADATA_URL'])
+    metadata_session = sessionmaker(bind=metadata_engine)()
+    batch_size = config.get('METADATA_FETCH_BATCH', FETCH_BATCH_SIZE)
+
+    log.info('Loading partition metadata from %s to %s', start, end)
+    partitions = read_frame(metadata_engine, get_partition_rows(metadata_session, start, end), batch_size)
+    deployments = read_frame(metadata_engine, get_deployment_spans(metadata_session, start, end), batch_size)
+    deployments.columns = ['subsite', 'node', 'sensor', 'start', 'stop']
+
+    timeline = build_timeline(partitions, deployments, start, end)
+    log.info('Rebuilt %d gaps for %d streams from %d partitions', len(timeline.gaps), len(timeline),
+             len(partitions))
+    return timeline
+
+
+def run_replay(config, start, end, scales=(1.0,), proposed=()):
+    """
+    Load the partition metadata and thresholds and replay every candidate setting
+    :param scales: factors applied to the current thresholds
+    :param proposed: expected stream CSV files replacing the current defaults
+    :return: (Timeline, setting labels, warn array, fail array, results)
+    """
+    timeline = load_timeline(config, start, end)
+    monitor_session = sessionmaker(bind=create_engine(config['MONITOR_URL']))()
+    expected, deployed = get_threshold_frames(monitor_session)
+
+    labels = []
+    warn = []
+    fail = []
+    current_warn, current_fail = resolve_thresholds(timeline.streams, expected, deployed)
+    for scale in scales:
+        labels.append('scale=%g' % scale)
+        warn.append(current_warn * scale)
+        fail.append(current_fail * scale)
+    for filename in proposed:
+        labels.append(os.path.basename(filename))
+        proposed_warn, proposed_fail = resolve_thresholds(timeline.streams, read_proposed_csv(filename), deployed)
+        warn.append(proposed_warn)
+        fail.append(proposed_fail)
+
+    warn = np.array(warn).reshape(len(labels), len(timeline))
+    fail = np.array(fail).reshape(len(labels), len(timeline))
+    results = replay(timeline, warn, fail)
+    return timeline, labels, warn, fail, results
+
+
+def parse_time_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse(value)
+    except ValueError:
+        raise click.BadParameter('unable to parse %r' % value)
+
+
+@click.command()
+@click.option('--start', callback=parse_time_option, help='Start of the replay window (default 30 days before end)')
+@click.option('--end', callback=parse_time_option, help='End of the replay window (default now)')
+@click.option('--scale', type=float, multiple=True, help='Multiply the current thresholds by this factor')
+@click.option('--proposed', type=click.Path(exists=True, dir_okay=False), multiple=True,
+              help='CSV file of proposed expected stream thresholds')
+@click.option('--detail', 'detail_file', type=click.Path(dir_okay=False),
+              help='Write per stream results to this CSV file')
+def main(start, end, scale, proposed, detail_file):
+    config = Config(here)
+    config.from_object('ooi_status.default_settings')
+    if 'OOISTATUS_SETTINGS' in os.environ:
+        config.from_envvar('OOISTATUS_SETTINGS')
+
+    end = end or datetime.datetime.utcnow()
+    start = start or end - datetime.timedelta(days=30)
+    scales = scale or (() if proposed else (1.0,))
+
+    timeline, labels, warn, fail, results = run_replay(config, start, end, scales=scales, proposed=proposed)
+    click.echo(summarize(labels, warn, fail, results).to_string(index=False))
+    if detail_file:
+        stream_detail(timeline, labels, warn, fail, results).to_csv(detail_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Hash partitioning of reference designators between several status monitor instances.
+
+Each instance holds session level Postgres advisory locks on a dedicated connection:
+
+* one member lock (class SHARD_LOCK_CLASS + 1, slot 0..SHARD_MAX_MEMBERS-1) announcing that it is alive
+* one partition lock (class SHARD_LOCK_CLASS, partition 0..SHARD_PARTITIONS-1) per partition it owns
+
+On every refresh an instance counts the live members from pg_locks, releases partitions beyond its fair share
+and claims free partitions up to it. Locks disappear with the connection of a dead instance, so the survivors
+pick up its partitions on their next refresh. A partition is never owned by two live instances at once.
+"""
+import logging
+import math
+import threading
+import zlib
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from . import metrics
+from .get_logger import get_logger
+
+log = get_logger(__name__, logging.INFO)
+
+OWNED_PARTITIONS = metrics.gauge('ooi_status_shard_partitions_owned', 'Hash partitions owned by this monitor')
+SHARD_MEMBERS = metrics.gauge('ooi_status_shard_members', 'Live status monitor instances sharing the partitions')
+
+_TRY_LOCK = text('SELECT pg_try_advisory_lock(:lock_class, :key)')
+_UNLOCK = text('SELECT pg_advisory_unlock(:lock_class, :key)')
+# pg_locks lists the locks of the whole cluster, advisory locks are only shared within a database
+_COUNT_MEMBERS = text("""
+    SELECT count(*) FROM pg_locks
+    WHERE locktype = 'advisory' AND granted AND objsubid = 2 AND classid = :lock_class
+    AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+""")
+
+
+def partition_of(refdes, partitions):
+    """
+    Stable hash partition of a reference designator (identical in every process and python version)
+    """
+    return (zlib.crc32(refdes.encode('utf-8')) & 0xffffffff) % partitions
+
+
+def fair_share(partitions, members):
+    return int(math.ceil(float(partitions) / max(members, 1)))
+
+
+class PartitionLeases(object):
+    """
+    Advisory lock based ownership of a subset of hash partitions
+    :param engine: engine for the monitor database
+    :param partitions: total number of partitions
+    :param lock_class: first advisory lock key (partition locks), lock_class + 1 is used for member locks
+    :param max_members: number of member slots
+    """
+    def __init__(self, engine, partitions, lock_class=7007, max_members=64):
+        self.engine = engine
+        self.partitions = partitions
+        self.partition_class = lock_class
+        self.member_class = lock_class + 1
+        self.max_members = max_members
+        self.connection = None
+        self.member = None
+        self.members = 0
+        self.owned = frozenset()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self.connection = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        self.member = None
+        self.owned = frozenset()
+
+    def _try_lock(self, lock_class, key):
+        return self.connection.execute(_TRY_LOCK, lock_class=lock_class, key=key).scalar()
+
+    def _unlock(self, lock_class, key):
+        return self.connection.execute(_UNLOCK, lock_class=lock_class, key=key).scalar()
+
+    def _join(self):
+        for slot in range(self.max_members):
+            if self._try_lock(self.member_class, slot):
+                self.member = slot
+                log.info('Joined status monitor shard as member %d', slot)
+                return
+        raise RuntimeError('All %d shard member slots are in use' % self.max_members)
+
+    def _rebalance(self):
+        self.members = self.connection.execute(_COUNT_MEMBERS, lock_class=self.member_class).scalar()
+        share = fair_share(self.partitions, self.members)
+        owned = set(self.owned)
+
+        # keep the partitions closest to this member's preferred range
+        for partition in sorted(owned, key=self._preference)[share:]:
+            self._unlock(self.partition_class, partition)
+            owned.discard(partition)
+
+        if len(owned) < share:
+            for partition in sorted(set(range(self.partitions)) - owned, key=self._preference):
+                if self._try_lock(self.partition_class, partition):
+                    owned.add(partition)
+                    if len(owned) >= share:
+                        break
+
+        if owned != self.owned:
+            log.info('Member %d of %d now owns partitions %s', self.member, self.members, sorted(owned))
+        self.owned = frozenset(owned)
+
+    def _preference(self, partition):
+        # each member prefers a contiguous block so ownership is stable as members come and go
+        members = max(self.members, 1)
+        start = (self.member % members) * self.partitions // members
+        return (partition - start) % self.partitions
+
+    def refresh(self):
+        """
+        Verify the lock connection, update the member count and claim or release partitions
+        :return: frozenset of owned partitions (empty if the database is unavailable)
+        """
+        with self._lock:
+            try:
+                if self.connection is None or self.connection.closed:
+                    self._connect()
+                if self.member is None:
+                    self._join()
+                self._rebalance()
+            except DBAPIError:
+                log.exception('Lost shard lock connection, releasing all partitions')
+                self.close()
+            OWNED_PARTITIONS.set(len(self.owned))
+            SHARD_MEMBERS.set(self.members)
+            return self.owned
+
+    def owns(self, refdes, owned=None):
+        owned = self.owned if owned is None else owned
+        return partition_of(refdes, self.partitions) in owned
+
+    def close(self):
+        if self.connection is not None and not self.connection.closed:
+            # discard the DBAPI connection rather than returning it to the pool with the locks still held
+            self.connection.invalidate()
+            self.connection.close()
+        self.connection = None
+        self.member = None
+        self.members = 0
+        self.owned = frozenset()
+
+
+def from_config(engine, config):
+    """
+    :return: PartitionLeases if SHARD_PARTITIONS is set, otherwise None
+    """
+    partitions = config.get('SHARD_PARTITIONS')
+    if not partitions:
+        return None
+    return PartitionLeases(engine, partitions,
+                           lock_class=config.get('SHARD_LOCK_CLASS', 7007),
+                           max_members=config.get('SHARD_MAX_MEMBERS', 64))
@@ -0,0 +1,222 @@
+"""
+Warm restart snapshots of the status monitor's working state.
+
+A snapshot is written to SNAPSHOT_PATH every SNAPSHOT_INTERVAL_SECONDS and when the monitor stops:
+
+* <path>.streams.npy - structured array of the ids of the cached deployed streams
+* <path>.mirror.npy - last particle times held by the metadata mirror (if enabled)
+* <path>.json - the stream keys, mirror deployments, scheduler deadlines and the monitor database watermark
+
+The arrays are loaded memory mapped. On startup the watermark (row counts and maximum ids of the deployed stream,
+reference designator and expected stream tables) is compared with the database in one query. If nothing was
+added or deleted since the snapshot, the stream cache is warmed with only the streams this monitor was checking.
+Thresholds and statuses are always read from the database.
+
+The metadata mirror only depends on the metadata database, so it is restored whatever the watermark. It continues
+incrementally from its saved watermark, and its usual full resync (METADATA_MIRROR_RESYNC_MINUTES after the saved
+last resync) catches anything deleted while the monitor was stopped.
+"""
+import calendar
+import datetime
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from ooi_data.postgres.model import DeployedStream, ExpectedStream, ReferenceDesignator
+from sqlalchemy import func, select
+
+from .get_logger import get_logger
+from .metadata_mirror import Deployment
+
+log = get_logger(__name__, logging.INFO)
+
+SNAPSHOT_VERSION = 2
+STREAM_DTYPE = np.dtype([
+    ('deployed_id', 'i8'),
+    ('refdes_id', 'i8'),
+    ('expected_id', 'i8'),
+])
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_micros(value):
+    if value is None:
+        return None
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_micros(value):
+    if value is None:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+
+def get_watermark(session):
+    """
+    Row count and maximum id of the tables whose ids are cached, in one query
+    """
+    columns = []
+    for model in (DeployedStream, ReferenceDesignator, ExpectedStream):
+        columns.append(select([func.count(model.id)]).as_scalar())
+        columns.append(select([func.max(model.id)]).as_scalar())
+    return [value for value in session.execute(select(columns)).first()]
+
+
+def _write(path, write):
+    temp = path + '.tmp'
+    with open(temp, 'wb') as fh:
+        write(fh)
+    os.rename(temp, path)
+
+
+class Snapshot(object):
+    """
+    :param keys: list of (refdes, stream, method) keys of the cached deployed streams
+    :param streams: STREAM_DTYPE array aligned with keys
+    :param watermark: result of get_watermark when the snapshot was written
+    :param saved: datetime the snapshot was written
+    :param deadlines: dictionary mapping scheduler job id to its next run time in unix seconds
+    :param mirror: None or dictionary with the metadata mirror keys, last (datetime64 array), deployments,
+                   watermark, last_resync and last_deployment_refresh
+    """
+    def __init__(self, keys, streams, watermark, saved, deadlines=None, mirror=None):
+        self.keys = keys
+        self.streams = streams
+        self.watermark = watermark
+        self.saved = saved
+        self.deadlines = deadlines or {}
+        self.mirror = mirror
+
+
+def capture(monitor, cache, scheduler=None):
+    """
+    Collect the monitor's working state
+    :param monitor: StatusMonitor
+    :param cache: StreamCache
+    :param scheduler: optional APScheduler scheduler whose job deadlines are saved
+    :return: Snapshot
+    """
+    with monitor.session.begin():
+        watermark = get_watermark(monitor.session)
+
+    entries = cache.entries()
+    keys = [key for key, _ in entries]
+    streams = np.array([(info.deployed_id, info.refdes_id, info.expected_id) for _, info in entries],
+                       dtype=STREAM_DTYPE)
+
+    deadlines = {}
+    if scheduler is not None:
+        for job in scheduler.get_jobs():
+            if job.next_run_time is not None:
+                deadlines[job.id] = calendar.timegm(job.next_run_time.utctimetuple())
+
+    mirror = None
+    if monitor.mirror is not None and monitor.mirror.last_resync is not None:
+        state = monitor.mirror
+        mirror_keys = list(state.streams)
+        mirror = {
+            'keys': mirror_keys,
+            'last': np.array([state.streams[key] for key in mirror_keys], dtype='datetime64[us]'),
+            'deployments': [list(sensor) + [deployment.uid, _to_micros(deployment.start),
+                                            _to_micros(deployment.stop)]
+                            for sensor, deployment in state.deployments.items()],
+            'watermark': _to_micros(state.watermark),
+            'last_resync': _to_micros(state.last_resync),
+            'last_deployment_refresh': _to_micros(state.last_deployment_refresh),
+        }
+    return Snapshot(keys, streams, watermark, datetime.datetime.utcnow(), deadlines, mirror)
+
+
+def save_snapshot(path, snapshot):
+    """
+    Write a snapshot. Each file is written to a temporary name and renamed, the JSON file last.
+    """
+    _write(path + '.streams.npy', lambda fh: np.save(fh, snapshot.streams))
+    info = {
+        'version': SNAPSHOT_VERSION,
+        'saved': _to_micros(snapshot.saved),
+        'watermark': snapshot.watermark,
+        'keys': snapshot.keys,
+        'deadlines': snapshot.deadlines,
+        'mirror': None,
+    }
+    if snapshot.mirror is not None:
+        _write(path + '.mirror.npy', lambda fh: np.save(fh, snapshot.mirror['last']))
+        info['mirror'] = {key: value for key, value in snapshot.mirror.items() if key != 'last'}
+    _write(path + '.json', lambda fh: fh.write(json.dumps(info).encode('utf-8')))
+    log.info('Saved snapshot of %d streams to %s', len(snapshot.keys), path)
+
+
+def load_snapshot(path):
+    """
+    :return: Snapshot or None if there is no usable snapshot at path
+    """
+    try:
+        with open(path + '.json', 'rb') as fh:
+            info = json.loads(fh.read().decode('utf-8'))
+        if info.get('version') != SNAPSHOT_VERSION:
+            log.warning('Ignoring snapshot %s with version %r', path, info.get('version'))
+            return None
+        streams = np.load(path + '.streams.npy', mmap_mode='r')
+        mirror = info['mirror']
+        if mirror is not None:
+            mirror['last'] = np.load(path + '.mirror.npy', mmap_mode='r')
+            if len(mirror['last']) != len(mirror['keys']):
+                mirror = None
+    except (IOError, OSError, ValueError, KeyError):
+        log.exception('Unable to load snapshot %s', path)
+        return None
+
+    if len(streams) != len(info['keys']) or streams.dtype != STREAM_DTYPE:
+        log.warning('Ignoring inconsistent snapshot %s', path)
+        return None
+    return Snapshot([tuple(key) for key in info['keys']], streams, info['watermark'],
+                    _from_micros(info['saved']), info['deadlines'], mirror)
+
+
+def restore_mirror(state, mirror):
+    """
+    Fill an ActiveStreamMirror from the mirror state of a snapshot
+    """
+    last = mirror['last'].astype('datetime64[us]').astype(object)
+    state.streams = {tuple(key): value for key, value in zip(mirror['keys'], last)}
+    state.deployments = {tuple(row[:3]): Deployment(row[3], _from_micros(row[4]), _from_micros(row[5]))
+                         for row in mirror['deployments']}
+    state.watermark = _from_micros(mirror['watermark'])
+    state.last_resync = _from_micros(mirror['last_resync'])
+    state.last_deployment_refresh = _from_micros(mirror['last_deployment_refresh'])
+
+
+def restore(monitor, cache, snapshot):
+    """
+    Fill the metadata mirror from a snapshot, and the stream cache if the monitor database has not changed since
+    :return: True if the stream cache was warmed from the snapshot
+    """
+    if monitor.mirror is not None and snapshot.mirror is not None:
+        restore_mirror(monitor.mirror, snapshot.mirror)
+        log.info('Restored %d mirrored streams from the snapshot of %s', len(monitor.mirror.streams),
+                 snapshot.saved)
+
+    with monitor.session.begin():
+        watermark = get_watermark(monitor.session)
+        if watermark != snapshot.watermark:
+            log.info('Monitor database changed since the snapshot of %s, starting the stream cache cold',
+                     snapshot.saved)
+            return False
+
+        ids = [int(deployed_id) for deployed_id in snapshot.streams['deployed_id']]
+        restored = cache.warm(monitor.session, deployed_ids=ids)
+
+    log.info('Restored %d cached streams from the snapshot of %s', restored, snapshot.saved)
+    return True
+
+
+def missed_jobs(snapshot, now=None):
+    """
+    :return: ids of the scheduler jobs which were due while the monitor was stopped
+    """
+    now = time.time() if now is None else now
+    return sorted(job_id for job_id, deadline in snapshot.deadlines.items() if deadline <= now)
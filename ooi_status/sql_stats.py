@@ -0,0 +1,333 @@
+"""
+SQL statement instrumentation shared by the status monitor, AMQP client and HTTP API.
+
+instrument_engine attaches to an engine's cursor events and records the execution time of every statement
+under a normalized fingerprint (literals and parameter markers replaced with ?, IN lists collapsed).
+Statistics are aggregated for the life of the process and per named scope (a monitor cycle or an API
+endpoint), and statements slower than the configured threshold are logged with the shape, never the values,
+of their parameters.
+
+    instrument_engine(engine, 'monitor', slow_seconds=1.0)
+    with scope('check_all'):
+        ...
+    summary(scope_name='check_all')
+"""
+import logging
+import random
+import re
+import threading
+
+from cachetools import LRUCache
+from sqlalchemy import event
+
+from . import metrics
+from .get_logger import get_logger
+
+log = get_logger(__name__, logging.INFO)
+
+MAX_FINGERPRINTS = 1000
+MAX_SAMPLES = 512
+OVERFLOW = '<other statements>'
+
+STATEMENTS = metrics.counter('ooi_status_sql_statements_total', 'SQL statements executed', ['engine'])
+STATEMENT_SECONDS = metrics.histogram('ooi_status_sql_statement_seconds', 'SQL statement execution time',
+                                      ['engine'])
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PARAMETER = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+_VALUES_LIST = re.compile(r'\bVALUES \((?:\?(?:, )?)+\)(?:, \((?:\?(?:, )?)+\))*', re.IGNORECASE)
+
+_fingerprints = LRUCache(4096)
+_fingerprint_lock = threading.Lock()
+
+
+def fingerprint(statement):
+    """
+    Normalize a SQL statement so executions differing only in literal or parameter values share a key
+    """
+    with _fingerprint_lock:
+        result = _fingerprints.get(statement)
+    if result is None:
+        result = _WHITESPACE.sub(' ', statement).strip()
+        result = _STRING.sub('?', result)
+        result = _PARAMETER.sub('?', result)
+        result = _NUMBER.sub('?', result)
+        result = _IN_LIST.sub('IN (...)', result)
+        result = _VALUES_LIST.sub('VALUES (...)', result)
+        with _fingerprint_lock:
+            _fingerprints[statement] = result
+    return result
+
+
+def parameter_shape(parameters, executemany=False):
+    """
+    Describe bound parameters by name and type without exposing their values
+    """
+    if executemany:
+        parameters = list(parameters)
+        first = parameters[0] if parameters else None
+        return '%d x %s' % (len(parameters), parameter_shape(first))
+    if isinstance(parameters, dict):
+        return '{%s}' % ', '.join('%s: %s' % (key, _type_name(parameters[key])) for key in sorted(parameters))
+    if isinstance(parameters, (list, tuple)):
+        return '(%s)' % ', '.join(_type_name(value) for value in parameters)
+    return _type_name(parameters)
+
+
+def _type_name(value):
+    if isinstance(value, (list, tuple)):
+        return '%s[%d]' % (type(value).__name__, len(value))
+    return type(value).__name__
+
+
+class StatementStats(object):
+    """
+    Execution count, total time and a bounded reservoir sample of durations for one fingerprint
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(duration)
+        else:
+            index = random.randrange(self.count)
+            if index < MAX_SAMPLES:
+                self.samples[index] = duration
+
+    def merge(self, other):
+        for duration in other.samples:
+            self.add(duration)
+        # the samples only approximate the other table, so take its exact totals
+        self.count += other.count - len(other.samples)
+        self.total += other.total - sum(other.samples)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count else None,
+            'p50_seconds': self.percentile(0.5),
+            'p95_seconds': self.percentile(0.95),
+            'p99_seconds': self.percentile(0.99),
+            'max_seconds': self.max,
+        }
+
+
+class StatementTable(object):
+    """
+    Statement statistics keyed by (engine name, fingerprint)
+    """
+    def __init__(self):
+        self.stats = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, engine_name, key, duration):
+        stats = self.stats.get((engine_name, key))
+        if stats is None:
+            if len(self.stats) >= MAX_FINGERPRINTS:
+                key = OVERFLOW
+            stats = self.stats.setdefault((engine_name, key), StatementStats())
+        stats.add(duration)
+        self.count += 1
+        self.total += duration
+
+    def merge(self, other):
+        for (engine_name, key), other_stats in other.stats.items():
+            stats = self.stats.get((engine_name, key))
+            if stats is None:
+                if len(self.stats) >= MAX_FINGERPRINTS:
+                    key = OVERFLOW
+                stats = self.stats.setdefault((engine_name, key), StatementStats())
+            stats.merge(other_stats)
+        self.count += other.count
+        self.total += other.total
+
+    def top(self, limit=None):
+        """
+        :return: list of statement summaries ordered by total time
+        """
+        rows = []
+        for (engine_name, key), stats in self.stats.items():
+            row = stats.as_dict()
+            row['engine'] = engine_name
+            row['statement'] = key
+            rows.append(row)
+        rows.sort(key=lambda row: row['total_seconds'], reverse=True)
+        return rows if limit is None else rows[:limit]
+
+
+class ScopeTable(StatementTable):
+    """
+    Statement statistics accumulated over every completed scope of one name
+    """
+    def __init__(self):
+        super(ScopeTable, self).__init__()
+        self.scopes = 0
+
+    def summary(self, limit=None):
+        return {
+            'scopes': self.scopes,
+            'statements': self.count,
+            'seconds': self.total,
+            'statements_per_scope': float(self.count) / self.scopes if self.scopes else None,
+            'seconds_per_scope': self.total / self.scopes if self.scopes else None,
+            'top': self.top(limit),
+        }
+
+
+class SqlStats(object):
+    """
+    Process wide statement statistics and the scope currently active in each thread (or greenlet)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = StatementTable()
+        self.scopes = {}
+        self.local = threading.local()
+
+    def current(self):
+        return getattr(self.local, 'table', None)
+
+    def record(self, engine_name, statement, duration):
+        key = fingerprint(statement)
+        with self.lock:
+            self.totals.add(engine_name, key, duration)
+        table = self.current()
+        if table is not None:
+            table.add(engine_name, key, duration)
+
+    def begin_scope(self):
+        """
+        Start collecting this thread's statements in a new table
+        :return: the enclosing scope's table, to be passed to end_scope
+        """
+        previous = self.current()
+        self.local.table = StatementTable()
+        return previous
+
+    def end_scope(self, name, previous=None):
+        table = self.current()
+        self.local.table = previous
+        if table is None:
+            return None
+        with self.lock:
+            scope_table = self.scopes.get(name)
+            if scope_table is None:
+                scope_table = self.scopes[name] = ScopeTable()
+            scope_table.scopes += 1
+            scope_table.merge(table)
+        return table
+
+    def summary(self, scope_name=None, limit=20):
+        with self.lock:
+            if scope_name is not None:
+                scope_table = self.scopes.get(scope_name)
+                return scope_table.summary(limit) if scope_table else None
+            return {
+                'statements': self.totals.count,
+                'seconds': self.totals.total,
+                'top': self.totals.top(limit),
+                'scopes': {name: table.summary(0) for name, table in self.scopes.items()},
+            }
+
+    def reset(self):
+        with self.lock:
+            self.totals = StatementTable()
+            self.scopes = {}
+
+
+STATS = SqlStats()
+
+
+class Scope(object):
+    """
+    Aggregate the statements executed by this thread within a block under the given scope name
+    :param log_summary: log the statement count, time and most expensive statements when the block exits
+    """
+    def __init__(self, name, log_summary=False, stats=STATS):
+        self.name = name
+        self.log_summary = log_summary
+        self.stats = stats
+        self.table = None
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = self.stats.begin_scope()
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.table = self.stats.end_scope(self.name, self._previous)
+        if self.log_summary and self.table is not None and self.table.count:
+            top = self.table.top(3)
+            log.info('%s: %d statements in %.3fs, most expensive: %s', self.name, self.table.count,
+                     self.table.total, '; '.join('%.3fs x%d %s' % (row['total_seconds'], row['count'],
+                                                                  row['statement'][:200]) for row in top))
+
+
+def scope(name, log_summary=False):
+    return Scope(name, log_summary)
+
+
+def instrument_engine(engine, name, slow_seconds=None, stats=STATS):
+    """
+    Record every statement executed through engine (safe to call more than once per engine)
+    :param name: engine name used in summaries and metrics
+    :param slow_seconds: log statements which take at least this long (None to disable)
+    """
+    if getattr(engine, '_ooi_sql_stats', None) is not None:
+        return engine
+    engine._ooi_sql_stats = name
+    statements = STATEMENTS.labels(name)
+    seconds = STATEMENT_SECONDS.labels(name)
+
+    # noinspection PyUnusedLocal
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('ooi_sql_start', []).append(metrics.monotonic())
+
+    # noinspection PyUnusedLocal
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = metrics.monotonic() - conn.info['ooi_sql_start'].pop()
+        stats.record(name, statement, duration)
+        statements.inc()
+        seconds.observe(duration)
+        if slow_seconds is not None and duration >= slow_seconds:
+            log.warning('Slow statement on %s (%.3fs): %s parameters=%s', name, duration,
+                        _WHITESPACE.sub(' ', statement).strip(), parameter_shape(parameters, executemany))
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        starts = context.connection.info.get('ooi_sql_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    return engine
+
+
+def instrument_from_config(engine, name, config):
+    """
+    Instrument engine unless SQL_STATS is disabled in config
+    """
+    if engine is not None and config.get('SQL_STATS', True):
+        instrument_engine(engine, name, slow_seconds=config.get('SQL_SLOW_SECONDS'))
+    return engine
@@ -94,3 +94,17 @@ class StatusMessage(object):
     @property
     def method(self):
         return 'automatic'
+
+
+class RateStatusMessage(StatusMessage):
+    """
+    Change of the port data rate status of an instrument (RATE_STATUS) without a stream status change
+    """
+    def __init__(self, refdes, uid, previous_status, rate_status, rate_reason):
+        super(RateStatusMessage, self).__init__(refdes, 'port data rate', uid, None, previous_status, rate_status,
+                                                None)
+        self.rate_reason = rate_reason
+
+    @property
+    def stream_reason(self):
+        return self.rate_reason
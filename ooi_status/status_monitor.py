@@ -6,31 +6,47 @@ RSN health and status monitor for data particles received by OOI CI.
 import datetime
 import logging
 import os
+import signal
+import threading
 
 import click
 import pandas as pd
 import requests
 from apscheduler.schedulers.blocking import BlockingScheduler
-from cachetools import LRUCache, cached
 from flask import Config
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm.exc import ObjectDeletedError
 
-from ooi_data.postgres.model import DeployedStream, ExpectedStream, ReferenceDesignator, PendingUpdate, StatusEnum
+from ooi_data.postgres.model import ReferenceDesignator, PendingUpdate, StatusEnum
 
 from ooi_status.event_notifier import EventNotifier
-from ooi_status.metadata_queries import get_active_streams
-from ooi_status.status_message import StatusMessage
+from ooi_status.metadata_mirror import ActiveStreamMirror
+from ooi_status.metadata_queries import get_active_streams, get_uid_from_refdes
+from ooi_status.status_message import RateStatusMessage, StatusMessage
+from . import export, history, metadata_notify, metrics, sharding, snapshot, sql_stats, stream_cache
 from .get_logger import get_logger
-from .queries import (resample_port_count, get_port_rates_dataframe, get_rollup_status)
-from .stop_watch import stopwatch
+from .profiling import Profiler
+from .replay import parse_time_option
+from .queries import (resample_port_count, get_port_rates_dataframe, get_rollup_status, THRESHOLD_FIELDS,
+                      upsert_expected_streams, get_expected_changes, count_inheriting_deployed,
+                      clear_redundant_overrides, get_port_rate_frame, classify_port_rates)
 
 log = get_logger(__name__, logging.INFO)
 here = os.path.dirname(__file__)
 
 MAX_STATUS_POST_FAILURES = 5
-STREAM_CACHE = LRUCache(3000)
+
+PHASE_SECONDS = metrics.histogram('ooi_status_monitor_phase_seconds',
+                                  'Time spent in each status monitor phase', ['phase'])
+LAST_CYCLE = metrics.gauge('ooi_status_monitor_last_cycle_timestamp_seconds',
+                           'Unix time the last status check cycle completed')
+ACTIVE_STREAMS = metrics.gauge('ooi_status_monitor_active_streams', 'Active streams checked in the last cycle')
+STATUS_CHANGES = metrics.counter('ooi_status_monitor_status_changes_total', 'Stream status changes detected',
+                                 ['status'])
+NOTIFY_EVENTS = metrics.counter('ooi_status_notify_events_total', 'Status events posted to uFrame by result',
+                                ['result'])
+NOTIFY_SECONDS = metrics.histogram('ooi_status_notify_post_seconds', 'Latency of status event posts to uFrame')
+PENDING_UPDATES = metrics.gauge('ooi_status_notify_pending', 'Pending status updates remaining after notify')
 
 
 class StatusMonitor(object):
@@ -39,6 +55,8 @@ class StatusMonitor(object):
 
         self.engine = create_engine(config['MONITOR_URL'])
         self.metadata_engine = create_engine(config['METADATA_URL'])
+        sql_stats.instrument_from_config(self.engine, 'monitor', config)
+        sql_stats.instrument_from_config(self.metadata_engine, 'metadata', config)
 
         self.session_factory = sessionmaker(bind=self.engine, autocommit=True)
         self.session = self.session_factory()
@@ -46,52 +64,136 @@ class StatusMonitor(object):
         self.metadata_session_factory = sessionmaker(bind=self.metadata_engine, autocommit=True)
         self.metadata_session = self.metadata_session_factory()
 
-    @cached(STREAM_CACHE)
-    def _get_or_create_stream(self, refdes, stream, method):
-        refdes_obj = ReferenceDesignator.get_or_create(self.session, refdes)
-        expected_obj = ExpectedStream.get_or_create(self.session, stream, method)
-        return DeployedStream.get_or_create(self.session, refdes_obj, expected_obj)
+        self.profiler = Profiler.from_config(config)
+        self.shard = sharding.from_config(self.engine, config)
+        self.mirror = ActiveStreamMirror.from_config(config) if config.get('METADATA_MIRROR') else None
+        self.stream_cache = stream_cache.StreamCache.from_config(config)
+        self._owned = None
+        # last port data rate status of each instrument and the asset uid of each active instrument (RATE_STATUS)
+        self.rate_status = {}
+        self._uids = {}
+        # result of the last classification of the port data rates, reused by partial checks
+        self._rate_classified = None
+        # set once the stream cache invalidation listener runs, until then full checks reload the cache
+        self.cache_notified = False
+        # check_all and check_streams (called from the metadata listener) share the monitor session
+        self._check_lock = threading.Lock()
 
     def get_or_create_stream(self, refdes, stream, method):
         """
-        Attempt to fetch this value from the cached method. If the cached value no longer exists,
-        delete from the cache and create a new object.
+        :return: StreamInfo (ids, effective thresholds and status) of the deployed stream, created if needed
+        """
+        return self.stream_cache.get(self.session, refdes, stream, method)
+
+    def asset_uid(self, refdes):
+        """
+        :return: asset uid of the instrument, as seen by the last check or from its current deployment
+        """
+        uid = self._uids.get(refdes)
+        if uid is None:
+            # called from the AMQP consumer thread, which must not use the monitor's metadata session
+            session = self.metadata_session_factory()
+            try:
+                uid = get_uid_from_refdes(session, refdes)
+            finally:
+                session.close()
+        return uid
+
+    @PHASE_SECONDS.labels('save_snapshot').time()
+    def save_snapshot(self, scheduler=None):
+        """
+        Save the stream cache, metadata mirror and scheduler deadlines to SNAPSHOT_PATH
+        """
+        path = self.config.get('SNAPSHOT_PATH')
+        if not path:
+            return
+        # the snapshot reads through the monitor session, which must not be used by a check at the same time
+        with self._check_lock:
+            state = snapshot.capture(self, self.stream_cache, scheduler)
+        snapshot.save_snapshot(path, state)
+
+    @PHASE_SECONDS.labels('restore_snapshot').time()
+    def restore_snapshot(self):
+        """
+        Warm the stream cache and metadata mirror from SNAPSHOT_PATH
+        :return: the loaded Snapshot or None
+        """
+        path = self.config.get('SNAPSHOT_PATH')
+        if not path:
+            return None
+        state = snapshot.load_snapshot(path)
+        if state is not None:
+            snapshot.restore(self, self.stream_cache, state)
+        return state
+
+    @PHASE_SECONDS.labels('read_expected_csv').time()
+    def read_expected_csv(self, filename, push_defaults=False):
+        """
+        Populate expected stream definitions from definition in CSV-formatted file
+        :param filename: CSV file with name, method, expected_rate, warn_interval and fail_interval columns
+        :param push_defaults: clear deployed stream overrides equal to the new defaults of changed expected streams
+        :return: dictionary of inserted, updated and unchanged counts
         """
-        try:
-            ds = self._get_or_create_stream(refdes, stream, method)
-            s = ds.status
-        except ObjectDeletedError:
-            del STREAM_CACHE[(self, refdes, stream, method)]
-            ds = self._get_or_create_stream(refdes, stream, method)
-        return ds
-
-    @stopwatch()
-    def read_expected_csv(self, filename):
-        """ Populate expected stream definitions from definition in CSV-formatted file"""
         log.info('Populating the expected streams table')
-        df = pd.read_csv(filename)
         fields = ['name', 'method', 'expected_rate', 'warn_interval', 'fail_interval']
+        df = pd.read_csv(filename)[fields]
+        duplicated = df.duplicated(['name', 'method'], keep='last')
+        if duplicated.any():
+            names = df[duplicated][['name', 'method']].itertuples(index=False)
+            log.warning('Ignoring %d duplicate expected stream definitions: %s', duplicated.sum(),
+                        ', '.join('%s/%s' % tuple(row) for row in names))
+            df = df[~duplicated]
+
         with self.session.begin():
-            for stream, method, rate, warn_interval, fail_interval in df[fields].itertuples(index=False):
-                es = ExpectedStream.get_or_create(self.session, stream, method)
-                es.expected_rate = rate
-                es.warn_interval = warn_interval
-                es.fail_interval = fail_interval
-                self.session.add(es)
-
-    @stopwatch()
+            changes = get_expected_changes(self.session, df)
+            rows = df.astype(object).where(df.notnull(), None).to_dict('records')
+            inserted, updated = upsert_expected_streams(self.session, rows)
+            report = {
+                'inserted': len(inserted),
+                'updated': len(updated),
+                'unchanged': len(rows) - len(inserted) - len(updated),
+            }
+            if push_defaults:
+                report['inheriting'] = count_inheriting_deployed(self.session, updated)
+                report['cleared'] = clear_redundant_overrides(self.session, updated)
+
+        for row in changes.to_dict('records'):
+            if pd.isnull(row['expected_rate_old']):
+                log.info('Added %s/%s: %s', row['name'], row['method'],
+                         ', '.join('%s=%s' % (field, row[field]) for field in THRESHOLD_FIELDS))
+            else:
+                log.info('Changed %s/%s: %s', row['name'], row['method'],
+                         ', '.join('%s %s -> %s' % (field, row[field + '_old'], row[field])
+                                   for field in THRESHOLD_FIELDS if row[field] != row[field + '_old']))
+        log.info('Expected streams: %(inserted)d inserted, %(updated)d updated, %(unchanged)d unchanged', report)
+        return report
+
+    @PHASE_SECONDS.labels('check_status').time()
     def _check_status(self, rows):
         now = datetime.datetime.utcnow()
+        record_history = self.config.get('STATUS_HISTORY')
+        if record_history:
+            # time up to now is attributed to the statuses before this check
+            with self.session.begin():
+                history.accrue_status_time(self.session, now, datetime.timedelta(
+                    minutes=self.config.get('STATUS_ACCRUAL_MAX_GAP_MINUTES', 10)))
 
         messages = []
+        transitions = []
+        active = 0
+        updates = []
+        keys = {}
         with self.session.begin():
+            self.stream_cache.warm_if_stale(self.session)
 
             for stream_metadata, elapsed, uid in rows:
+                active += 1
+                self._uids[stream_metadata.refdes] = uid
                 deployed = self.get_or_create_stream(stream_metadata.refdes,
                                                      stream_metadata.stream,
                                                      stream_metadata.method)
 
-                status, interval = deployed.get_status(elapsed)
+                status, interval = stream_cache.get_status(deployed.warn_interval, deployed.fail_interval, elapsed)
 
                 if deployed.status == status:
                     continue
@@ -103,26 +205,101 @@ class StatusMonitor(object):
                                               deployed.status,
                                               status,
                                               interval))
-                deployed.status = status
-                deployed.status_time = now
-
+                if record_history:
+                    transitions.append({
+                        'deployed_stream_id': deployed.deployed_id,
+                        'reference_designator_id': deployed.refdes_id,
+                        'transition_time': now,
+                        'previous_status': deployed.status,
+                        'status': status,
+                        'elapsed_seconds': elapsed.total_seconds(),
+                    })
+                updates.append((deployed, status))
+                keys[deployed.deployed_id] = stream_metadata.refdes, stream_metadata.stream, stream_metadata.method
+                STATUS_CHANGES.labels(status).inc()
+
+            gone = self.stream_cache.set_statuses(self.session, updates, now)
+            if gone:
+                # deleted since they were cached, recreate them so the new status is recorded
+                statuses = {info.deployed_id: status for info, status in updates}
+                recreated = {info.deployed_id: self.get_or_create_stream(*keys[info.deployed_id]) for info in gone}
+                self.stream_cache.set_statuses(self.session, [(info, statuses[deployed_id])
+                                                              for deployed_id, info in recreated.items()], now)
+                for transition in transitions:
+                    info = recreated.get(transition['deployed_stream_id'])
+                    if info is not None:
+                        transition['deployed_stream_id'] = info.deployed_id
+                        transition['reference_designator_id'] = info.refdes_id
+            history.record_transitions(self.session, transitions)
+
+        ACTIVE_STREAMS.set(active)
         return messages
 
-    @stopwatch()
-    def _add_rollup_status(self, in_messages):
+    def _get_rate_status(self):
+        """
+        Port data rate status of every instrument with an expected rate
+        :return: dictionary mapping reference designator to (rate status, rate reason)
+        """
+        now = datetime.datetime.utcnow()
+        window = datetime.timedelta(minutes=self.config.get('RATE_STATUS_WINDOW_MINUTES', 60))
+        df = get_port_rate_frame(self.session, now - window, now)
+        return classify_port_rates(df,
+                                   degraded_ratio=self.config.get('RATE_STATUS_DEGRADED_RATIO', 0.5),
+                                   failed_ratio=self.config.get('RATE_STATUS_FAILED_RATIO', 0.1))
+
+    def _rate_changes(self, rate_status):
+        """
+        :param rate_status: dictionary returned by _get_rate_status
+        :return: list of (refdes, previous status) of the owned instruments whose port data rate status changed.
+                 A degraded or failed rate seen for the first time (e.g. after a restart) is also a change.
+        """
+        changes = []
+        for refdes, (status, _) in rate_status.items():
+            previous = self.rate_status.get(refdes)
+            if previous == status:
+                continue
+            if previous is None and status not in (StatusEnum.DEGRADED, StatusEnum.FAILED):
+                continue
+            if self.shard and not self.shard.owns(refdes, self._owned):
+                continue
+            changes.append((refdes, previous or StatusEnum.NOT_TRACKED))
+        return changes
+
+    @PHASE_SECONDS.labels('rollup_status').time()
+    def _add_rollup_status(self, in_messages, rate_status=None):
+        """
+        Set the rolled up instrument status of the stream status messages, and add a message for every instrument
+        whose port data rate status changed without a stream status change
+        :param rate_status: dictionary returned by _get_rate_status, or None when RATE_STATUS is off
+        """
         status_dict = {}
         out_messages = []
+        rate_status = rate_status or {}
         with self.session.begin():
             for each in in_messages:
                 rollup_status, rollup_reason = status_dict.get(each.refdes, (None, None))
                 if rollup_status is None:
-                    rollup_status, rollup_reason = get_rollup_status(self.session, each.refdes)
+                    rollup_status, rollup_reason = get_rollup_status(self.session, each.refdes,
+                                                                     rate_status.get(each.refdes))
                     status_dict[each.refdes] = rollup_status, rollup_reason
                 each.instrument_status = rollup_status
                 each.instrument_reason = rollup_reason
                 out_messages.append(each)
+
+            for refdes, previous in self._rate_changes(rate_status):
+                uid = self._uids.get(refdes)
+                if refdes in status_dict or uid is None:
+                    # already reported with a stream status change, or not seen active yet
+                    continue
+                status, reason = rate_status[refdes]
+                message = RateStatusMessage(refdes, uid, previous, status, reason)
+                message.instrument_status, message.instrument_reason = get_rollup_status(
+                    self.session, refdes, rate_status[refdes])
+                status_dict[refdes] = message.instrument_status, message.instrument_reason
+                out_messages.append(message)
         return out_messages
 
+    @PHASE_SECONDS.labels('resample').time()
     def resample_count_data_hourly(self):
         window_start = self.config.get('RESAMPLE_WINDOW_START_HOURS')
         window_end = self.config.get('RESAMPLE_WINDOW_END_HOURS')
@@ -132,7 +309,10 @@ class StatusMonitor(object):
         window_end_dt = now - datetime.timedelta(hours=window_end)
         session = self.session_factory()
 
+        owned = self.shard.refresh() if self.shard else None
         for reference_designator in self.session.query(ReferenceDesignator):
+            if owned is not None and not self.shard.owns(reference_designator.name, owned):
+                continue
             log.info('Resampling %s', reference_designator)
             with session.begin():
                 counts_df = get_port_rates_dataframe(session, reference_designator.id, window_end_dt, window_start_dt)
@@ -143,39 +323,94 @@ class StatusMonitor(object):
         event_port = self.config.get('NOTIFY_URL_PORT')
         return EventNotifier(self.session, root_url, event_port)
 
-    @stopwatch()
+    @PHASE_SECONDS.labels('save_pending').time()
     def save_pending(self, messages):
         with self.session.begin():
             for message in messages:
                 log.info('Staging status message: %r', message)
                 self.session.add(PendingUpdate(message=message.as_dict()))
 
+    @PHASE_SECONDS.labels('check_all').time()
     def check_all(self):
-        active = get_active_streams(self.metadata_session)
-        changed = self._check_status(active)
-        rolled = self._add_rollup_status(changed)
-        self.save_pending(rolled)
+        self._check('check_all')
 
+    @PHASE_SECONDS.labels('check_streams').time()
+    def check_streams(self, streams):
+        """
+        Check only the specified streams
+        :param streams: collection of (subsite, node, sensor, method, stream) tuples, or None to check all streams
+        """
+        if streams is None:
+            self.check_all()
+        else:
+            self._check('check_streams', streams)
+
+    def _check(self, name, streams=None):
+        with self._check_lock, self.profiler.cycle(name) as capture, sql_stats.scope(name, log_summary=True):
+            if self.mirror:
+                active = self.mirror.active_streams(self.metadata_session, streams=streams)
+            else:
+                active = get_active_streams(self.metadata_session, streams=streams,
+                                            batch_size=self.config.get('METADATA_FETCH_BATCH', 1000))
+            if self.shard:
+                owned = self.shard.refresh()
+                if self._owned is not None and owned - self._owned:
+                    # cached statuses of streams taken over from another monitor may be stale
+                    self.stream_cache.clear()
+                self._owned = owned
+                active = (row for row in active if self.shard.owns(row[0].refdes, owned))
+            if name == 'check_all' and not self.cache_notified:
+                # without invalidation notifications, threshold edits and deletes are picked up by reloading
+                with self.session.begin():
+                    self.stream_cache.warm(self.session)
+            changed = self._check_status(active)
+            rate_status = None
+            if self.config.get('RATE_STATUS'):
+                if name == 'check_all' or self._rate_classified is None:
+                    # rates are classified every full cycle so a rate change is reported even if no stream
+                    # changed, the checks of notified streams reuse the result rather than scan the port counts
+                    with self.session.begin():
+                        rate_status = self._get_rate_status()
+                else:
+                    rate_status = self._rate_classified
+            rolled = self._add_rollup_status(changed, rate_status)
+            self.save_pending(rolled)
+            if rate_status is not None:
+                # only once the changes are staged, a failed cycle reports them again
+                self._rate_classified = rate_status
+                self.rate_status = {refdes: status for refdes, (status, _) in rate_status.items()}
+            capture.metadata.update(changed=len(changed), pending=len(rolled))
+        LAST_CYCLE.set_to_current_time()
+
+    @PHASE_SECONDS.labels('notify_all').time()
     def notify_all(self):
         notifier = self.get_status_notifier()
         session = self.session_factory()
 
         with session.begin():
-            for pu in session.query(PendingUpdate).order_by(PendingUpdate.id):
+            remaining = 0
+            query = session.query(PendingUpdate).order_by(PendingUpdate.id)
+            if self.shard:
+                # several monitors share the queue, each update is delivered by whichever locks it first
+                query = query.with_for_update(skip_locked=True)
+            for pu in query:
                 message = pu.message
                 uid = message.get('assetUid')
                 delete = False
                 if uid and message:
                     try:
-                        response = notifier.post_event(uid, message)
-                        response.raise_for_status()
+                        with NOTIFY_SECONDS.time():
+                            response = notifier.post_event(uid, message)
+                        # HTTP errors are handled by status code below, only connection failures raise
                         status_code = response.status_code
                         if status_code == 201:
+                            NOTIFY_EVENTS.labels('delivered').inc()
                             delete = True
                         elif 400 <= status_code < 500:
                             # client error - increment the error count
                             log.error('Received client error from events API: (%d) %r',
                                       status_code, response.content)
+                            NOTIFY_EVENTS.labels('client_error').inc()
                             pu.error_count += 1
                             if pu.error_count > MAX_STATUS_POST_FAILURES:
                                 delete = True
@@ -184,46 +419,162 @@ class StatusMonitor(object):
                             # log the problem
                             log.error('Received server error from events API: (%d) %r',
                                       status_code, response.content)
+                            NOTIFY_EVENTS.labels('server_error').inc()
+                            remaining += 1
                             continue
                         else:
                             # unknown response
                             # log, but don't increment error count
                             log.error('Received unexpected response from events API: (%d) %r',
                                       status_code, response.content)
+                            NOTIFY_EVENTS.labels('unexpected').inc()
                     except requests.exceptions.RequestException:
                         # Don't count this as an error
                         # we'll keep trying until we can connect to uframe
+                        NOTIFY_EVENTS.labels('connection_error').inc()
+                        remaining += 1
                         continue
                 if delete:
                     session.delete(pu)
+                else:
+                    remaining += 1
+            PENDING_UPDATES.set(remaining)
+
 
+# noinspection PyUnusedLocal
+def _raise_system_exit(signum, frame):
+    raise SystemExit(0)
 
-@click.command()
+
+@click.group(invoke_without_command=True)
 @click.option('--expected', type=click.Path(exists=True, dir_okay=False),
               help='CSV file with expected rates and timeouts')
-def main(expected):
+@click.option('--push-defaults', is_flag=True,
+              help='With --expected, clear deployed stream overrides which equal the new defaults')
+@click.option('--install-trigger', is_flag=True,
+              help='Install the stream metadata notification trigger in the metadata database and the stream '
+                   'cache invalidation triggers in the monitor database and exit')
+@click.pass_context
+def main(ctx, expected, push_defaults, install_trigger):
     config = Config(here)
     config.from_object('ooi_status.default_settings')
     if 'OOISTATUS_SETTINGS' in os.environ:
         config.from_envvar('OOISTATUS_SETTINGS')
 
+    if ctx.invoked_subcommand is not None:
+        # subcommands run instead of the monitor
+        ctx.obj = config
+        return
+
     for key in config:
         log.info('OOI_STATUS CONFIG: %r: %r', key, config[key])
 
+    if config.get('METADATA_NOTIFY') and not config['METADATA_NOTIFY_SWEEP_MINUTES'] > 0:
+        raise click.UsageError('METADATA_NOTIFY_SWEEP_MINUTES must be greater than zero')
+
     monitor = StatusMonitor(config)
 
     if expected:
-        monitor.read_expected_csv(expected)
+        report = monitor.read_expected_csv(expected, push_defaults=push_defaults)
+        click.echo(', '.join('%s: %s' % item for item in sorted(report.items())))
+
+    elif install_trigger:
+        metadata_notify.install_trigger(monitor.metadata_engine, config['METADATA_NOTIFY_CHANNEL'])
+        stream_cache.install_triggers(monitor.engine, config['STREAM_CACHE_CHANNEL'])
 
     else:
+        if config.get('METRICS_PORT'):
+            metrics.start_http_server(config['METRICS_PORT'])
+
         scheduler = BlockingScheduler()
+        restored = monitor.restore_snapshot()
+        # jobs which came due while the monitor was stopped run immediately
+        missed = snapshot.missed_jobs(restored) if restored else []
+        if config.get('STREAM_CACHE_NOTIFY'):
+            if stream_cache.triggers_installed(monitor.engine):
+                # edits and deletes in the monitor database invalidate the cached ids and thresholds
+                invalidator = metadata_notify.MetadataListener(monitor.engine, config['STREAM_CACHE_CHANNEL'],
+                                                               monitor.stream_cache.on_notify, debounce=0,
+                                                               parse=stream_cache.parse_payload)
+                invalidator.start_thread()
+                monitor.cache_notified = True
+            else:
+                log.warning('Stream cache triggers are not installed (run with --install-trigger), '
+                            'the cache is reloaded by every full check')
         log.info('adding jobs')
 
-        # notify on change every minute
-        scheduler.add_job(monitor.check_all, 'cron', second=0)
-        scheduler.add_job(monitor.notify_all, 'cron', second=10)
+        def first_run(job_id):
+            # passing next_run_time=None would add the job paused
+            return {'next_run_time': datetime.datetime.now()} if job_id in missed else {}
+
+        if config.get('METADATA_NOTIFY'):
+            # streams are checked as their metadata changes, the full sweep only catches streams going stale
+            listener = metadata_notify.MetadataListener(monitor.metadata_engine, config['METADATA_NOTIFY_CHANNEL'],
+                                                        monitor.check_streams,
+                                                        debounce=config['METADATA_NOTIFY_DEBOUNCE_SECONDS'])
+            listener.start_thread()
+            scheduler.add_job(monitor.check_all, 'interval', minutes=config['METADATA_NOTIFY_SWEEP_MINUTES'],
+                              id='check_all', **first_run('check_all'))
+        else:
+            # notify on change every minute
+            scheduler.add_job(monitor.check_all, 'cron', second=0, id='check_all')
+        scheduler.add_job(monitor.notify_all, 'cron', second=10, id='notify_all', **first_run('notify_all'))
+        if config.get('AMQP_CONSUMER'):
+            # kombu is only needed when the consumer runs in the monitor
+            from .amqp_client import AmqpStatsClient
+
+            # rate changes of instruments reported by RATE_STATUS check every stream straight away, rather than
+            # waiting for the next cycle, the others are staged by the consumer
+            def on_rate_event(event):
+                scheduler.add_job(monitor.check_all, id='rate_event', replace_existing=True)
+
+            consumer = AmqpStatsClient.from_config(config, create_engine(config['MONITOR_URL']),
+                                                   stream_cache=monitor.stream_cache, uid_resolver=monitor.asset_uid,
+                                                   on_rate_event=on_rate_event)
+            consumer.start_thread()
+        if monitor.shard:
+            monitor.shard.refresh()
+            scheduler.add_job(monitor.shard.refresh, 'interval', seconds=config['SHARD_REBALANCE_SECONDS'])
+        if config.get('SNAPSHOT_PATH'):
+            scheduler.add_job(monitor.save_snapshot, 'interval', seconds=config['SNAPSHOT_INTERVAL_SECONDS'],
+                              args=[scheduler], id='snapshot')
         log.info('starting jobs')
-        scheduler.start()
+        # stop on SIGTERM (e.g. from a service manager) as on Ctrl-C, so the snapshot below is saved
+        signal.signal(signal.SIGTERM, _raise_system_exit)
+        try:
+            scheduler.start()
+        except (KeyboardInterrupt, SystemExit):
+            monitor.save_snapshot(scheduler)
+            raise
+
+
+@main.command('export')
+@click.argument('dataset', type=click.Choice(export.DATASETS))
+@click.option('--format', 'output_format', type=click.Choice(export.FORMATS), default='csv',
+              help='Output format (default csv, parquet requires pyarrow)')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write to this file (default stdout)')
+@click.option('--refdes', help='Reference designators containing this string')
+@click.option('--method', help='Methods containing this string')
+@click.option('--stream', help='Streams containing this string')
+@click.option('--status', help='Streams (or spans) with this status')
+@click.option('--start', callback=parse_time_option, help='Start of the window (default 30 days before end)')
+@click.option('--end', callback=parse_time_option, help='End of the window (default now)')
+@click.pass_obj
+def export_command(config, dataset, output_format, output, refdes, method, stream, status, start, end):
+    """
+    Export stream status, port counts or status spans
+    """
+    if output_format == 'parquet' and not export.parquet_available():
+        raise click.UsageError('Parquet export requires pyarrow')
+    session = sessionmaker(bind=create_engine(config['MONITOR_URL']))()
+    try:
+        body = export.export(session, dataset, output_format, batch_size=config['EXPORT_BATCH_SIZE'],
+                             refdes=refdes, method=method, stream=stream, status=status, start=start, end=end)
+        with click.open_file(output or '-', 'wb') as fh:
+            for chunk in body:
+                fh.write(chunk)
+    finally:
+        session.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,427 @@
+"""
+Shared cache of reference designator, expected stream and deployed stream ids and thresholds.
+
+The status monitor and AMQP client only need ids, thresholds and the current status of each deployed stream, so
+this cache holds plain tuples rather than ORM instances bound to a session:
+
+* reference designator name -> id
+* (stream name, method) -> (expected stream id, warn_interval, fail_interval)
+* (reference designator id, expected stream id) -> (deployed stream id, warn override, fail override, status)
+
+The whole fleet is loaded with one joined query (warm) and missing entries are created and cached on demand.
+Triggers on the three tables (installed with ooi_status_monitor --install-trigger) publish the id of every deleted
+row and of every row whose thresholds or names change, and a listener invalidates those entries. Notifications
+missed while the listener was disconnected clear the cache, and it is reloaded every STREAM_CACHE_REFRESH_MINUTES
+as a safety net.
+
+Entries created and statuses written inside a transaction are kept in the session until it commits, so a rolled
+back transaction never leaves uncommitted ids or statuses in the shared cache.
+"""
+import datetime
+import logging
+import threading
+from collections import namedtuple
+
+from cachetools import LRUCache
+from ooi_data.postgres.model import DeployedStream, ExpectedStream, ReferenceDesignator
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .get_logger import get_logger
+from .status_message import StatusEnum
+
+log = get_logger(__name__, logging.INFO)
+
+CACHE_MISSES = metrics.counter('ooi_status_stream_cache_misses_total', 'Stream cache lookups which hit the database',
+                               ['kind'])
+CACHE_INVALIDATIONS = metrics.counter('ooi_status_stream_cache_invalidations_total',
+                                      'Stream cache entries invalidated by notifications', ['table'])
+
+FUNCTION_NAME = 'ooi_status_notify_stream_cache'
+TRIGGER_NAME = 'ooi_status_stream_cache_notify'
+
+# columns whose changes invalidate cached entries (status updates are written by the monitor itself)
+WATCHED_COLUMNS = {
+    ReferenceDesignator.__tablename__: ['name'],
+    ExpectedStream.__tablename__: ['name', 'method', 'warn_interval', 'fail_interval'],
+    DeployedStream.__tablename__: ['reference_designator_id', 'expected_stream_id', 'warn_interval',
+                                   'fail_interval'],
+}
+
+_CREATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', TG_TABLE_NAME || ':' || OLD.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+_DROP_TRIGGER = 'DROP TRIGGER IF EXISTS {trigger} ON {table}'
+_CREATE_TRIGGER = """
+CREATE TRIGGER {trigger} AFTER UPDATE OF {columns} OR DELETE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE {function}()
+"""
+
+_PENDING = 'ooi_status_stream_cache_pending'
+
+_COUNT_TRIGGERS = text('SELECT count(*) FROM pg_trigger WHERE tgname = :name')
+
+StreamInfo = namedtuple('StreamInfo', 'deployed_id refdes_id expected_id warn_interval fail_interval status')
+
+
+def install_triggers(engine, channel):
+    """
+    Create (or replace) the invalidation triggers on the monitor tables
+    """
+    with engine.begin() as conn:
+        conn.execute(_CREATE_FUNCTION.format(function=FUNCTION_NAME, channel=channel))
+        for table, columns in WATCHED_COLUMNS.items():
+            conn.execute(_DROP_TRIGGER.format(trigger=TRIGGER_NAME, table=table))
+            conn.execute(_CREATE_TRIGGER.format(trigger=TRIGGER_NAME, table=table, columns=', '.join(columns),
+                                                function=FUNCTION_NAME))
+    log.info('Installed %s triggers on %s', channel, ', '.join(sorted(WATCHED_COLUMNS)))
+
+
+def triggers_installed(engine):
+    """
+    :return: True if the invalidation triggers exist on every watched table of the monitor database
+    """
+    with engine.connect() as conn:
+        count = conn.execute(_COUNT_TRIGGERS, name=TRIGGER_NAME).scalar()
+    return count == len(WATCHED_COLUMNS)
+
+
+def parse_payload(payload):
+    """
+    :return: (table, id) tuple or None if the payload is not a cache notification
+    """
+    table, _, row_id = payload.partition(':')
+    if table not in WATCHED_COLUMNS or not row_id.isdigit():
+        return None
+    return table, int(row_id)
+
+
+def get_status(warn_interval, fail_interval, elapsed):
+    """
+    Status of a stream from its effective thresholds, following the rules of DeployedStream.get_status (without
+    loading the ORM instances): a zero threshold is disabled and a stream with both thresholds zero is not tracked
+    :param elapsed: timedelta since the last particle
+    :return: (status, interval)
+    """
+    if not warn_interval and not fail_interval:
+        return StatusEnum.NOT_TRACKED, None
+    seconds = elapsed.total_seconds()
+    if fail_interval and seconds > fail_interval:
+        return StatusEnum.FAILED, datetime.timedelta(seconds=fail_interval)
+    if warn_interval and seconds > warn_interval:
+        return StatusEnum.DEGRADED, datetime.timedelta(seconds=warn_interval)
+    return StatusEnum.OPERATIONAL, datetime.timedelta(seconds=warn_interval or fail_interval)
+
+
+def _stream_info(refdes_id, expected, deployed):
+    """
+    Combine cached expected and deployed stream tuples, unset overrides inherit the expected stream thresholds
+    """
+    expected_id, warn_default, fail_default = expected
+    deployed_id, warn_override, fail_override, status = deployed
+    return StreamInfo(deployed_id, refdes_id, expected_id,
+                      warn_default if warn_override is None else warn_override,
+                      fail_default if fail_override is None else fail_override,
+                      status)
+
+
+class _Pending(object):
+    """
+    Cache writes of one transaction, applied to the StreamCache when it commits
+    """
+    def __init__(self):
+        self.refdes = {}
+        self.expected = {}
+        self.deployed = {}
+        self.statuses = {}
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    for cache, pending in session.info.pop(_PENDING, {}).items():
+        cache._apply(pending)
+
+
+# noinspection PyUnusedLocal
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    session.info.pop(_PENDING, None)
+
+
+class StreamCache(object):
+    """
+    :param maxsize: maximum number of deployed streams cached
+    :param refresh_interval: timedelta after which warm_if_stale reloads the cache
+    """
+    def __init__(self, maxsize=100000, refresh_interval=datetime.timedelta(hours=1)):
+        self.maxsize = maxsize
+        self.refresh_interval = refresh_interval
+        self.refdes = {}
+        self.refdes_names = {}
+        self.expected = {}
+        self.expected_keys = {}
+        self.deployed = LRUCache(maxsize)
+        self.deployed_keys = {}
+        self.last_warm = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(maxsize=config.get('STREAM_CACHE_SIZE', 100000),
+                   refresh_interval=datetime.timedelta(minutes=config.get('STREAM_CACHE_REFRESH_MINUTES', 60)))
+
+    def __len__(self):
+        return len(self.deployed)
+
+    def _put_refdes(self, name, refdes_id):
+        self.refdes[name] = refdes_id
+        self.refdes_names[refdes_id] = name
+
+    def _put_expected(self, name, method, expected_id, warn_interval, fail_interval):
+        self.expected[(name, method)] = expected_id, warn_interval, fail_interval
+        self.expected_keys[expected_id] = name, method
+
+    def _put_deployed(self, refdes_id, expected_id, deployed_id, warn_override, fail_override, status):
+        self.deployed[(refdes_id, expected_id)] = deployed_id, warn_override, fail_override, status
+        self.deployed_keys[deployed_id] = refdes_id, expected_id
+
+    def _pending(self, session):
+        """
+        :return: the writes of this cache in the current transaction of session
+        """
+        return session.info.setdefault(_PENDING, {}).setdefault(self, _Pending())
+
+    def _autocommitted(self, session):
+        """
+        Apply the writes straight away if session is in autocommit mode outside of a transaction, as they have
+        already been committed
+        """
+        if session.transaction is None:
+            _apply_pending(session)
+
+    def _apply(self, pending):
+        with self._lock:
+            for name, refdes_id in pending.refdes.items():
+                self._put_refdes(name, refdes_id)
+            for (name, method), expected in pending.expected.items():
+                self._put_expected(name, method, *expected)
+            for (refdes_id, expected_id), deployed in pending.deployed.items():
+                self._put_deployed(refdes_id, expected_id, *deployed)
+            for key, status in pending.statuses.items():
+                # entries invalidated in the meantime are read again on the next lookup
+                deployed = self.deployed.get(key)
+                if deployed is not None:
+                    self.deployed[key] = deployed[:3] + (status,)
+
+    def clear(self):
+        with self._lock:
+            self.refdes.clear()
+            self.refdes_names.clear()
+            self.expected.clear()
+            self.expected_keys.clear()
+            self.deployed.clear()
+            self.deployed_keys.clear()
+            self.last_warm = None
+
+    def warm(self, session, deployed_ids=None):
+        """
+        Load every (or the specified) deployed stream with its reference designator and expected stream in one
+        query, replacing the cached entries
+        :return: number of deployed streams loaded
+        """
+        rows = session.query(
+            DeployedStream.id,
+            DeployedStream._warn_interval,
+            DeployedStream._fail_interval,
+            DeployedStream.status,
+            ReferenceDesignator.id,
+            ReferenceDesignator.name,
+            ExpectedStream.id,
+            ExpectedStream.name,
+            ExpectedStream.method,
+            ExpectedStream.warn_interval,
+            ExpectedStream.fail_interval,
+        ).join(DeployedStream.reference_designator).join(DeployedStream.expected_stream)
+        if deployed_ids is not None:
+            rows = rows.filter(DeployedStream.id.in_(list(deployed_ids)))
+        rows = rows.all()
+
+        with self._lock:
+            self.clear()
+            for (deployed_id, warn_override, fail_override, status, refdes_id, refdes, expected_id,
+                 name, method, warn_interval, fail_interval) in rows:
+                self._put_refdes(refdes, refdes_id)
+                self._put_expected(name, method, expected_id, warn_interval, fail_interval)
+                self._put_deployed(refdes_id, expected_id, deployed_id, warn_override, fail_override, status)
+            count = len(rows)
+            self.last_warm = datetime.datetime.utcnow()
+        log.info('Stream cache loaded %d deployed streams', count)
+        return count
+
+    def warm_if_stale(self, session):
+        if self.last_warm is None or datetime.datetime.utcnow() - self.last_warm >= self.refresh_interval:
+            self.warm(session)
+
+    def refdes_id(self, session, name):
+        """
+        :return: id of the named reference designator, created if it does not exist
+        """
+        with self._lock:
+            refdes_id = self.refdes.get(name)
+        if refdes_id is None:
+            refdes_id = self._pending(session).refdes.get(name)
+            if refdes_id is None:
+                CACHE_MISSES.labels('refdes').inc()
+                refdes_id = ReferenceDesignator.get_or_create(session, name).id
+                self._pending(session).refdes[name] = refdes_id
+                self._autocommitted(session)
+        return refdes_id
+
+    def _expected(self, session, name, method):
+        with self._lock:
+            expected = self.expected.get((name, method))
+        if expected is None:
+            expected = self._pending(session).expected.get((name, method))
+            if expected is None:
+                CACHE_MISSES.labels('expected').inc()
+                obj = ExpectedStream.get_or_create(session, name, method)
+                expected = obj.id, obj.warn_interval, obj.fail_interval
+                self._pending(session).expected[(name, method)] = expected
+                self._autocommitted(session)
+        return expected
+
+    def get(self, session, refdes, stream, method):
+        """
+        :return: StreamInfo of the deployed stream, created if it does not exist
+        """
+        refdes_id = self.refdes_id(session, refdes)
+        expected = self._expected(session, stream, method)
+        expected_id = expected[0]
+        key = refdes_id, expected_id
+        with self._lock:
+            deployed = self.deployed.get(key)
+        if deployed is None:
+            deployed = self._pending(session).deployed.get(key)
+            if deployed is None:
+                CACHE_MISSES.labels('deployed').inc()
+                refdes_obj = session.query(ReferenceDesignator).get(refdes_id)
+                expected_obj = session.query(ExpectedStream).get(expected_id)
+                obj = DeployedStream.get_or_create(session, refdes_obj, expected_obj)
+                deployed = obj.id, obj._warn_interval, obj._fail_interval, obj.status
+                # looked up after the writes, which commit straight away in autocommit mode
+                self._pending(session).deployed[key] = deployed
+                self._autocommitted(session)
+
+        return _stream_info(refdes_id, expected, deployed)
+
+    def entries(self):
+        """
+        :return: list of ((refdes, stream, method), StreamInfo) for every cached deployed stream
+        """
+        with self._lock:
+            result = []
+            for (refdes_id, expected_id), deployed in self.deployed.items():
+                refdes = self.refdes_names.get(refdes_id)
+                key = self.expected_keys.get(expected_id)
+                if refdes is None or key is None:
+                    continue
+                result.append(((refdes,) + key, _stream_info(refdes_id, self.expected[key], deployed)))
+            return result
+
+    def set_statuses(self, session, updates, now):
+        """
+        Write new statuses with a single executemany UPDATE, recorded in the cache once the transaction commits.
+        Entries whose deployed stream was deleted since it was cached are invalidated, with their reference
+        designator and expected stream if those were deleted too, so the next lookup recreates them.
+        :param updates: list of (StreamInfo, new status) tuples
+        :return: list of the StreamInfo whose deployed stream no longer exists
+        """
+        if not updates:
+            return []
+        table = DeployedStream.__table__
+        statement = table.update().where(table.c.id == bindparam('deployed_id')).values(
+            status=bindparam('new_status'), status_time=bindparam('new_time'))
+        result = session.execute(statement, [{'deployed_id': info.deployed_id, 'new_status': status,
+                                              'new_time': now} for info, status in updates])
+        gone = []
+        if result.rowcount != len(updates) or not result.supports_sane_multi_rowcount():
+            gone = self._drop_deleted(session, [info for info, _ in updates])
+
+        pending = self._pending(session)
+        gone_ids = {info.deployed_id for info in gone}
+        for info, status in updates:
+            if info.deployed_id in gone_ids:
+                continue
+            key = info.refdes_id, info.expected_id
+            if key in pending.deployed:
+                pending.deployed[key] = pending.deployed[key][:3] + (status,)
+            else:
+                pending.statuses[key] = status
+        self._autocommitted(session)
+        return gone
+
+    def _drop_deleted(self, session, infos):
+        """
+        Invalidate the entries of deleted rows
+        :return: list of the StreamInfo whose deployed stream no longer exists
+        """
+        def existing(model, ids):
+            return {row_id for row_id, in session.query(model.id).filter(model.id.in_(list(ids)))}
+
+        deployed_ids = existing(DeployedStream, {info.deployed_id for info in infos})
+        gone = [info for info in infos if info.deployed_id not in deployed_ids]
+        if not gone:
+            return gone
+        refdes_ids = existing(ReferenceDesignator, {info.refdes_id for info in gone})
+        expected_ids = existing(ExpectedStream, {info.expected_id for info in gone})
+        pending = session.info.get(_PENDING, {}).get(self)
+        for info in gone:
+            log.warning('Deployed stream %d was deleted, recreating it', info.deployed_id)
+            if pending is not None:
+                pending.deployed.pop((info.refdes_id, info.expected_id), None)
+            self.invalidate(DeployedStream.__tablename__, info.deployed_id)
+            if info.refdes_id not in refdes_ids:
+                self.invalidate(ReferenceDesignator.__tablename__, info.refdes_id)
+            if info.expected_id not in expected_ids:
+                self.invalidate(ExpectedStream.__tablename__, info.expected_id)
+        return gone
+
+    def invalidate(self, table, row_id):
+        """
+        Drop the entries depending on a changed or deleted row
+        """
+        with self._lock:
+            if table == ReferenceDesignator.__tablename__:
+                name = self.refdes_names.pop(row_id, None)
+                self.refdes.pop(name, None)
+                keys = [key for key in self.deployed if key[0] == row_id]
+            elif table == ExpectedStream.__tablename__:
+                self.expected.pop(self.expected_keys.pop(row_id, None), None)
+                # deployed entries hold only overrides, the new defaults are read on the next lookup
+                keys = []
+            else:
+                key = self.deployed_keys.pop(row_id, None)
+                keys = [key] if key is not None else []
+            for key in keys:
+                deployed = self.deployed.pop(key, None)
+                if deployed is not None:
+                    self.deployed_keys.pop(deployed[0], None)
+        CACHE_INVALIDATIONS.labels(table).inc()
+
+    def on_notify(self, keys):
+        """
+        MetadataListener callback
+        :param keys: set of (table, id) tuples or None if notifications may have been missed
+        """
+        if keys is None:
+            log.info('Stream cache invalidation notifications may have been missed, clearing the cache')
+            self.clear()
+            return
+        for table, row_id in keys:
+            self.invalidate(table, row_id)
@@ -11,6 +11,8 @@ setup(
     entry_points={
           'console_scripts': [
               'ooi_status_monitor=ooi_status.status_monitor:main',
+              'ooi_status_replay=ooi_status.replay:main',
+              'ooi_status_estimate=ooi_status.estimate:main',
           ],
       },
 )
@@ -0,0 +1,71 @@
+import logging
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy_utils import database_exists, create_database
+from ooi_data.postgres import model
+
+from ooi_status.api import app
+from ooi_status.get_logger import get_logger
+from ooi_status.query_counter import QueryCounter
+
+log = get_logger(__name__, level=logging.INFO)
+
+REFDES = ['RS03AXPS-PC03A-06-VADCPA301', 'RS03AXPS-SF03A-4A-NUTNRA301', 'CE04OSBP-LJ01C-06-CTDBPO108']
+STREAMS = ['adcp_engineering', 'vadcp_velocity_beam', 'nutnr_a_sample', 'ctdbp_no_sample']
+
+# maximum number of SQL statements each endpoint may issue, regardless of the number of streams returned
+QUERY_BUDGET = {
+    '/instrument': 1,
+    '/instrument/%(refdes_id)d': 1,
+    '/stream': 1,
+    '/stream/%(deployed_id)d': 1,
+    '/deployed/%(deployed_id)d': 1,
+    '/expected': 1,
+    '/expected/%(expected_id)d': 1,
+    # reference designator name, then the bucketed port counts
+    '/instrument/%(refdes_id)d/rates': 2,
+}
+
+
+class ApiQueryBudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('postgresql+psycopg2://monitor@localhost/monitor_test')
+
+        if not database_exists(cls.engine.url):
+            create_database(cls.engine.url, template='template_postgis')
+
+        model.create_database(cls.engine, drop=True)
+
+        session = sessionmaker(bind=cls.engine)()
+        for refdes in REFDES:
+            refdes_obj = model.ReferenceDesignator.get_or_create(session, refdes)
+            for stream in STREAMS:
+                expected_obj = model.ExpectedStream.get_or_create(session, stream, 'streamed')
+                deployed_obj = model.DeployedStream.get_or_create(session, refdes_obj, expected_obj)
+        session.commit()
+
+        cls.ids = {
+            'refdes_id': refdes_obj.id,
+            'expected_id': expected_obj.id,
+            'deployed_id': deployed_obj.id,
+        }
+        session.close()
+
+        app.sessionmaker.configure(bind=cls.engine, primary=cls.engine, replica=None)
+        cls.client = app.test_client()
+
+    def assert_query_budget(self, url, budget):
+        with QueryCounter(self.engine) as counter:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            # consume streamed responses inside the counter
+            response.get_data()
+        self.assertLessEqual(counter.count, budget, '%s issued %d statements: %r' % (url, counter.count,
+                                                                                     counter.statements))
+
+    def test_query_budget(self):
+        for url, budget in QUERY_BUDGET.items():
+            self.assert_query_budget(url % self.ids, budget)
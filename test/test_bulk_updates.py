@@ -0,0 +1,117 @@
+import json
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy_utils import database_exists, create_database
+from ooi_data.postgres import model
+
+from ooi_status.api import app
+
+REFDES = ['RS03AXPS-PC03A-06-VADCPA301', 'RS03AXPS-SF03A-4A-NUTNRA301', 'CE04OSBP-LJ01C-06-CTDBPO108']
+STREAMS = ['adcp_engineering', 'vadcp_velocity_beam', 'nutnr_a_sample', 'ctdbp_no_sample']
+THRESHOLDS = ('_expected_rate', '_warn_interval', '_fail_interval')
+
+
+class BulkUpdateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('postgresql+psycopg2://monitor@localhost/monitor_test')
+
+        if not database_exists(cls.engine.url):
+            create_database(cls.engine.url, template='template_postgis')
+
+        app.sessionmaker.configure(bind=cls.engine, primary=cls.engine, replica=None)
+        cls.client = app.test_client()
+
+    def setUp(self):
+        model.create_database(self.engine, drop=True)
+        self.session = sessionmaker(bind=self.engine)()
+        for refdes in REFDES:
+            refdes_obj = model.ReferenceDesignator.get_or_create(self.session, refdes)
+            for stream in STREAMS:
+                expected_obj = model.ExpectedStream.get_or_create(self.session, stream, 'streamed')
+                model.DeployedStream.get_or_create(self.session, refdes_obj, expected_obj)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def request(self, method, url, body):
+        return self.client.open(url, method=method, data=json.dumps(body), content_type='application/json')
+
+    def deployed_thresholds(self):
+        """
+        :return: dictionary mapping (refdes, stream) to the (expected_rate, warn, fail) overrides
+        """
+        self.session.expire_all()
+        return {(d.reference_designator.name, d.expected_stream.name): tuple(getattr(d, f) for f in THRESHOLDS)
+                for d in self.session.query(model.DeployedStream)}
+
+    def test_update_deployed_by_filter(self):
+        response = self.request('PATCH', '/deployed', {'refdes': 'RS03AXPS', 'stream': 'nutnr',
+                                                       'warn_interval': 600, 'fail_interval': 1800})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data(as_text=True)), {'updated': 2})
+
+        # only the streams matched by the joined id subquery are updated
+        for (refdes, stream), values in self.deployed_thresholds().items():
+            if refdes.startswith('RS03AXPS') and stream == 'nutnr_a_sample':
+                self.assertEqual(values, (None, 600, 1800))
+            else:
+                self.assertEqual(values, (None, None, None))
+
+    def test_update_deployed_by_ids(self):
+        ids = [d.id for d in self.session.query(model.DeployedStream).limit(3)]
+        response = self.request('PATCH', '/deployed', {'ids': ids, 'expected_rate': 1.5})
+        self.assertEqual(json.loads(response.get_data(as_text=True)), {'updated': 3})
+        self.session.expire_all()
+        rates = {d.id: d._expected_rate for d in self.session.query(model.DeployedStream)}
+        self.assertEqual(sorted(i for i, rate in rates.items() if rate == 1.5), sorted(ids))
+
+    def test_invalid_request_updates_nothing(self):
+        before = self.deployed_thresholds()
+        bodies = [
+            # one valid and one invalid value
+            {'refdes': 'RS03AXPS', 'warn_interval': 600, 'fail_interval': 'later'},
+            {'refdes': 'RS03AXPS', 'warn_interval': -1},
+            {'refdes': 'RS03AXPS', 'warn_interval': True},
+            {'ids': [1, 'two'], 'warn_interval': 600},
+            {'refdes_names': 'RS03AXPS-PC03A-4A-CTDPFA303', 'warn_interval': 600},
+            {'refdes_names': [{'name': 'RS03AXPS'}], 'warn_interval': 600},
+            # no selection
+            {'warn_interval': 600},
+        ]
+        for body in bodies:
+            response = self.request('PATCH', '/deployed', body)
+            self.assertEqual(response.status_code, 400, body)
+        for body in [{'ids': [1, 'two']}, {'ids': 1}, {'refdes_names': [1]}, {}]:
+            response = self.request('PUT', '/stream/disable', body)
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(self.deployed_thresholds(), before)
+
+    def test_disable_enable(self):
+        response = self.request('PUT', '/stream/disable', {'refdes': 'CE04OSBP'})
+        self.assertEqual(json.loads(response.get_data(as_text=True)), {'updated': len(STREAMS)})
+        for (refdes, stream), values in self.deployed_thresholds().items():
+            # disabling zeroes every override
+            self.assertEqual(values, (0, 0, 0) if refdes.startswith('CE04OSBP') else (None, None, None))
+
+        response = self.request('PUT', '/stream/enable', {'refdes': 'CE04OSBP'})
+        self.assertEqual(json.loads(response.get_data(as_text=True)), {'updated': len(STREAMS)})
+        # enabling clears the overrides so the expected stream thresholds apply again
+        self.assertEqual(set(self.deployed_thresholds().values()), {(None, None, None)})
+
+    def test_update_expected(self):
+        response = self.request('PATCH', '/expected', {'method': 'streamed', 'stream': 'ctdbp_no_sample',
+                                                       'warn_interval': 300, 'fail_interval': 900})
+        self.assertEqual(json.loads(response.get_data(as_text=True)), {'updated': 1})
+        self.session.expire_all()
+        expected = self.session.query(model.ExpectedStream).filter_by(name='ctdbp_no_sample').one()
+        self.assertEqual((expected.warn_interval, expected.fail_interval), (300, 900))
+
+        # null may clear a deployed override but is not a valid default
+        response = self.request('PATCH', '/expected', {'stream': 'ctdbp_no_sample', 'warn_interval': None})
+        self.assertEqual(response.status_code, 400)
+        response = self.request('PATCH', '/expected', {'warn_interval': 300})
+        self.assertEqual(response.status_code, 400)
@@ -42,3 +42,7 @@ class StatusMonitorTest(unittest.TestCase):
         with self.monitor.session.begin():
             self.assertEqual(self.monitor.session.query(model.ExpectedStream).count(), 365)
 
+    def test_reload_expected(self):
+        report = self.monitor.read_expected_csv(os.path.join(test_dir, 'data', 'expected-rates.csv'))
+        self.assertEqual(report, {'inserted': 0, 'updated': 0, 'unchanged': 365})
+
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+from ooi_status.downsample import downsample, lttb, minmax
+
+
+class DownsampleTest(unittest.TestCase):
+    def setUp(self):
+        self.x = np.arange(1000, dtype='f8')
+        self.y = np.ones(1000)
+        # a single outage and a single burst
+        self.y[300] = 0
+        self.y[700] = 5
+
+    def test_lttb(self):
+        selected = lttb(self.x, self.y, 20)
+        self.assertEqual(len(selected), 20)
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertIn(300, selected)
+        self.assertIn(700, selected)
+
+    def test_minmax(self):
+        selected = minmax(self.x, self.y, 20)
+        self.assertLessEqual(len(selected), 20)
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertIn(300, selected)
+        self.assertIn(700, selected)
+
+    def test_small_threshold(self):
+        # too few points for any bucket, the threshold is still respected
+        self.assertEqual(list(lttb(self.x, self.y, 2)), [0, 999])
+        self.assertEqual(list(lttb(self.x, self.y, 1)), [0])
+        self.assertEqual(list(minmax(self.x, self.y, 1)), [0])
+        x, y = downsample(self.x, self.y, 2)
+        self.assertEqual(list(x), [0, 999])
+
+    def test_short_series(self):
+        for algorithm in ('lttb', 'minmax'):
+            x, y = downsample([0, 1, 2], [1, 2, 3], 10, algorithm=algorithm)
+            self.assertEqual(list(y), [1, 2, 3])
+            x, y = downsample([], [], 10, algorithm=algorithm)
+            self.assertEqual(len(x), 0)
+        self.assertRaises(ValueError, downsample, [], [], 10, 'mean')
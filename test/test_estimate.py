@@ -0,0 +1,54 @@
+import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ooi_status.estimate import estimate, weighted_percentiles
+from ooi_status.replay import build_timeline
+
+START = datetime.datetime(2017, 1, 1)
+END = datetime.datetime(2017, 1, 2)
+COLUMNS = ['subsite', 'node', 'sensor', 'method', 'stream', 'first', 'last', 'count']
+
+
+def minutes(value):
+    return START + datetime.timedelta(minutes=value)
+
+
+class EstimateTest(unittest.TestCase):
+    def test_weighted_percentiles(self):
+        groups = np.array([1, 0, 0, 0, 1])
+        values = np.array([10., 3., 1., 2., 20.])
+        weights = np.array([1., 1., 1., 1., 3.])
+        result = weighted_percentiles(groups, values, weights, [0.5, 0.99], 3)
+        np.testing.assert_array_equal(result[:, :2], [[2, 20], [3, 20]])
+        self.assertTrue(np.isnan(result[:, 2]).all())
+
+    def test_estimate(self):
+        partitions = pd.DataFrame([
+            ('RS01', 'SF01', '01-CTD', 'streamed', 'ctd', minutes(0), minutes(600), 601),
+            ('RS01', 'SF01', '01-CTD', 'streamed', 'ctd', minutes(720), minutes(1440), 721),
+            ('RS02', 'SF01', '01-CTD', 'streamed', 'ctd', minutes(0), minutes(1440), 1441),
+            ('RS01', 'SF01', '02-ADCP', 'streamed', 'adcp', minutes(0), minutes(360), 5),
+        ], columns=COLUMNS)
+        deployments = pd.DataFrame(columns=['subsite', 'node', 'sensor', 'start', 'stop'])
+        timeline = build_timeline(partitions, deployments, START, END)
+        expected = pd.DataFrame([('ctd', 'streamed', 0.5, 0, 0), ('adcp', 'streamed', 0, 60, 120)],
+                                columns=['name', 'method', 'expected_rate', 'warn_interval', 'fail_interval'])
+        deployed = pd.DataFrame(columns=['refdes', 'name', 'method', 'warn_interval', 'fail_interval'])
+
+        types, per_stream = estimate(timeline, expected, deployed, min_intervals=100)
+        types = types.set_index('name')
+        # one minute particles, the minimum warn interval applies
+        self.assertTrue(types.estimated['ctd'])
+        self.assertEqual(types.warn_interval['ctd'], 300)
+        self.assertEqual(types.fail_interval['ctd'], 600)
+        self.assertEqual(types.expected_rate['ctd'], 0.5)
+        self.assertEqual(types.streams['ctd'], 2)
+        # too few intervals, the current thresholds are kept
+        self.assertFalse(types.estimated['adcp'])
+        self.assertEqual(types.warn_interval['adcp'], 60)
+
+        self.assertEqual(len(per_stream), 3)
+        self.assertEqual(list(per_stream.warn_interval_default), [300, 60, 300])
@@ -0,0 +1,49 @@
+import datetime
+import io
+import unittest
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from ooi_status.export import iter_batches, parquet_available, write_csv, write_parquet
+
+COLUMNS = [('refdes', 'string'), ('collected_time', 'timestamp'), ('byte_count', 'int'), ('seconds', 'float')]
+BATCHES = [
+    [('RS01-SF01-01-CTD', datetime.datetime(2017, 1, 1), 1024, 60.0),
+     ('RS01-SF01-02-ADCP', datetime.datetime(2017, 1, 1), 2048, 60.0)],
+    [('RS01-SF01-01-CTD', datetime.datetime(2017, 1, 1, 0, 1), None, None)],
+]
+
+
+class ExportTest(unittest.TestCase):
+    def test_csv(self):
+        chunks = list(write_csv(COLUMNS, iter(BATCHES)))
+        # the header, then one chunk per batch
+        self.assertEqual(len(chunks), 3)
+        lines = b''.join(chunks).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'refdes,collected_time,byte_count,seconds')
+        self.assertEqual(lines[1], 'RS01-SF01-01-CTD,2017-01-01 00:00:00,1024,60.0')
+        self.assertEqual(lines[3], 'RS01-SF01-01-CTD,2017-01-01 00:01:00,,')
+
+    def test_iter_batches(self):
+        session = sessionmaker(bind=create_engine('sqlite://'))()
+        session.execute(text('CREATE TABLE numbers (value INTEGER)'))
+        session.execute(text('INSERT INTO numbers VALUES (1), (2), (3)'))
+        batches = iter_batches(session, text('SELECT value FROM numbers ORDER BY value'), batch_size=2)
+        self.assertEqual([[row[0] for row in batch] for batch in batches], [[1, 2], [3]])
+        # errors are raised when the export starts, not once the response is streaming
+        self.assertRaises(OperationalError, iter_batches, session, text('SELECT missing FROM numbers'))
+        session.close()
+
+    @unittest.skipUnless(parquet_available(), 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        chunks = list(write_parquet(COLUMNS, iter(BATCHES)))
+        # one row group per batch, then the footer
+        self.assertEqual(len(chunks), 3)
+        parquet = pq.ParquetFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual(parquet.num_row_groups, 2)
+        table = parquet.read()
+        self.assertEqual(table.column_names, [name for name, _ in COLUMNS])
+        self.assertEqual(table.column(2).to_pylist(), [1024, 2048, None])
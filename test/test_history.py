@@ -0,0 +1,58 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_status import history
+from ooi_status.history import month_bounds, split_days, _uptime
+
+
+class HistoryTest(unittest.TestCase):
+    def test_split_days(self):
+        start = datetime.datetime(2017, 5, 31, 23, 59, 30)
+        stop = datetime.datetime(2017, 6, 1, 0, 1)
+        self.assertEqual(split_days(start, stop), [(datetime.date(2017, 5, 31), 30.0),
+                                                   (datetime.date(2017, 6, 1), 60.0)])
+        self.assertEqual(split_days(stop, stop), [])
+
+    def test_month_bounds(self):
+        self.assertEqual(month_bounds(datetime.datetime(2017, 12, 15)),
+                         (datetime.date(2017, 12, 1), datetime.date(2018, 1, 1)))
+
+    def test_uptime(self):
+        start, end = datetime.date(2017, 5, 1), datetime.date(2017, 6, 1)
+        result = _uptime([('operational', 750.0), ('degraded', 150.0), ('failed', 100.0), ('notTracked', 500.0)],
+                         start, end)
+        self.assertEqual(result['uptime'], 75.0)
+        self.assertEqual(result['available'], 90.0)
+        self.assertIsNone(_uptime([], start, end)['uptime'])
+
+    def test_partitions_known_after_commit(self):
+        session = sessionmaker(bind=create_engine('sqlite://'), autocommit=True)()
+        statements = []
+        # record the partition DDL instead of running it
+        session.execute = lambda statement, *args: statements.append(str(statement))
+        when = datetime.datetime(2001, 2, 3)
+
+        try:
+            with session.begin():
+                history.ensure_partition(session, when)
+                raise RuntimeError('insert failed')
+        except RuntimeError:
+            pass
+        self.assertNotIn('status_transition_y2001m02', history._known_partitions)
+
+        # the rolled back partition is created again, and only remembered once committed
+        del statements[:]
+        with session.begin():
+            history.ensure_partition(session, when)
+            history.ensure_partition(session, when)
+        self.assertEqual(len([s for s in statements if 'PARTITION OF' in s]), 1)
+        self.assertIn('status_transition_y2001m02', history._known_partitions)
+
+        del statements[:]
+        with session.begin():
+            history.ensure_partition(session, when)
+        self.assertEqual(statements, [])
+        history._known_partitions.discard('status_transition_y2001m02')
@@ -0,0 +1,60 @@
+import datetime
+import gzip
+import io
+import json
+import unittest
+import zlib
+
+from ooi_status.json_stream import negotiate_encoding, stream_json, GZIP, DEFLATE
+
+
+class DateEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return str(o)
+        if hasattr(o, 'as_dict'):
+            return o.as_dict()
+        return json.JSONEncoder.default(self, o)
+
+
+class Row(object):
+    def __init__(self, value):
+        self.value = value
+
+    def as_dict(self):
+        return {'value': self.value, 'time': datetime.datetime(2017, 2, 1)}
+
+
+class JsonStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.encoder = DateEncoder(sort_keys=True)
+        self.data = {
+            'b': [1, 2.5, None, 'text'],
+            'a': {'nested': (x for x in range(3)), 1: True},
+            'rows': iter([Row(1), Row(2)]),
+        }
+        self.expected = {
+            'b': [1, 2.5, None, 'text'],
+            'a': {'nested': [0, 1, 2], '1': True},
+            'rows': [{'value': 1, 'time': '2017-02-01 00:00:00'}, {'value': 2, 'time': '2017-02-01 00:00:00'}],
+        }
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(negotiate_encoding(None), None)
+        self.assertEqual(negotiate_encoding('identity'), None)
+        self.assertEqual(negotiate_encoding('gzip, deflate'), GZIP)
+        self.assertEqual(negotiate_encoding('gzip;q=0, deflate'), DEFLATE)
+        self.assertEqual(negotiate_encoding('*'), GZIP)
+
+    def test_uncompressed(self):
+        body = b''.join(stream_json(self.data, self.encoder, chunk_size=4))
+        self.assertEqual(json.loads(body.decode('utf-8')), self.expected)
+
+    def test_gzip(self):
+        body = b''.join(stream_json(self.data, self.encoder, encoding=GZIP, chunk_size=4))
+        decoded = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        self.assertEqual(json.loads(decoded.decode('utf-8')), self.expected)
+
+    def test_deflate(self):
+        body = b''.join(stream_json(self.data, self.encoder, encoding=DEFLATE))
+        self.assertEqual(json.loads(zlib.decompress(body).decode('utf-8')), self.expected)
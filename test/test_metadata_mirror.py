@@ -0,0 +1,68 @@
+import datetime
+import unittest
+
+from ooi_status import metadata_mirror
+from ooi_status.metadata_mirror import ActiveStreamMirror
+
+NOW = datetime.datetime.utcnow()
+CTD = ('RS03AXPS', 'SF01A', '2A-CTDPFA102')
+ADCP = ('CE02SHBP', 'LJ01D', '05-ADCPTB104')
+
+
+class ActiveStreamMirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.originals = {name: getattr(metadata_mirror, name)
+                          for name in ('get_active_stream_rows', 'get_active_deployments', 'get_stream_lasts',
+                                       'stream_query')}
+        self.calls = []
+        self.stream_lasts = []
+
+        def get_stream_lasts(session, **kwargs):
+            self.calls.append(kwargs)
+            return self.stream_lasts
+
+        metadata_mirror.get_stream_lasts = get_stream_lasts
+        metadata_mirror.stream_query = lambda query, batch_size: query
+        metadata_mirror.get_active_stream_rows = lambda session: [
+            CTD + ('streamed', 'ctdpf_sbe43_sample', NOW - datetime.timedelta(minutes=5), 'A1', NOW, None),
+            ADCP + ('streamed', 'adcp_velocity_beam', NOW - datetime.timedelta(hours=5), 'A2', NOW, None),
+        ]
+        metadata_mirror.get_active_deployments = lambda session: [CTD + ('A1', NOW, None)]
+
+        self.mirror = ActiveStreamMirror()
+        self.active = list(self.mirror.active_streams(None))
+
+    def tearDown(self):
+        for name, func in self.originals.items():
+            setattr(metadata_mirror, name, func)
+
+    def test_resync(self):
+        self.assertEqual(len(self.active), 2)
+        stream, elapsed, uid = [row for row in self.active if row[0].sensor == CTD[2]][0]
+        self.assertEqual(stream.refdes, 'RS03AXPS-SF01A-2A-CTDPFA102')
+        self.assertEqual(stream.stream, 'ctdpf_sbe43_sample')
+        self.assertEqual(uid, 'A1')
+        self.assertEqual(self.mirror.watermark, NOW - datetime.timedelta(minutes=5))
+
+    def test_incremental(self):
+        last = NOW - datetime.timedelta(minutes=1)
+        self.stream_lasts = [CTD + ('streamed', 'ctdpf_sbe43_sample', last)]
+        active = {stream.refdes: stream for stream, _, _ in self.mirror.active_streams(None)}
+        self.assertEqual(self.calls[-1]['since'], NOW - datetime.timedelta(minutes=65))
+        self.assertEqual(active['RS03AXPS-SF01A-2A-CTDPFA102'].last, last)
+        self.assertEqual(self.mirror.watermark, last)
+
+    def test_deployment_ended(self):
+        self.mirror.last_deployment_refresh = NOW - datetime.timedelta(hours=1)
+        active = list(self.mirror.active_streams(None))
+        self.assertEqual([stream.refdes for stream, _, _ in active], ['RS03AXPS-SF01A-2A-CTDPFA102'])
+
+    def test_future_last(self):
+        last = NOW + datetime.timedelta(days=1)
+        self.stream_lasts = [CTD + ('streamed', 'ctdpf_sbe43_sample', last)]
+        active = {stream.refdes: stream for stream, _, _ in self.mirror.active_streams(None)}
+        self.assertEqual(active['RS03AXPS-SF01A-2A-CTDPFA102'].last, last)
+        # the watermark stops at the time of the refresh so later updates are still pulled
+        self.assertLessEqual(self.mirror.watermark, datetime.datetime.utcnow())
+        list(self.mirror.active_streams(None))
+        self.assertLess(self.calls[-1]['since'], NOW)
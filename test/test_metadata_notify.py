@@ -0,0 +1,89 @@
+import datetime
+import select
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy_utils import database_exists, create_database
+from ooi_data.postgres import model
+
+from ooi_status.metadata_notify import install_statements, install_trigger, parse_payload, remove_trigger
+
+CHANNEL = 'ooi_status_test_metadata'
+
+
+class ParsePayloadTest(unittest.TestCase):
+    def test_parse_payload(self):
+        self.assertEqual(parse_payload('["RS03AXPS", "SF01A", "2A-CTDPFA102", "streamed", "ctdpf_sbe43_sample"]'),
+                         ('RS03AXPS', 'SF01A', '2A-CTDPFA102', 'streamed', 'ctdpf_sbe43_sample'))
+        self.assertIsNone(parse_payload('not json'))
+        self.assertIsNone(parse_payload('["RS03AXPS"]'))
+        self.assertIsNone(parse_payload('{"subsite": "RS03AXPS"}'))
+
+    def test_insert_and_update_triggers_are_split(self):
+        statements = install_statements(CHANNEL)
+        function = [sql for sql in statements if 'CREATE OR REPLACE FUNCTION' in sql]
+        triggers = [sql for sql in statements if 'CREATE TRIGGER' in sql]
+        self.assertEqual(len(function), 1)
+        # OLD is unassigned during INSERT on PG < 11, so only the update trigger may refer to it
+        self.assertNotIn('OLD', function[0])
+        self.assertEqual(len(triggers), 2)
+        insert, update = triggers
+        self.assertIn('AFTER INSERT ON', insert)
+        self.assertNotIn('OLD', insert)
+        self.assertIn('AFTER UPDATE OF last ON', update)
+        self.assertIn('WHEN (OLD.last IS DISTINCT FROM NEW.last)', update)
+
+
+class MetadataTriggerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('postgresql+psycopg2://monitor@localhost/monitor_test')
+
+        if not database_exists(cls.engine.url):
+            create_database(cls.engine.url, template='template_postgis')
+
+        cls.table = model.StreamMetadatum.__table__
+        cls.table.drop(cls.engine, checkfirst=True)
+        cls.table.create(cls.engine)
+        install_trigger(cls.engine, CHANNEL)
+
+    @classmethod
+    def tearDownClass(cls):
+        remove_trigger(cls.engine)
+        cls.table.drop(cls.engine)
+
+    def setUp(self):
+        self.listener = self.engine.raw_connection()
+        self.listener.connection.set_session(autocommit=True)
+        self.listener.cursor().execute('LISTEN "%s"' % CHANNEL)
+
+    def tearDown(self):
+        self.listener.close()
+
+    def notifications(self):
+        conn = self.listener.connection
+        select.select([conn], [], [], 1.0)
+        conn.poll()
+        payloads = [parse_payload(notify.payload) for notify in conn.notifies]
+        del conn.notifies[:]
+        return payloads
+
+    def test_notifications(self):
+        key = ('RS03AXPS', 'SF01A', '2A-CTDPFA102', 'streamed', 'ctdpf_sbe43_sample')
+        now = datetime.datetime.utcnow()
+        row = dict(zip(('subsite', 'node', 'sensor', 'method', 'stream'), key))
+        with self.engine.begin() as conn:
+            result = conn.execute(self.table.insert().values(first=now, last=now, count=1, **row))
+        row_id = result.inserted_primary_key[0]
+        self.assertEqual(self.notifications(), [key])
+
+        where = self.table.c.id == row_id
+        with self.engine.begin() as conn:
+            conn.execute(self.table.update().where(where).values(last=now + datetime.timedelta(minutes=1), count=2))
+        self.assertEqual(self.notifications(), [key])
+
+        # updates which leave last unchanged are not published
+        with self.engine.begin() as conn:
+            conn.execute(self.table.update().where(where).values(count=3))
+            conn.execute(self.table.update().where(where).values(last=now + datetime.timedelta(minutes=1)))
+        self.assertEqual(self.notifications(), [])
@@ -1,3 +1,4 @@
+import datetime
 import requests
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -5,7 +6,8 @@ import unittest
 import time
 
 from ooi_status.event_notifier import EventNotifier
-from ooi_status.metadata_queries import get_uid_from_refdes
+from ooi_status.metadata_queries import (get_uid_from_refdes, compact_measure, data_categories, filter_spans, CompactSpans,
+                                         PRESENT, MISSING)
 
 
 class MetadataQueryTest(unittest.TestCase):
@@ -60,3 +62,36 @@ class MetadataQueryTest(unittest.TestCase):
             available_ids.append(event['eventId'])
         self.assertIn(created_id, available_ids)
 
+
+class CompactMeasureTest(unittest.TestCase):
+    def test_compact_measure(self):
+        t0 = datetime.datetime(2017, 1, 1)
+        t1 = datetime.datetime(2017, 1, 2)
+        t2 = datetime.datetime(2017, 1, 3)
+        measure = {
+            'measure': 'streamed ctdbp_no_sample',
+            'data': [(t0, PRESENT, t1), (t1, MISSING, t2)],
+            'categories': data_categories
+        }
+        compact = compact_measure(measure)
+        names = [c['name'] for c in compact['categories']]
+
+        self.assertEqual(compact['measure'], measure['measure'])
+        self.assertEqual(compact['start'], [1483228800000, 1483315200000])
+        self.assertEqual(compact['stop'], [1483315200000, 1483401600000])
+        self.assertEqual([names[code] for code in compact['category']], [PRESENT, MISSING])
+        self.assertEqual(compact['categories'][names.index(MISSING)]['color'], data_categories[MISSING]['color'])
+
+    def test_filter_spans_compact(self):
+        t0 = datetime.datetime(2017, 1, 1)
+        t1 = datetime.datetime(2017, 1, 2)
+        t2 = datetime.datetime(2017, 1, 3)
+        spans = [(t0, PRESENT, t1), (t1, MISSING, t2)]
+        deploy_data = [(t0 + datetime.timedelta(hours=12), 1, t2)]
+        compact = filter_spans(spans, deploy_data, CompactSpans(data_categories))
+        names = [c['name'] for c in compact.measure('streamed')['categories']]
+
+        self.assertEqual(len(compact), 2)
+        self.assertEqual(compact.start, [1483272000000, 1483315200000])
+        self.assertEqual(compact.stop, [1483315200000, 1483401600000])
+        self.assertEqual([names[code] for code in compact.category], [PRESENT, MISSING])
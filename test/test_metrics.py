@@ -0,0 +1,66 @@
+import unittest
+
+from ooi_status.metrics import Registry, Counter, Gauge, Histogram
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        c = self.registry.get_or_create(Counter, 'events_total', 'Events', ['result'])
+        c.labels('ok').inc()
+        c.labels(result='ok').inc(2)
+        c.labels('failed').inc()
+        self.assertRaises(ValueError, c.labels('ok').inc, -1)
+        self.assertRaises(ValueError, c.labels, 'ok', 'extra')
+
+        text = self.registry.render()
+        self.assertIn('# TYPE events_total counter', text)
+        self.assertIn('events_total{result="ok"} 3', text)
+        self.assertIn('events_total{result="failed"} 1', text)
+
+    def test_gauge(self):
+        g = self.registry.get_or_create(Gauge, 'queue_depth', 'Queue depth')
+        g.set(10)
+        g.dec(2.5)
+        self.assertIn('queue_depth 7.5', self.registry.render())
+
+    def test_gauge_special_values(self):
+        g = self.registry.get_or_create(Gauge, 'ratio', 'Ratio', ['kind'])
+        g.labels('nan').set(float('nan'))
+        g.labels('low').set(float('-inf'))
+        g.labels('high').set(float('inf'))
+        text = self.registry.render()
+        self.assertIn('ratio{kind="nan"} NaN', text)
+        self.assertIn('ratio{kind="low"} -Inf', text)
+        self.assertIn('ratio{kind="high"} +Inf', text)
+
+    def test_histogram(self):
+        h = self.registry.get_or_create(Histogram, 'latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5):
+            h.observe(value)
+        with h.time():
+            pass
+
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 4', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 5', text)
+        self.assertIn('latency_seconds_count 5', text)
+
+    def test_timer_decorator(self):
+        h = self.registry.get_or_create(Histogram, 'phase_seconds', 'Phase', ['phase'])
+
+        @h.labels('check').time()
+        def check():
+            return 'done'
+
+        self.assertEqual(check(), 'done')
+        self.assertEqual(check(), 'done')
+        self.assertIn('phase_seconds_count{phase="check"} 2', self.registry.render())
+
+    def test_reregister(self):
+        c = self.registry.get_or_create(Counter, 'events_total', 'Events')
+        self.assertIs(c, self.registry.get_or_create(Counter, 'events_total', 'Events'))
+        self.assertRaises(ValueError, self.registry.get_or_create, Gauge, 'events_total', 'Events')
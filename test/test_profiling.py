@@ -0,0 +1,72 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ooi_status.profiling import Profiler, NULL_CAPTURE
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def profiles(self):
+        return sorted(glob.glob(os.path.join(self.directory, '*.prof')))
+
+    def test_disabled(self):
+        profiler = Profiler()
+        self.assertIs(profiler.cycle('check_all'), NULL_CAPTURE)
+        self.assertIs(profiler.request('available', '/available/X', 'GET'), NULL_CAPTURE)
+        with profiler.cycle('check_all') as capture:
+            capture.metadata.update(changed=1)
+
+    def test_cycle_sampling(self):
+        profiler = Profiler(self.directory, cycle_every=3)
+        for _ in range(7):
+            with profiler.cycle('check_all', label='x'):
+                sum(range(100))
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 2)
+
+        with open(profiles[0][:-len('.prof')] + '.json') as fh:
+            metadata = json.load(fh)
+        self.assertEqual(metadata['cycle'], 3)
+        self.assertEqual(metadata['kind'], 'cycle')
+        self.assertEqual(metadata['label'], 'x')
+
+    def test_requests(self):
+        profiler = Profiler(self.directory, routes=['available', '/stream'], slow_seconds=60)
+        profiler.request('available', '/available/X', 'GET').start().stop(status=200)
+        profiler.request('get_streams', '/stream', 'GET').start().stop(status=200)
+        # not selected and faster than slow_seconds
+        profiler.request('expected', '/expected', 'GET').start().stop(status=200)
+        self.assertEqual(len(self.profiles()), 2)
+
+    def test_rotation(self):
+        profiler = Profiler(self.directory, keep=2, cycle_every=1)
+        for _ in range(5):
+            with profiler.cycle('check_all'):
+                pass
+        self.assertEqual(len(self.profiles()), 2)
+        self.assertEqual(len(glob.glob(os.path.join(self.directory, '*.json'))), 2)
+
+    def test_one_capture_at_a_time(self):
+        profiler = Profiler(self.directory, routes=['available'])
+        outer = profiler.request('available', '/available/X', 'GET').start()
+        # e.g. another greenlet's request while the first is still being profiled
+        inner = profiler.request('available', '/available/Y', 'GET').start()
+        inner.stop(status=200)
+        outer.stop(status=200)
+        self.assertEqual(len(self.profiles()), 1)
+        # the next capture runs once the active one has stopped
+        profiler.request('available', '/available/Z', 'GET').start().stop(status=200)
+        self.assertEqual(len(self.profiles()), 2)
+
+    def test_requests_disabled(self):
+        profiler = Profiler(self.directory, routes=['available'], profile_requests=False)
+        self.assertIs(profiler.request('available', '/available/X', 'GET'), NULL_CAPTURE)
@@ -0,0 +1,97 @@
+import json
+import time
+import unittest
+
+from ooi_data.postgres import model
+from sqlalchemy import create_engine
+
+from ooi_status.amqp_client import AmqpStatsClient
+from ooi_status.rate_detector import RateDetector
+from ooi_status.status_message import StatusEnum
+
+
+class FakeMessage(object):
+    def ack(self):
+        pass
+
+
+class RateDetectorTest(unittest.TestCase):
+    def test_expected_rate(self):
+        detector = RateDetector(persist=2)
+        detector.set_expected({'RS01-SF01-01-CTD': 100.0})
+        self.assertIsNone(detector.update('RS01-SF01-01-CTD', 6000, 60))
+        self.assertIsNone(detector.update('RS01-SF01-01-CTD', 600, 60))
+        event = detector.update('RS01-SF01-01-CTD', 600, 60)
+        self.assertEqual(event.status, StatusEnum.DEGRADED)
+        self.assertEqual(event.previous_status, StatusEnum.OPERATIONAL)
+        self.assertEqual(event.baseline, 100.0)
+        self.assertEqual(detector.degraded(), ['RS01-SF01-01-CTD'])
+        # still low, no new event
+        self.assertIsNone(detector.update('RS01-SF01-01-CTD', 600, 60))
+        event = detector.update('RS01-SF01-01-CTD', 5400, 60)
+        self.assertEqual(event.status, StatusEnum.OPERATIONAL)
+        self.assertEqual(detector.degraded(), [])
+
+    def test_learned_rate(self):
+        detector = RateDetector(warmup=5, persist=1)
+        for _ in range(10):
+            self.assertIsNone(detector.update('A', 1000, 1))
+        # no expected rate and still warming up
+        self.assertIsNone(detector.update('B', 0, 1))
+        event = detector.update('A', 10, 1)
+        self.assertEqual(event.status, StatusEnum.DEGRADED)
+        self.assertAlmostEqual(event.baseline, 1000)
+        # low rates are not learned
+        self.assertAlmostEqual(detector.mean[detector.slots['A']], 1000)
+
+    def test_grow(self):
+        detector = RateDetector(capacity=2)
+        for index in range(5):
+            detector.update('refdes%d' % index, index, 1)
+        self.assertEqual(len(detector.slots), 5)
+        self.assertGreaterEqual(len(detector.mean), 5)
+        self.assertEqual(detector.mean[detector.slots['refdes4']], 4)
+        self.assertIsNone(detector.update('refdes0', 10, 0))
+
+    def test_has_expected(self):
+        detector = RateDetector()
+        detector.set_expected({'A': 100.0, 'B': 0})
+        self.assertTrue(detector.has_expected('A'))
+        self.assertFalse(detector.has_expected('B'))
+        self.assertFalse(detector.has_expected('C'))
+
+
+class RateEventStagingTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        model.create_database(engine)
+        self.events = []
+        self.client = AmqpStatsClient('memory://', 'port_agent_stats', engine,
+                                      detector=RateDetector(warmup=2, persist=1), uid_resolver=lambda refdes: 'UID',
+                                      rate_status=True, on_rate_event=self.events.append)
+        self.client._expected_loaded = time.time()
+        self.client.detector.set_expected({'EXPECTED': 100.0})
+
+    def send(self, refdes, bytes_in):
+        body = json.dumps({'reference_designator': refdes, 'bytes_in': bytes_in, 'elapsed': 1,
+                           'end_time': time.time()})
+        self.client.on_message(body, FakeMessage())
+
+    def pending(self):
+        return [pu.message for pu in self.client.session.query(model.PendingUpdate)]
+
+    def test_learned_rate_staged(self):
+        for _ in range(3):
+            self.send('LEARNED', 1000)
+        self.send('LEARNED', 1)
+        messages = self.pending()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['assetUid'], 'UID')
+        self.assertEqual(messages[0]['status'], StatusEnum.DEGRADED)
+        self.assertIn('Port data rate: 1.0 B/s (baseline 1000.0 B/s)', messages[0]['reason'])
+        self.assertEqual(self.events, [])
+
+    def test_expected_rate_left_to_rate_status(self):
+        self.send('EXPECTED', 1)
+        self.assertEqual(self.pending(), [])
+        self.assertEqual([event.refdes for event in self.events], ['EXPECTED'])
@@ -0,0 +1,87 @@
+import unittest
+
+import pandas as pd
+from flask import Config
+from ooi_data.postgres import model
+
+from ooi_status.queries import classify_port_rates
+from ooi_status.status_message import RateStatusMessage, StatusEnum
+from ooi_status.status_monitor import StatusMonitor, here
+
+
+class RateStatusTest(unittest.TestCase):
+    def test_classify_port_rates(self):
+        df = pd.DataFrame([
+            ('A', 100.0, 6000.0, 60.0),
+            ('B', 100.0, 1800.0, 60.0),
+            ('C', 100.0, 300.0, 60.0),
+            ('D', 100.0, None, None),
+            ('E', 100.0, 0.0, 0.0),
+        ], columns=['refdes', 'expected_rate', 'byte_count', 'seconds'])
+        result = classify_port_rates(df, degraded_ratio=0.5, failed_ratio=0.1)
+        self.assertEqual({refdes: status for refdes, (status, _) in result.items()}, {
+            'A': StatusEnum.OPERATIONAL,
+            'B': StatusEnum.DEGRADED,
+            'C': StatusEnum.FAILED,
+            'D': StatusEnum.NOT_TRACKED,
+            'E': StatusEnum.NOT_TRACKED,
+        })
+        self.assertEqual(result['B'][1], 'Port data rate: 30.0 B/s (expected 100.0 B/s)')
+
+    def test_message(self):
+        message = RateStatusMessage('RS01-SF01-01-CTD', 'UID', StatusEnum.OPERATIONAL, StatusEnum.DEGRADED,
+                                    'Port data rate: 30.0 B/s (expected 100.0 B/s)')
+        message.instrument_status = StatusEnum.DEGRADED
+        message = message.as_dict()
+        self.assertEqual(message['status'], StatusEnum.DEGRADED)
+        self.assertEqual(message['assetUid'], 'UID')
+        self.assertEqual(message['notes'], '(%s -> %s) Port data rate: 30.0 B/s (expected 100.0 B/s)' % (
+            StatusEnum.OPERATIONAL, StatusEnum.DEGRADED))
+
+    def test_rate_changes(self):
+        config = Config(here)
+        config.from_object('ooi_status.default_settings')
+        config.update(MONITOR_URL='sqlite://', METADATA_URL='sqlite://', RATE_STATUS=True)
+        monitor = StatusMonitor(config)
+
+        def classified(**statuses):
+            return {refdes: (status, '') for refdes, status in statuses.items()}
+
+        # unknown instruments are only reported when their rate is degraded or failed
+        rates = classified(A=StatusEnum.OPERATIONAL, B=StatusEnum.DEGRADED, C=StatusEnum.NOT_TRACKED)
+        self.assertEqual(monitor._rate_changes(rates), [('B', StatusEnum.NOT_TRACKED)])
+        monitor.rate_status = {refdes: status for refdes, (status, _) in rates.items()}
+
+        # without any stream status change
+        self.assertEqual(monitor._rate_changes(rates), [])
+        rates = classified(A=StatusEnum.FAILED, B=StatusEnum.OPERATIONAL, C=StatusEnum.NOT_TRACKED)
+        self.assertEqual(sorted(monitor._rate_changes(rates)), [('A', StatusEnum.OPERATIONAL),
+                                                                ('B', StatusEnum.DEGRADED)])
+
+        # a message is staged for active instruments whose rate changed without a stream status change
+        model.create_database(monitor.engine)
+        monitor._uids = {'A': 'UID-A'}
+        messages = monitor._add_rollup_status([], rates)
+        self.assertEqual([(m.refdes, m.uid, m.stream_status, m.instrument_status) for m in messages],
+                         [('A', 'UID-A', StatusEnum.FAILED, StatusEnum.FAILED)])
+
+    def test_rates_classified_by_full_checks(self):
+        config = Config(here)
+        config.from_object('ooi_status.default_settings')
+        config.update(MONITOR_URL='sqlite://', METADATA_URL='sqlite://', RATE_STATUS=True)
+        monitor = StatusMonitor(config)
+        model.create_database(monitor.engine)
+        calls = []
+
+        def get_rate_status():
+            calls.append(None)
+            return {}
+
+        monitor._get_rate_status = get_rate_status
+        monitor._check_status = lambda rows: []
+        monitor.check_all()
+        monitor.check_streams([('RS01', 'SF01', '01-CTD', 'streamed', 'ctd')])
+        monitor.check_streams([('RS01', 'SF01', '01-CTD', 'streamed', 'ctd')])
+        self.assertEqual(len(calls), 1)
+        monitor.check_all()
+        self.assertEqual(len(calls), 2)
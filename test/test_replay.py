@@ -0,0 +1,124 @@
+import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy_utils import database_exists, create_database
+from ooi_data.postgres import model
+
+from ooi_status.queries import get_threshold_frames
+from ooi_status.replay import build_timeline, replay, resolve_thresholds, summarize, STATES
+from ooi_status.status_message import StatusEnum
+
+START = datetime.datetime(2017, 1, 1)
+END = datetime.datetime(2017, 1, 2)
+COLUMNS = ['subsite', 'node', 'sensor', 'method', 'stream', 'first', 'last', 'count']
+
+
+def minutes(value):
+    return START + datetime.timedelta(minutes=value)
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.partitions = pd.DataFrame([
+            # two hour gap between partitions, particles every minute inside them, no trailing gap
+            ('RS01', 'SF01', '01-CTD', 'streamed', 'ctd', minutes(0), minutes(600), 601),
+            ('RS01', 'SF01', '01-CTD', 'streamed', 'ctd', minutes(720), minutes(1440), 721),
+            # stops reporting after six hours
+            ('RS01', 'SF01', '02-ADCP', 'streamed', 'adcp', minutes(0), minutes(360), 361),
+        ], columns=COLUMNS)
+        self.deployments = pd.DataFrame(columns=['subsite', 'node', 'sensor', 'start', 'stop'])
+
+    def test_build_timeline(self):
+        timeline = build_timeline(self.partitions, self.deployments, START, END)
+        self.assertEqual(list(timeline.streams.refdes), ['RS01-SF01-01-CTD', 'RS01-SF01-02-ADCP'])
+        totals = np.bincount(timeline.stream_index, weights=timeline.gaps * timeline.weights)
+        np.testing.assert_allclose(totals, [86400, 86400])
+        self.assertAlmostEqual(timeline.gaps[timeline.stream_index == 1].max(), 18 * 3600)
+
+    def test_deployment_limits_window(self):
+        self.deployments = pd.DataFrame([('RS01', 'SF01', '02-ADCP', START, minutes(480))],
+                                        columns=['subsite', 'node', 'sensor', 'start', 'stop'])
+        timeline = build_timeline(self.partitions, self.deployments, START, END)
+        totals = np.bincount(timeline.stream_index, weights=timeline.gaps * timeline.weights)
+        np.testing.assert_allclose(totals, [86400, 480 * 60])
+
+    def test_replay(self):
+        timeline = build_timeline(self.partitions, self.deployments, START, END)
+        warn = np.array([[3600, 3600], [10800, 0], [0, 0]], dtype='f8')
+        fail = np.array([[7200, 7200], [21600, 0], [0, 0]], dtype='f8')
+        results = replay(timeline, warn, fail)
+
+        # the two hour gap reaches degraded but not failed
+        self.assertEqual(results['degraded_alerts'][0, 0], 1)
+        self.assertEqual(results['failed_alerts'][0, 0], 0)
+        self.assertAlmostEqual(results[StatusEnum.DEGRADED][0, 0], 3600)
+        # the eighteen hour trailing gap reaches both
+        self.assertEqual(results['failed_alerts'][0, 1], 1)
+        self.assertAlmostEqual(results[StatusEnum.FAILED][0, 1], 16 * 3600)
+        # longer thresholds raise nothing on the first stream, zero thresholds are not tracked
+        self.assertEqual(results['degraded_alerts'][1, 0], 0)
+        self.assertAlmostEqual(results[StatusEnum.NOT_TRACKED][1, 1], 86400)
+        self.assertAlmostEqual(results[StatusEnum.NOT_TRACKED][2].sum(), 2 * 86400)
+
+        for index in range(3):
+            total = sum(results[state][index] for state in STATES)
+            np.testing.assert_allclose(total, [86400, 86400])
+
+        summary = summarize(['a', 'b', 'c'], warn, fail, results)
+        self.assertEqual(list(summary.tracked_streams), [2, 1, 0])
+        self.assertTrue(pd.isnull(summary.uptime[2]))
+
+    def test_resolve_thresholds(self):
+        timeline = build_timeline(self.partitions, self.deployments, START, END)
+        expected = pd.DataFrame([('ctd', 'streamed', 600, 1200), ('adcp', 'streamed', 60, 120)],
+                                columns=['name', 'method', 'warn_interval', 'fail_interval'])
+        deployed = pd.DataFrame([('RS01-SF01-02-ADCP', 'adcp', 'streamed', 0, None)],
+                                columns=['refdes', 'name', 'method', 'warn_interval', 'fail_interval'])
+        warn, fail = resolve_thresholds(timeline.streams, expected, deployed)
+        self.assertEqual(list(warn), [600, 0])
+        self.assertEqual(list(fail), [1200, 120])
+
+
+class ThresholdFramesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('postgresql+psycopg2://monitor@localhost/monitor_test')
+
+        if not database_exists(cls.engine.url):
+            create_database(cls.engine.url, template='template_postgis')
+
+        model.create_database(cls.engine, drop=True)
+
+        cls.session = sessionmaker(bind=cls.engine)()
+        ctd = model.ExpectedStream.get_or_create(cls.session, 'ctd', 'streamed')
+        ctd.warn_interval, ctd.fail_interval = 600, 1200
+        adcp = model.ExpectedStream.get_or_create(cls.session, 'adcp', 'streamed')
+        adcp.warn_interval, adcp.fail_interval = 60, 120
+        # an expected stream without deployments must not appear in the deployed frame
+        model.ExpectedStream.get_or_create(cls.session, 'unused', 'streamed')
+        refdes = model.ReferenceDesignator.get_or_create(cls.session, 'RS01-SF01-02-ADCP')
+        model.DeployedStream.get_or_create(cls.session, refdes, ctd)
+        deployed = model.DeployedStream.get_or_create(cls.session, refdes, adcp)
+        deployed._warn_interval = 0
+        cls.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+
+    def test_threshold_frames(self):
+        expected, deployed = get_threshold_frames(self.session)
+        self.assertEqual(sorted(expected.name), ['adcp', 'ctd', 'unused'])
+        self.assertEqual(list(deployed.columns), ['refdes', 'name', 'method', 'warn_interval', 'fail_interval'])
+        self.assertEqual(sorted(deployed.name), ['adcp', 'ctd'])
+        self.assertEqual(set(deployed.refdes), {'RS01-SF01-02-ADCP'})
+
+        streams = pd.DataFrame([('RS01-SF01-02-ADCP', 'ctd', 'streamed'), ('RS01-SF01-02-ADCP', 'adcp', 'streamed')],
+                               columns=['refdes', 'stream', 'method'])
+        warn, fail = resolve_thresholds(streams, expected, deployed)
+        self.assertEqual(list(warn), [600, 0])
+        self.assertEqual(list(fail), [1200, 120])
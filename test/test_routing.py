@@ -0,0 +1,93 @@
+import json
+import time
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy_utils import database_exists, create_database
+from ooi_data.postgres import model
+
+from ooi_status.api import app
+from ooi_status.api.routing import READ_PRIMARY_COOKIE, RoutingSession, use_replica
+
+
+class UseReplicaTest(unittest.TestCase):
+    def test_reads_use_replica(self):
+        self.assertTrue(use_replica('GET', {}))
+        self.assertTrue(use_replica('HEAD', {}))
+
+    def test_writes_use_primary(self):
+        for method in ('POST', 'PUT', 'PATCH', 'DELETE'):
+            self.assertFalse(use_replica(method, {}))
+
+    def test_read_your_writes_cookie(self):
+        self.assertFalse(use_replica('GET', {READ_PRIMARY_COOKIE: str(time.time() + 60)}))
+        # expired or malformed cookies are ignored
+        self.assertTrue(use_replica('GET', {READ_PRIMARY_COOKIE: str(time.time() - 60)}))
+        self.assertTrue(use_replica('GET', {READ_PRIMARY_COOKIE: 'soon'}))
+
+
+class RoutingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # two engines against the same database stand in for the primary and its replica
+        cls.engines = {name: create_engine('postgresql+psycopg2://monitor@localhost/monitor_test')
+                       for name in ('primary', 'replica')}
+
+        if not database_exists(cls.engines['primary'].url):
+            create_database(cls.engines['primary'].url, template='template_postgis')
+
+        model.create_database(cls.engines['primary'], drop=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        for engine in cls.engines.values():
+            engine.dispose()
+
+    def setUp(self):
+        self.statements = []
+        self.listeners = [(engine, self.recorder(name)) for name, engine in self.engines.items()]
+        for engine, listener in self.listeners:
+            event.listen(engine, 'before_cursor_execute', listener)
+
+        self.saved = (app.replica_engine, dict(app.sessionmaker.kw))
+        app.replica_engine = self.engines['replica']
+        app.sessionmaker.configure(bind=self.engines['primary'], primary=self.engines['primary'],
+                                   replica=self.engines['replica'])
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.replica_engine, app.sessionmaker.kw = self.saved
+        for engine, listener in self.listeners:
+            event.remove(engine, 'before_cursor_execute', listener)
+
+    def recorder(self, name):
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self.statements.append(name)
+        return before_cursor_execute
+
+    def bound_to(self, response):
+        self.assertLess(response.status_code, 400)
+        engines, self.statements = set(self.statements), []
+        return engines
+
+    def test_session_bind(self):
+        session = RoutingSession(primary=self.engines['primary'], replica=self.engines['replica'])
+        self.assertIs(session.get_bind(), self.engines['primary'])
+        session.info['use_replica'] = True
+        self.assertIs(session.get_bind(), self.engines['replica'])
+        # without a replica everything goes to the primary
+        session = RoutingSession(primary=self.engines['primary'])
+        session.info['use_replica'] = True
+        self.assertIs(session.get_bind(), self.engines['primary'])
+
+    def test_get_uses_replica(self):
+        self.assertEqual(self.bound_to(self.client.get('/expected')), {'replica'})
+
+    def test_write_and_following_reads_use_primary(self):
+        response = self.client.open('/expected', method='PATCH', content_type='application/json',
+                                    data=json.dumps({'stream': 'ctdbp_no_sample', 'warn_interval': 300}))
+        self.assertEqual(self.bound_to(response), {'primary'})
+        self.assertIn(READ_PRIMARY_COOKIE, response.headers.get('Set-Cookie', ''))
+
+        # the test client sends the read-your-writes cookie back with the next request
+        self.assertEqual(self.bound_to(self.client.get('/expected')), {'primary'})
@@ -0,0 +1,64 @@
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy_utils import database_exists, create_database
+
+from ooi_status.sharding import PartitionLeases, fair_share, partition_of
+
+PARTITIONS = 16
+
+
+class PartitionFunctionTest(unittest.TestCase):
+    def test_partition_of(self):
+        self.assertEqual(partition_of('CE01ISSM-MFD35-02-PRESFA000', PARTITIONS),
+                         partition_of(u'CE01ISSM-MFD35-02-PRESFA000', PARTITIONS))
+        partitions = {partition_of('RS%04d-SNODE-01-INSTRU000' % i, PARTITIONS) for i in range(1000)}
+        self.assertEqual(partitions, set(range(PARTITIONS)))
+
+    def test_fair_share(self):
+        self.assertEqual(fair_share(16, 0), 16)
+        self.assertEqual(fair_share(16, 3), 6)
+        self.assertEqual(fair_share(16, 16), 1)
+
+
+class PartitionLeasesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('postgresql+psycopg2://monitor@localhost/monitor_test')
+        if not database_exists(cls.engine.url):
+            create_database(cls.engine.url, template='template_postgis')
+
+    def setUp(self):
+        # a lock class not used by any running monitor
+        self.members = [PartitionLeases(self.engine, PARTITIONS, lock_class=9900) for _ in range(3)]
+
+    def tearDown(self):
+        for member in self.members:
+            member.close()
+
+    def refresh_all(self, members, rounds=2):
+        # released partitions are only claimed by other members on their following refresh
+        for _ in range(rounds):
+            for member in members:
+                member.refresh()
+
+    def assert_partitioned(self, members):
+        owned = [member.owned for member in members]
+        self.assertEqual(set().union(*owned), set(range(PARTITIONS)))
+        self.assertEqual(sum(len(o) for o in owned), PARTITIONS)
+
+    def test_single_member_owns_everything(self):
+        self.assertEqual(self.members[0].refresh(), frozenset(range(PARTITIONS)))
+
+    def test_rebalance(self):
+        self.refresh_all(self.members)
+        self.assert_partitioned(self.members)
+        for member in self.members:
+            self.assertLessEqual(len(member.owned), fair_share(PARTITIONS, 3))
+
+        # an instance dies and the survivors take over its partitions
+        self.members[1].close()
+        survivors = [self.members[0], self.members[2]]
+        self.refresh_all(survivors)
+        self.assert_partitioned(survivors)
+        self.assertEqual(len(survivors[0].owned), PARTITIONS // 2)
@@ -0,0 +1,82 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from ooi_data.postgres import model
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_status.metadata_mirror import ActiveStreamMirror
+from ooi_status.snapshot import STREAM_DTYPE, Snapshot, load_snapshot, missed_jobs, restore, save_snapshot
+from ooi_status.stream_cache import StreamCache
+
+
+class FakeMonitor(object):
+    def __init__(self, session):
+        self.session = session
+        self.mirror = ActiveStreamMirror()
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'monitor')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        keys = [('RS01-SF01-01-CTD', 'ctd', 'streamed'), ('RS01-SF01-02-ADCP', 'adcp', 'streamed')]
+        streams = np.array([(1, 10, 100), (2, 11, 101)], dtype=STREAM_DTYPE)
+        last = datetime.datetime(2017, 6, 1, 12, 30, 15, 250)
+        mirror = {
+            'keys': [('RS01', 'SF01', '01-CTD', 'streamed', 'ctd'), ('RS01', 'SF01', '02-ADCP', 'streamed', 'adcp')],
+            'last': np.array([last, None], dtype='datetime64[us]'),
+            'deployments': [['RS01', 'SF01', '01-CTD', 'UID', 0, None]],
+            'watermark': 1,
+            'last_resync': 2,
+            'last_deployment_refresh': 3,
+        }
+        saved = datetime.datetime(2017, 6, 1, 12, 31)
+        save_snapshot(self.path, Snapshot(keys, streams, [2, 2, 2, 11, 2, 101], saved, {'check_all': 100}, mirror))
+
+        loaded = load_snapshot(self.path)
+        self.assertEqual(loaded.keys, keys)
+        self.assertEqual(loaded.streams.tolist(), streams.tolist())
+        self.assertEqual(loaded.watermark, [2, 2, 2, 11, 2, 101])
+        self.assertEqual(loaded.saved, saved)
+        self.assertEqual(loaded.mirror['keys'], [list(key) for key in mirror['keys']])
+        self.assertEqual(loaded.mirror['last'].astype(object).tolist(), [last, None])
+        self.assertEqual(missed_jobs(loaded, now=99), [])
+        self.assertEqual(missed_jobs(loaded, now=100), ['check_all'])
+
+    def test_missing_or_inconsistent(self):
+        self.assertIsNone(load_snapshot(self.path))
+        streams = np.zeros(1, dtype=STREAM_DTYPE)
+        save_snapshot(self.path, Snapshot([], streams, [], datetime.datetime.utcnow()))
+        self.assertIsNone(load_snapshot(self.path))
+
+    def test_mirror_restored_when_monitor_changed(self):
+        engine = create_engine('sqlite://')
+        model.create_database(engine)
+        monitor = FakeMonitor(sessionmaker(bind=engine, autocommit=True)())
+        last = datetime.datetime(2017, 6, 1, 12, 30)
+        mirror = {
+            'keys': [['RS01', 'SF01', '01-CTD', 'streamed', 'ctd']],
+            'last': np.array([last], dtype='datetime64[us]'),
+            'deployments': [['RS01', 'SF01', '01-CTD', 'UID', 0, None]],
+            'watermark': 1,
+            'last_resync': 2,
+            'last_deployment_refresh': 3,
+        }
+        # the monitor database changed (here: emptied) while the monitor was stopped
+        state = Snapshot([], np.zeros(0, dtype=STREAM_DTYPE), [1, 1, 1, 1, 1, 1],
+                         datetime.datetime.utcnow(), mirror=mirror)
+
+        self.assertFalse(restore(monitor, StreamCache(), state))
+        self.assertEqual(monitor.mirror.streams, {('RS01', 'SF01', '01-CTD', 'streamed', 'ctd'): last})
+        self.assertEqual(monitor.mirror.deployments[('RS01', 'SF01', '01-CTD')].uid, 'UID')
+        self.assertEqual(monitor.mirror.last_resync, datetime.datetime(1970, 1, 1, 0, 0, 0, 2))
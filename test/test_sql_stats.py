@@ -0,0 +1,50 @@
+import unittest
+
+from sqlalchemy import create_engine
+
+from ooi_status.sql_stats import SqlStats, Scope, fingerprint, instrument_engine, parameter_shape
+
+
+class SqlStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.stats = SqlStats()
+        self.engine = instrument_engine(create_engine('sqlite://'), 'test', stats=self.stats)
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE id IN (%(id_1)s, %(id_2)s) AND name = 'x'"),
+                         'SELECT * FROM t WHERE id IN (...) AND name = ?')
+        self.assertEqual(fingerprint('SELECT a\n  FROM t\n LIMIT 10'), 'SELECT a FROM t LIMIT ?')
+        self.assertEqual(fingerprint('INSERT INTO t (a, b) VALUES (%(a)s, %(b)s)'),
+                         'INSERT INTO t (a, b) VALUES (...)')
+        self.assertEqual(fingerprint('SELECT t1.a FROM t1'), 'SELECT t1.a FROM t1')
+
+    def test_parameter_shape(self):
+        self.assertEqual(parameter_shape({'b': 1, 'a': 'secret'}), '{a: str, b: int}')
+        self.assertEqual(parameter_shape([{'a': 1}, {'a': 2}], executemany=True), '2 x {a: int}')
+        self.assertEqual(parameter_shape((1, [1, 2])), '(int, list[2])')
+
+    def test_scopes(self):
+        with Scope('cycle', stats=self.stats) as scope:
+            for value in range(3):
+                self.engine.execute('SELECT ?', value)
+        self.engine.execute('SELECT 1 + 1')
+
+        self.assertEqual(scope.table.count, 3)
+        summary = self.stats.summary()
+        self.assertEqual(summary['statements'], 4)
+        self.assertEqual(summary['scopes']['cycle']['scopes'], 1)
+
+        cycle = self.stats.summary(scope_name='cycle')
+        self.assertEqual(len(cycle['top']), 1)
+        self.assertEqual(cycle['top'][0]['statement'], 'SELECT ?')
+        self.assertEqual(cycle['top'][0]['count'], 3)
+        self.assertIsNone(self.stats.summary(scope_name='missing'))
+
+    def test_nested_scopes(self):
+        with Scope('outer', stats=self.stats) as outer:
+            self.engine.execute('SELECT 1')
+            with Scope('inner', stats=self.stats) as inner:
+                self.engine.execute('SELECT 2')
+            self.engine.execute('SELECT 3')
+        self.assertEqual(outer.table.count, 2)
+        self.assertEqual(inner.table.count, 1)
@@ -0,0 +1,116 @@
+import datetime
+import itertools
+import unittest
+
+from ooi_data.postgres import model
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_status.status_message import StatusEnum
+from ooi_status.stream_cache import StreamCache, get_status, parse_payload
+
+
+class StreamCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = StreamCache(maxsize=10)
+        self.cache._put_refdes('RS01-SF01-01-CTD', 1)
+        self.cache._put_refdes('RS01-SF01-02-ADCP', 2)
+        self.cache._put_expected('ctd', 'streamed', 10, 600, 1200)
+        self.cache._put_deployed(1, 10, 100, None, None, StatusEnum.OPERATIONAL)
+        self.cache._put_deployed(2, 10, 101, 60, None, StatusEnum.FAILED)
+
+    def test_get_status(self):
+        minutes = lambda value: datetime.timedelta(minutes=value)
+        self.assertEqual(get_status(600, 1200, minutes(5)), (StatusEnum.OPERATIONAL, minutes(10)))
+        self.assertEqual(get_status(600, 1200, minutes(15)), (StatusEnum.DEGRADED, minutes(10)))
+        self.assertEqual(get_status(600, 1200, minutes(25)), (StatusEnum.FAILED, minutes(20)))
+        self.assertEqual(get_status(0, 1200, minutes(15)), (StatusEnum.OPERATIONAL, minutes(20)))
+        self.assertEqual(get_status(0, 0, minutes(25)), (StatusEnum.NOT_TRACKED, None))
+
+    def test_get_status_matches_model(self):
+        # every combination of default and override thresholds, including disabled (zero) ones
+        thresholds = [0, 600, 1200]
+        for warn, fail, warn_override, fail_override in itertools.product(thresholds, thresholds,
+                                                                          [None] + thresholds, [None] + thresholds):
+            expected = model.ExpectedStream(name='ctd', method='streamed', warn_interval=warn, fail_interval=fail)
+            deployed = model.DeployedStream(expected_stream=expected)
+            deployed._warn_interval = warn_override
+            deployed._fail_interval = fail_override
+            for minutes in (5, 15, 25):
+                elapsed = datetime.timedelta(minutes=minutes)
+                self.assertEqual(get_status(deployed.warn_interval, deployed.fail_interval, elapsed),
+                                 deployed.get_status(elapsed), (warn, fail, warn_override, fail_override, minutes))
+
+    def test_parse_payload(self):
+        self.assertEqual(parse_payload('deployed_stream:12'), ('deployed_stream', 12))
+        self.assertIsNone(parse_payload('stream_metadata:12'))
+        self.assertIsNone(parse_payload('deployed_stream:'))
+
+    def test_overrides(self):
+        # cached entries are resolved without touching the session
+        ctd = self.cache.get(None, 'RS01-SF01-01-CTD', 'ctd', 'streamed')
+        adcp = self.cache.get(None, 'RS01-SF01-02-ADCP', 'ctd', 'streamed')
+        self.assertEqual((ctd.deployed_id, ctd.warn_interval, ctd.fail_interval), (100, 600, 1200))
+        self.assertEqual((adcp.deployed_id, adcp.warn_interval, adcp.fail_interval), (101, 60, 1200))
+        self.assertEqual(sorted(key for key, _ in self.cache.entries()),
+                         [('RS01-SF01-01-CTD', 'ctd', 'streamed'), ('RS01-SF01-02-ADCP', 'ctd', 'streamed')])
+
+    def test_invalidate(self):
+        self.cache.on_notify({('deployed_stream', 100)})
+        self.assertEqual(len(self.cache), 1)
+        self.cache.on_notify({('reference_designator', 2)})
+        self.assertEqual(len(self.cache), 0)
+        self.assertNotIn('RS01-SF01-02-ADCP', self.cache.refdes)
+        self.cache.on_notify({('expected_stream', 10)})
+        self.assertEqual(self.cache.expected, {})
+        self.cache.on_notify(None)
+        self.assertEqual(self.cache.refdes, {})
+
+
+class StreamCacheTransactionTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        model.create_database(engine)
+        self.session = sessionmaker(bind=engine, autocommit=True)()
+        self.cache = StreamCache()
+
+    def test_rollback(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.session.begin():
+                info = self.cache.get(self.session, 'RS01-SF01-01-CTD', 'ctd', 'streamed')
+                # repeated lookups in the same transaction are served from the pending entries
+                self.assertEqual(self.cache.get(self.session, 'RS01-SF01-01-CTD', 'ctd', 'streamed'), info)
+                self.assertEqual(len(self.cache), 0)
+                1 / 0
+        # the rolled back ids are not cached
+        self.assertEqual((len(self.cache), self.cache.refdes, self.cache.expected), (0, {}, {}))
+
+        info = self.cache.get(self.session, 'RS01-SF01-01-CTD', 'ctd', 'streamed')
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.refdes, {'RS01-SF01-01-CTD': info.refdes_id})
+
+        with self.assertRaises(ZeroDivisionError):
+            with self.session.begin():
+                self.cache.set_statuses(self.session, [(info, StatusEnum.FAILED)], datetime.datetime.utcnow())
+                1 / 0
+        self.assertEqual(self.cache.get(self.session, 'RS01-SF01-01-CTD', 'ctd', 'streamed').status, info.status)
+
+        with self.session.begin():
+            self.cache.set_statuses(self.session, [(info, StatusEnum.FAILED)], datetime.datetime.utcnow())
+            self.assertEqual(self.cache.get(self.session, 'RS01-SF01-01-CTD', 'ctd', 'streamed').status, info.status)
+        self.assertEqual(self.cache.get(self.session, 'RS01-SF01-01-CTD', 'ctd', 'streamed').status, StatusEnum.FAILED)
+
+    def test_deleted_stream(self):
+        info = self.cache.get(self.session, 'RS01-SF01-01-CTD', 'ctd', 'streamed')
+        with self.session.begin():
+            self.session.query(model.DeployedStream).delete()
+
+        # the update matches no row, the entry is dropped and recreated by the next lookup
+        with self.session.begin():
+            gone = self.cache.set_statuses(self.session, [(info, StatusEnum.FAILED)], datetime.datetime.utcnow())
+        self.assertEqual(gone, [info])
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.refdes, {'RS01-SF01-01-CTD': info.refdes_id})
+        self.cache.get(self.session, 'RS01-SF01-01-CTD', 'ctd', 'streamed')
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.session.query(model.DeployedStream).count(), 1)